@@ -4,14 +4,15 @@ import sys
 from argparse import RawTextHelpFormatter
 from os.path import isdir
 
-from dejavu import Dejavu
+from dejavu import Dejavu, LegacyFingerprintsError
+from dejavu.logic.ingest_job import IngestJob
 from dejavu.logic.recognizer.file_recognizer import FileRecognizer
 from dejavu.logic.recognizer.microphone_recognizer import MicrophoneRecognizer
 
 DEFAULT_CONFIG_FILE = "dejavu.cnf.SAMPLE"
 
 
-def init(configpath):
+def init(configpath, migrate=False):
     """
     Load config from a JSON file
     """
@@ -23,7 +24,11 @@ def init(configpath):
         sys.exit(1)
 
     # create a Dejavu instance
-    return Dejavu(config)
+    try:
+        return Dejavu(config, migrate=migrate)
+    except LegacyFingerprintsError as err:
+        print(f"{str(err)} Exiting")
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -39,15 +44,37 @@ if __name__ == '__main__':
                              'Usages: \n'
                              '--fingerprint /path/to/directory extension\n'
                              '--fingerprint /path/to/directory')
+    parser.add_argument('-j', '--job', nargs='?',
+                        help='Path to the manifest of a bulk ingestion job, used with --fingerprint on a\n'
+                             'directory. An interrupted import started with the same manifest\n'
+                             'continues where it stopped.\n'
+                             'Usage: \n'
+                             '--fingerprint /path/to/directory extension --job /path/to/manifest.json\n')
+    parser.add_argument('-b', '--bulk', action='store_true',
+                        help='Bulk ingestion, used with --fingerprint on a directory. The fingerprints\n'
+                             'indexes are dropped while the files are stored and built again at the end,\n'
+                             'running it again finishes an interrupted one.\n'
+                             'Usage: \n'
+                             '--fingerprint /path/to/directory extension --bulk\n')
     parser.add_argument('-r', '--recognize', nargs=2,
                         help='Recognize what is '
                              'playing through the microphone or in a file.\n'
                              'Usage: \n'
                              '--recognize mic number_of_seconds \n'
                              '--recognize file path/to/file \n')
+    parser.add_argument('-m', '--migrate', nargs=2,
+                        help='Convert a database fingerprinted with the legacy sha1 hashes\n'
+                             'by fingerprinting again the source files in a directory.\n'
+                             'Usage: \n'
+                             '--migrate /path/to/directory extension\n')
+    parser.add_argument('-d', '--dedupe', action='store_true',
+                        help='Delete the songs fingerprinted from the same file as another song, kept by\n'
+                             'databases created before the file sha1 was unique, and create its index.\n'
+                             'Usage: \n'
+                             '--dedupe\n')
     args = parser.parse_args()
 
-    if not args.fingerprint and not args.recognize:
+    if not args.fingerprint and not args.recognize and not args.migrate and not args.dedupe:
         parser.print_help()
         sys.exit(0)
 
@@ -55,14 +82,18 @@ if __name__ == '__main__':
     if config_file is None:
         config_file = DEFAULT_CONFIG_FILE
 
-    djv = init(config_file)
+    djv = init(config_file, migrate=bool(args.migrate))
+    if args.dedupe:
+        print(f"Deleted {djv.delete_duplicated_songs()} songs fingerprinted from the same file as another song")
+
     if args.fingerprint:
         # Fingerprint all files in a directory
         if len(args.fingerprint) == 2:
             directory = args.fingerprint[0]
             extension = args.fingerprint[1]
             print(f"Fingerprinting all .{extension} files in the {directory} directory")
-            djv.fingerprint_directory(directory, ["." + extension], 4)
+            job = IngestJob(args.job) if args.job else None
+            djv.fingerprint_directory(directory, ["." + extension], 4, job=job, bulk_ingest=args.bulk)
 
         elif len(args.fingerprint) == 1:
             filepath = args.fingerprint[0]
@@ -71,6 +102,11 @@ if __name__ == '__main__':
                 sys.exit(1)
             djv.fingerprint_file(filepath)
 
+    elif args.migrate:
+        directory, extension = args.migrate
+        print(f"Migrating fingerprints using the .{extension} files in the {directory} directory")
+        djv.migrate_fingerprints(directory, ["." + extension], 4)
+
     elif args.recognize:
         # Recognize audio source
         songs = None
@@ -1,25 +1,49 @@
 import multiprocessing
 import os
+import queue
 import sys
+import threading
 import traceback
-from itertools import groupby
 from time import time
-from typing import Dict, List, Tuple
+from typing import Container, Dict, Iterable, Iterator, List, Set, Tuple
+
+import numpy as np
 
 import dejavu.logic.decoder as decoder
 from dejavu.base_classes.base_database import get_database
-from dejavu.config.settings import (DEFAULT_FS, DEFAULT_OVERLAP_RATIO,
+from dejavu.config.settings import (DB_WRITE_QUEUE_SIZE, DB_WRITER_THREADS,
+                                    DEFAULT_CHANNEL_STRATEGY, DEFAULT_FS,
+                                    DEFAULT_OVERLAP_RATIO,
                                     DEFAULT_WINDOW_SIZE, FIELD_FILE_SHA1,
-                                    FIELD_TOTAL_HASHES,
+                                    FIELD_SONG_ID, FIELD_TOTAL_HASHES,
+                                    FINGERPRINT_CACHE_MAX_SIZE,
                                     FINGERPRINTED_CONFIDENCE,
                                     FINGERPRINTED_HASHES, HASHES_MATCHED,
                                     INPUT_CONFIDENCE, INPUT_HASHES, OFFSET,
-                                    OFFSET_SECS, SONG_ID, SONG_NAME, TOPN)
-from dejavu.logic.fingerprint import fingerprint
+                                    OFFSET_SECS, SONG_CACHE_SIZE, SONG_ID,
+                                    SONG_NAME, TOPN)
+from dejavu.logic.file_index import FileIndex
+from dejavu.logic.fingerprint import (fft_window, fingerprint,
+                                      fingerprint_batch, fingerprints_array,
+                                      get_fingerprint_profile,
+                                      iter_fingerprints)
+from dejavu.logic.fingerprint_cache import (FingerprintCache,
+                                            fingerprint_version)
+from dejavu.logic.ingest_job import IngestJob
+from dejavu.logic.song_cache import SongCache
+from dejavu.logic.song_registry import SongRegistry
 
 
 class Dejavu:
-    def __init__(self, config):
+    # sha1 of the files fingerprint workers skip, see _init_fingerprint_worker.
+    _skip_hashes = frozenset()
+
+    def __init__(self, config, migrate: bool = False):
+        """
+        :param config: configuration dictionary, see the README.
+        :param migrate: whether a database fingerprinted with the legacy sha1 hashes is accepted, only
+         to convert it with migrate_fingerprints.
+        """
         self.config = config
 
         # initialize db
@@ -28,24 +52,55 @@ class Dejavu:
         self.db = db_cls(**config.get("database", {}))
         self.db.setup()
 
+        # packed integer hashes can neither be stored nor matched in a legacy table, see migrate_fingerprints.
+        if not migrate and self.db.has_legacy_fingerprints_table():
+            raise LegacyFingerprintsError()
+
         # if we should limit seconds fingerprinted,
         # None|-1 means use entire track
         self.limit = self.config.get("fingerprint_limit", None)
         if self.limit == -1:  # for JSON compatibility
             self.limit = None
-        self.__load_fingerprinted_audio_hashes()
 
-    def __load_fingerprinted_audio_hashes(self) -> None:
+        # fingerprint parameters, see FINGERPRINT_PROFILES in the settings.
+        self.fingerprint_params = get_fingerprint_profile(self.config.get("fingerprint_profile", "default"))
+
+        # how multichannel audio is fingerprinted, see DEFAULT_CHANNEL_STRATEGY in the settings.
+        self.channel_strategy = self.config.get("channels", DEFAULT_CHANNEL_STRATEGY)
+
+        # optional on disk cache of file fingerprints, shared by fingerprinting and file recognition.
+        cache_config = self.config.get("fingerprint_cache", None)
+        self.fingerprint_cache = None
+        if cache_config:
+            self.fingerprint_cache = FingerprintCache(
+                cache_config["directory"],
+                fingerprint_version(self.fingerprint_params, self.channel_strategy, self.limit),
+                cache_config.get("max_size", FINGERPRINT_CACHE_MAX_SIZE)
+            )
+
+        # optional manifest of the files already seen, so unchanged files are skipped without hashing them.
+        index_path = self.config.get("file_index", None)
+        self.file_index = FileIndex(index_path) if index_path else None
+
+        # songs recognition results are built with, so recognizing does not query them every time.
+        self.song_cache = SongCache(self.config.get("song_cache_size", SONG_CACHE_SIZE))
+
+        # fingerprinted songs by file sha1, to know which files were already processed. Loaded lazily.
+        self.song_registry = SongRegistry(self.db)
+
+        # whether fingerprints are stored with the bulk loader of the database, see CommonDatabase.load_hashes.
+        self.bulk_load = self.config.get("bulk_load", False)
+
+    def __worker_arguments(self, filenames: Iterable[str])\
+            -> Iterator[Tuple[str, int, Dict[str, any], str, FingerprintCache]]:
         """
-        Keeps a dictionary with the hashes of the fingerprinted songs, in that way is possible to check
-        whether or not an audio file was already processed.
+        Builds the _fingerprint_worker arguments for each file, so they are fingerprinted with this instance settings.
+
+        :param filenames: files to be fingerprinted.
+        :return: a generator of argument tuples, one per file.
         """
-        # get songs previously indexed
-        self.songs = self.db.get_songs()
-        self.songhashes_set = set()  # to know which ones we've computed before
-        for song in self.songs:
-            song_hash = song[FIELD_FILE_SHA1]
-            self.songhashes_set.add(song_hash)
+        return ((filename, self.limit, self.fingerprint_params, self.channel_strategy, self.fingerprint_cache)
+                for filename in filenames)
 
     def get_fingerprinted_songs(self) -> List[Dict[str, any]]:
         """
@@ -62,44 +117,277 @@ class Dejavu:
         :param song_ids: song ids to delete from the database.
         """
         self.db.delete_songs_by_id(song_ids)
+        self.song_cache.invalidate(song_ids)
+        self.song_registry.remove(song_ids)
 
-    def fingerprint_directory(self, path: str, extensions: str, nprocesses: int = None) -> None:
+    def delete_duplicated_songs(self) -> int:
+        """
+        Deletes the songs fingerprinted from the same file as another song, so the unique file sha1 index can
+        be created. See CommonDatabase.delete_duplicated_songs.
+
+        :return: the amount of songs deleted.
+        """
+        deleted = self.db.delete_duplicated_songs()
+        self.song_cache.clear()
+        self.song_registry = SongRegistry(self.db)
+        return deleted
+
+    def get_songs_by_ids(self, song_ids: List[int]) -> Dict[int, Dict[str, any]]:
+        """
+        Gets the info of several songs, from the song cache when possible and with a single query for the others.
+
+        :param song_ids: song identifiers.
+        :return: a dictionary with the songs info by song id, missing songs are left out.
+        """
+        songs, missing = self.song_cache.get(song_ids)
+        if missing:
+            loaded = {song[FIELD_SONG_ID]: song for song in self.db.get_songs_by_ids(missing)}
+            self.song_cache.put(loaded)
+            songs.update(loaded)
+
+        return songs
+
+    def fingerprint_directory(self, path: str, extensions: str, nprocesses: int = None,
+                              job: IngestJob = None, bulk_ingest: bool = False) -> None:
         """
         Given a directory and a set of extensions it fingerprints all files that match each extension specified.
 
         :param path: path to the directory.
         :param extensions: list of file extensions to consider.
         :param nprocesses: amount of processes to fingerprint the files within the directory.
+        :param job: ingest job recording the progress of every file, so an interrupted run resumes from it.
+        :param bulk_ingest: whether the fingerprints indexes are only built once all files are stored,
+         see CommonDatabase.begin_bulk_ingest. Worth it when the files add many fingerprints to the table.
         """
-        # Try to use the maximum amount of processes if not given.
+        nprocesses = Dejavu.__pool_size(nprocesses)
+
+        # don't refingerprint already fingerprinted files, workers check it while reading each file
+        # so files are read only once.
+        pool = multiprocessing.Pool(nprocesses, initializer=Dejavu._init_fingerprint_worker,
+                                    initargs=(self.song_registry.hashes(),))
+
+        signatures = {}
+        # files sent to the pool and not taken out of it yet, so the pool stops reading new files while
+        # the writers are behind instead of piling up fingerprints.
+        in_flight = threading.Semaphore(2 * nprocesses)
+        stopped = threading.Event()
+
+        def filenames_to_fingerprint() -> Iterator[str]:
+            for filename, _ in decoder.find_files(path, extensions):
+                if job and not job.pending(filename):
+                    continue
+
+                if self.file_index:
+                    # unchanged files whose song is still in the database are skipped without reading them.
+                    entry, signatures[filename] = self.file_index.lookup(filename)
+                    if entry and entry["sha1"] in self.song_registry:
+                        print(f"{filename} already fingerprinted, continuing...")
+                        if job:
+                            job.done(filename, entry["sha1"], entry["song_id"])
+                        continue
+
+                in_flight.acquire()
+                if stopped.is_set():
+                    return
+                if job:
+                    job.start(filename)
+                yield filename
+
+        # Prepare _fingerprint_worker input, the files are sent to the pool as the directory is walked.
+        worker_input = self.__worker_arguments(filenames_to_fingerprint())
+
+        # Send off our tasks
+        iterator = pool.imap_unordered(Dejavu._fingerprint_worker, worker_input)
+
+        # fingerprints are stored by writer threads, each query opening its own connection, while
+        # the pool keeps fingerprinting.
+        results = queue.Queue(maxsize=DB_WRITE_QUEUE_SIZE)
+        writers = [threading.Thread(target=self.__db_writer, args=(results, signatures, job), daemon=True)
+                   for _ in range(DB_WRITER_THREADS)]
+        for writer in writers:
+            writer.start()
+
+        # copies of the same file fingerprinted in this run are only inserted once, those whose
+        # song is still being written are indexed once the writers are done.
+        queued_hashes = set()
+        copies = []
+
+        # Loop till we have all of them
         try:
-            nprocesses = nprocesses or multiprocessing.cpu_count()
-        except NotImplementedError:
-            nprocesses = 1
-        else:
-            nprocesses = 1 if nprocesses <= 0 else nprocesses
+            if bulk_ingest:
+                self.db.begin_bulk_ingest()
+
+            while True:
+                try:
+                    song_name, hashes, file_hash, file_name = next(iterator)
+                except multiprocessing.TimeoutError:
+                    continue
+                except StopIteration:
+                    break
+                except Exception as e:
+                    in_flight.release()
+                    print("Failed fingerprinting")
+                    # Print traceback because we can't reraise it here
+                    traceback.print_exc(file=sys.stdout)
+                    if job and isinstance(e, FingerprintError):
+                        job.fail(e.file_name, e.message)
+                else:
+                    in_flight.release()
+                    if hashes is None or file_hash in queued_hashes or file_hash in self.song_registry:
+                        print(f"{song_name} already fingerprinted, continuing...")
+                        copies.append((file_name, file_hash))
+                    else:
+                        queued_hashes.add(file_hash)
+                        # blocks while the writers are behind.
+                        results.put((song_name, hashes, file_hash, file_name))
+        except BaseException:
+            # unblock the walk so the pool can be terminated.
+            stopped.set()
+            in_flight.release(2 * nprocesses)
+            pool.terminate()
+            raise
+        finally:
+            try:
+                # flush what is left in the queue before stopping the writers.
+                for _ in writers:
+                    results.put(None)
+                for writer in writers:
+                    writer.join()
+            finally:
+                for file_name, file_hash in copies:
+                    sid = self.song_registry.get(file_hash)
+                    if self.file_index:
+                        self.file_index.update(file_name, signatures[file_name], file_hash, sid)
+                    if job:
+                        job.done(file_name, file_hash, sid)
+
+                if self.file_index:
+                    self.file_index.save()
+                if job:
+                    job.save()
+                    print(f"Ingest job: {job.summary()}")
+
+                # also when interrupted, the fingerprints stored so far are indexed.
+                if bulk_ingest:
+                    print("Building fingerprints indexes...")
+                    self.db.end_bulk_ingest()
 
-        pool = multiprocessing.Pool(nprocesses)
+        pool.close()
+        pool.join()
 
-        filenames_to_fingerprint = []
-        for filename, _ in decoder.find_files(path, extensions):
-            # don't refingerprint already fingerprinted files
-            if decoder.unique_hash(filename) in self.songhashes_set:
-                print(f"{filename} already fingerprinted, continuing...")
+    def __db_writer(self, results: queue.Queue, signatures: Dict[str, Dict[str, int]], job: IngestJob) -> None:
+        """
+        Stores the fingerprints of the files taken from the queue, until it gets None.
+
+        :param results: queue of (song_name, hashes, file_hash, file_name) tuples.
+        :param signatures: file index signatures of the files, see FileIndex.lookup.
+        :param job: ingest job of the files, None if there is none.
+        """
+        while True:
+            result = results.get()
+            if result is None:
+                return
+
+            song_name, hashes, file_hash, file_name = result
+            try:
+                sid = self.__store_song(song_name, file_hash, hashes)
+            except Exception as e:
+                print(f"Failed storing {song_name}")
+                traceback.print_exc(file=sys.stdout)
+                if job:
+                    job.fail(file_name, f"{type(e).__name__}: {e}")
                 continue
 
-            filenames_to_fingerprint.append(filename)
+            if self.file_index:
+                self.file_index.update(file_name, signatures[file_name], file_hash, sid)
+            if job:
+                job.done(file_name, file_hash, sid)
 
-        # Prepare _fingerprint_worker input
-        worker_input = list(zip(filenames_to_fingerprint, [self.limit] * len(filenames_to_fingerprint)))
+    def __store_song(self, song_name: str, file_hash: str, hashes: Set[Tuple[int, int]]) -> int:
+        """
+        Inserts a song with its fingerprints and registers it.
 
-        # Send off our tasks
+        :param song_name: song name associated to the audio file.
+        :param file_hash: sha1 of the file content.
+        :param hashes: hashes with their corresponding offsets, or an array of (hash, offset) rows.
+        :return: the song identifier.
+        """
+        sid = self.db.insert_song(song_name, file_hash, len(hashes))
+        self.song_cache.invalidate([sid])
+
+        try:
+            self.__insert_hashes(sid, hashes)
+            self.db.set_song_fingerprinted(sid)
+        except Exception:
+            # the sha1 is unique, a partial song row left behind would make every retry of the file fail.
+            self.db.delete_songs_by_id([sid])
+            raise
+        self.song_registry.add(file_hash, sid)
+
+        return sid
+
+    def __insert_hashes(self, song_id: int, hashes: Set[Tuple[int, int]]) -> None:
+        """
+        Stores the fingerprints of a song, bulk loading them if enabled.
+
+        :param song_id: song identifier.
+        :param hashes: hashes with their corresponding offsets, or an array of (hash, offset) rows.
+        """
+        if self.bulk_load:
+            self.db.load_hashes(song_id, hashes)
+        else:
+            self.db.insert_hashes(song_id, hashes)
+
+    def migrate_fingerprints(self, path: str, extensions: str, nprocesses: int = None,
+                             delete_missing: bool = False) -> None:
+        """
+        Moves a database fingerprinted with the legacy sha1 hashes to the packed integer ones. The fingerprints
+        table is converted in place and the songs are fingerprinted again from their source files, which are
+        looked up in the given directory by their sha1. It can be run again to resume an interrupted migration.
+
+        :param path: path to the directory with the source audio files.
+        :param extensions: list of file extensions to consider.
+        :param nprocesses: amount of processes to fingerprint the files within the directory.
+        :param delete_missing: whether to delete the songs whose source file was not found.
+        """
+        legacy = self.db.has_legacy_fingerprints_table()
+
+        # a legacy table still holds the old fingerprints of every song, they are all migrated.
+        songs = self.db.get_songs() if legacy else self.db.get_songs_without_fingerprints()
+        pending = {song[FIELD_FILE_SHA1]: song for song in songs}
+        print(f"{len(pending)} songs need to be fingerprinted again.")
+
+        # keep a single source file per song, copies of the same file share the same sha1.
+        sources = {}
+        for filename, _ in decoder.find_files(path, extensions):
+            file_hash = decoder.unique_hash(filename)
+            if file_hash in pending:
+                sources.setdefault(file_hash, filename)
+
+        missing = [song for file_hash, song in pending.items() if file_hash not in sources]
+        if missing:
+            print(f"Source files not found for {len(missing)} songs: "
+                  f"{', '.join(song[SONG_NAME] for song in missing)}")
+            # the legacy fingerprints are dropped by the conversion, so it only goes ahead once every
+            # song can be fingerprinted again or the songs left without a source may be deleted.
+            if legacy and not delete_missing:
+                print("Fingerprints table not converted, find the missing files or pass delete_missing.")
+                return
+            if delete_missing:
+                self.delete_songs_by_id([song[FIELD_SONG_ID] for song in missing])
+
+        if self.db.convert_fingerprints_table():
+            print("Fingerprints table converted to packed integer hashes.")
+
+        nprocesses = Dejavu.__pool_size(nprocesses)
+        pool = multiprocessing.Pool(nprocesses)
+
+        worker_input = self.__worker_arguments(list(sources.values()))
         iterator = pool.imap_unordered(Dejavu._fingerprint_worker, worker_input)
 
-        # Loop till we have all of them
         while True:
             try:
-                song_name, hashes, file_hash = next(iterator)
+                song_name, hashes, file_hash, _ = next(iterator)
             except multiprocessing.TimeoutError:
                 continue
             except StopIteration:
@@ -109,11 +397,11 @@ class Dejavu:
                 # Print traceback because we can't reraise it here
                 traceback.print_exc(file=sys.stdout)
             else:
-                sid = self.db.insert_song(song_name, file_hash, len(hashes))
-
-                self.db.insert_hashes(sid, hashes)
-                self.db.set_song_fingerprinted(sid)
-                self.__load_fingerprinted_audio_hashes()
+                song = pending[file_hash]
+                self.__insert_hashes(song[FIELD_SONG_ID], hashes)
+                self.db.set_song_total_hashes(song[FIELD_SONG_ID], len(hashes))
+                self.song_cache.invalidate([song[FIELD_SONG_ID]])
+                print(f"{song[SONG_NAME]} migrated.")
 
         pool.close()
         pool.join()
@@ -126,25 +414,30 @@ class Dejavu:
         :param file_path: path to the file.
         :param song_name: song name associated to the audio file.
         """
-        song_name_from_path = decoder.get_audio_name_from_path(file_path)
-        song_hash = decoder.unique_hash(file_path)
-        song_name = song_name or song_name_from_path
+        song_name = song_name or decoder.get_audio_name_from_path(file_path)
+
+        entry, signature = self.file_index.lookup(file_path) if self.file_index else (None, None)
+        if entry and entry["sha1"] in self.song_registry:
+            print(f"{song_name} already fingerprinted, continuing...")
+            return
+
+        hashes, file_hash = Dejavu.get_file_fingerprints(file_path, self.limit, print_output=True,
+                                                         fingerprint_params=self.fingerprint_params,
+                                                         channel_strategy=self.channel_strategy,
+                                                         fingerprint_cache=self.fingerprint_cache,
+                                                         skip_hashes=self.song_registry)
         # don't refingerprint already fingerprinted files
-        if song_hash in self.songhashes_set:
+        if hashes is None:
             print(f"{song_name} already fingerprinted, continuing...")
+            sid = self.song_registry.get(file_hash)
         else:
-            song_name, hashes, file_hash = Dejavu._fingerprint_worker(
-                file_path,
-                self.limit,
-                song_name=song_name
-            )
-            sid = self.db.insert_song(song_name, file_hash)
+            sid = self.__store_song(song_name, file_hash, hashes)
 
-            self.db.insert_hashes(sid, hashes)
-            self.db.set_song_fingerprinted(sid)
-            self.__load_fingerprinted_audio_hashes()
+        if self.file_index:
+            self.file_index.update(file_path, signature, file_hash, sid)
+            self.file_index.save()
 
-    def generate_fingerprints(self, samples: List[int], Fs=DEFAULT_FS) -> Tuple[List[Tuple[str, int]], float]:
+    def generate_fingerprints(self, samples: List[int], Fs=DEFAULT_FS) -> Tuple[List[Tuple[int, int]], float]:
         f"""
         Generate the fingerprints for the given sample data (channel).
 
@@ -153,16 +446,31 @@ class Dejavu:
         :return: a list of tuples for hash and its corresponding offset, together with the generation time.
         """
         t = time()
-        hashes = fingerprint(samples, Fs=Fs)
+        hashes = fingerprint(samples, Fs=Fs, **self.fingerprint_params)
+        fingerprint_time = time() - t
+        return hashes, fingerprint_time
+
+    def generate_fingerprints_batch(self, clips: List[List[int]], Fs=DEFAULT_FS)\
+            -> Tuple[List[List[Tuple[int, int]]], float]:
+        f"""
+        Generate the fingerprints for several channels at once, see fingerprint_batch.
+
+        :param clips: list with the channel samples of every clip.
+        :param Fs: sampling rate of the clips, which defaults to {DEFAULT_FS}.
+        :return: a list with the hashes and offsets of every clip, together with the generation time.
+        """
+        t = time()
+        hashes = fingerprint_batch(clips, Fs=Fs, **self.fingerprint_params)
         fingerprint_time = time() - t
         return hashes, fingerprint_time
 
-    def find_matches(self, hashes: List[Tuple[str, int]]) -> Tuple[List[Tuple[int, int]], Dict[str, int], float]:
+    def find_matches(self, hashes: List[Tuple[int, int]]) -> Tuple[np.ndarray, Dict[str, int], float]:
         """
         Finds the corresponding matches on the fingerprinted audios for the given hashes.
 
         :param hashes: list of tuples for hashes and their corresponding offsets
-        :return: a tuple containing the matches found against the db, a dictionary which counts the different
+        :return: a tuple containing the matches found against the db (an array of (sid, offset_difference)
+         rows), a dictionary which counts the different
          hashes matched for each song (with the song id as key), and the time that the query took.
 
         """
@@ -172,34 +480,35 @@ class Dejavu:
 
         return matches, dedup_hashes, query_time
 
-    def align_matches(self, matches: List[Tuple[int, int]], dedup_hashes: Dict[str, int], queried_hashes: int,
+    def align_matches(self, matches: np.ndarray, dedup_hashes: Dict[str, int], queried_hashes: int,
                       topn: int = TOPN) -> List[Dict[str, any]]:
         """
         Finds hash matches that align in time with other matches and finds
         consensus about which hashes are "true" signal from the audio.
 
-        :param matches: matches from the database
+        :param matches: matches from the database, (sid, offset_difference) rows.
         :param dedup_hashes: dictionary containing the hashes matched without duplicates for each song
         (key is the song id).
         :param queried_hashes: amount of hashes sent for matching against the db
         :param topn: number of results being returned back.
         :return: a list of dictionaries (based on topn) with match information.
         """
-        # count offset occurrences per song and keep only the maximum ones.
-        sorted_matches = sorted(matches, key=lambda m: (m[0], m[1]))
-        counts = [(*key, len(list(group))) for key, group in groupby(sorted_matches, key=lambda m: (m[0], m[1]))]
-        songs_matches = sorted(
-            [max(list(group), key=lambda g: g[2]) for key, group in groupby(counts, key=lambda count: count[0])],
-            key=lambda count: count[2], reverse=True
-        )
+        songs_matches = self.top_alignments(matches, topn)
+
+        # offsets are counted in spectrogram frames of the fingerprint profile.
+        _, hop = fft_window(self.fingerprint_params.get("wsize", DEFAULT_WINDOW_SIZE),
+                            self.fingerprint_params.get("wratio", DEFAULT_OVERLAP_RATIO))
+        frame_seconds = hop / (self.fingerprint_params.get("target_fs") or DEFAULT_FS)
+
+        songs = self.get_songs_by_ids([song_id for song_id, _ in songs_matches])
 
         songs_result = []
-        for song_id, offset, _ in songs_matches[0:topn]:  # consider topn elements in the result
-            song = self.db.get_song_by_id(song_id)
+        for song_id, offset in songs_matches:
+            song = songs[song_id]
 
             song_name = song.get(SONG_NAME, None)
             song_hashes = song.get(FIELD_TOTAL_HASHES, None)
-            nseconds = round(float(offset) / DEFAULT_FS * DEFAULT_WINDOW_SIZE * DEFAULT_OVERLAP_RATIO, 5)
+            nseconds = round(float(offset) * frame_seconds, 5)
             hashes_matched = dedup_hashes[song_id]
 
             song = {
@@ -221,39 +530,151 @@ class Dejavu:
 
         return songs_result
 
+    @staticmethod
+    def top_alignments(matches: np.ndarray, topn: int = TOPN) -> List[Tuple[int, int]]:
+        """
+        Finds the offset difference most matches agree on for each song, and the songs with the most
+        aligned matches.
+
+        :param matches: matches from the database, (sid, offset_difference) rows.
+        :param topn: number of songs being returned back.
+        :return: a list of (sid, offset_difference) tuples, the most aligned song first and ties by song id.
+        """
+        matches = np.asarray(matches, dtype=np.int64).reshape(-1, 2)
+        if len(matches) == 0:
+            return []
+
+        # count offset occurrences per song on a combined (song, offset) key.
+        min_offset = matches[:, 1].min()
+        span = int(matches[:, 1].max() - min_offset) + 1
+        keys, counts = np.unique(matches[:, 0] * span + (matches[:, 1] - min_offset), return_counts=True)
+        song_ids, offsets = keys // span, keys % span + min_offset
+
+        # keep only the maximum count of each song, the earliest offset on ties.
+        order = np.lexsort((offsets, -counts, song_ids))
+        best = order[np.r_[True, song_ids[order][1:] != song_ids[order][:-1]]]
+        song_ids, offsets, counts = song_ids[best], offsets[best], counts[best]
+
+        # consider topn songs in the result, those sharing the count of the last one are all candidates
+        # so ties are broken by song id.
+        if 0 < topn < len(counts):
+            threshold = counts[np.argpartition(-counts, topn - 1)[topn - 1]]
+            candidates = np.flatnonzero(counts >= threshold)
+        else:
+            candidates = np.arange(len(counts))
+        candidates = candidates[np.lexsort((song_ids[candidates], -counts[candidates]))][:topn]
+        return list(zip(song_ids[candidates].tolist(), offsets[candidates].tolist()))
+
     def recognize(self, recognizer, *options, **kwoptions) -> Dict[str, any]:
         r = recognizer(self)
         return r.recognize(*options, **kwoptions)
 
+    @staticmethod
+    def __pool_size(nprocesses: int = None) -> int:
+        """
+        Tells how many processes to fingerprint files with, using the maximum amount of processes if not given.
+
+        :param nprocesses: requested amount of processes.
+        :return: the amount of processes for the pool.
+        """
+        try:
+            nprocesses = nprocesses or multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+
+        return 1 if nprocesses <= 0 else nprocesses
+
+    @staticmethod
+    def _init_fingerprint_worker(skip_hashes: Set[str]) -> None:
+        # the set is sent once per worker process instead of once per file.
+        Dejavu._skip_hashes = skip_hashes
+
     @staticmethod
     def _fingerprint_worker(arguments):
         # Pool.imap sends arguments as tuples so we have to unpack
         # them ourself.
         try:
-            file_name, limit = arguments
+            file_name, limit, fingerprint_params, channel_strategy, fingerprint_cache = arguments
         except ValueError:
             pass
 
         song_name, extension = os.path.splitext(os.path.basename(file_name))
 
-        fingerprints, file_hash = Dejavu.get_file_fingerprints(file_name, limit, print_output=True)
+        try:
+            fingerprints, file_hash = Dejavu.get_file_fingerprints(file_name, limit, print_output=True,
+                                                                   fingerprint_params=fingerprint_params,
+                                                                   channel_strategy=channel_strategy,
+                                                                   fingerprint_cache=fingerprint_cache,
+                                                                   skip_hashes=Dejavu._skip_hashes)
+        except Exception as e:
+            # the pool gives back the exception alone, it has to tell which file failed.
+            raise FingerprintError(file_name, f"{type(e).__name__}: {e}") from e
 
-        return song_name, fingerprints, file_hash
+        # sent back to the parent as a single array, unpickling a set builds an object per hash.
+        if fingerprints is not None:
+            fingerprints = fingerprints_array(fingerprints)
+
+        return song_name, fingerprints, file_hash, file_name
 
     @staticmethod
-    def get_file_fingerprints(file_name: str, limit: int, print_output: bool = False):
-        channels, fs, file_hash = decoder.read(file_name, limit)
+    def get_file_fingerprints(file_name: str, limit: int, print_output: bool = False,
+                              fingerprint_params: Dict[str, any] = None,
+                              channel_strategy: str = DEFAULT_CHANNEL_STRATEGY,
+                              fingerprint_cache: FingerprintCache = None,
+                              skip_hashes: Container[str] = None):
+        # the file is read once, the same bytes are hashed and decoded.
+        with decoder.map_file(file_name) as data:
+            file_hash = decoder.buffer_hash(data)
+            if skip_hashes and file_hash in skip_hashes:
+                return None, file_hash
+
+            if fingerprint_cache:
+                fingerprints = fingerprint_cache.get(file_hash)
+                if fingerprints is not None:
+                    if print_output:
+                        print(f"Fingerprints for {file_name} found in the cache")
+                    return fingerprints, file_hash
+
+            # let the decoder resample and mix the channels already when it can.
+            channels, fs = decoder.decode(file_name, data, limit, fs=(fingerprint_params or {}).get("target_fs"),
+                                          channel_strategy=channel_strategy)
+
+        channels = decoder.select_channels(channels, channel_strategy)
         fingerprints = set()
         channel_amount = len(channels)
         for channeln, channel in enumerate(channels, start=1):
             if print_output:
                 print(f"Fingerprinting channel {channeln}/{channel_amount} for {file_name}")
 
-            hashes = fingerprint(channel, Fs=fs)
+            fingerprints.update(iter_fingerprints(channel, Fs=fs, **(fingerprint_params or {})))
 
             if print_output:
                 print(f"Finished channel {channeln}/{channel_amount} for {file_name}")
 
-            fingerprints |= set(hashes)
+        if fingerprint_cache:
+            fingerprint_cache.put(file_hash, fingerprints)
 
         return fingerprints, file_hash
+
+
+class FingerprintError(Exception):
+    """
+    Raised by the fingerprint workers when a file can not be fingerprinted.
+    """
+    def __init__(self, file_name: str, message: str):
+        super().__init__(file_name, message)
+        self.file_name = file_name
+        self.message = message
+
+    def __str__(self):
+        return f"{self.file_name}: {self.message}"
+
+
+class LegacyFingerprintsError(Exception):
+    """
+    Raised when the database still holds fingerprints with the legacy sha1 hashes.
+    """
+    def __str__(self):
+        return ("The fingerprints table holds legacy sha1 hashes, migrate it first with "
+                "`python dejavu.py --migrate /path/to/directory extension` "
+                "(or Dejavu(config, migrate=True).migrate_fingerprints).")
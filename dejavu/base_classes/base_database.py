@@ -2,6 +2,8 @@ import abc
 import importlib
 from typing import Dict, List, Tuple
 
+import numpy as np
+
 from dejavu.config.settings import DATABASES
 
 
@@ -33,6 +35,15 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         """
         pass
 
+    @abc.abstractmethod
+    def delete_duplicated_songs(self) -> int:
+        """
+        Keeps a single song per file sha1, deleting the others with their fingerprints.
+
+        :return: the amount of songs deleted.
+        """
+        pass
+
     @abc.abstractmethod
     def empty(self) -> None:
         """
@@ -95,11 +106,32 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
-    def insert(self, fingerprint: str, song_id: int, offset: int):
+    def get_song_id_by_file_hash(self, file_hash: str) -> int:
+        """
+        Looks up the fingerprinted song of a file by its sha1.
+
+        :param file_hash: sha1 of the file content.
+        :return: the song identifier, or None if the file was not fingerprinted.
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_songs_by_ids(self, song_ids: List[int], batch_size: int = 1000) -> List[Dict[str, str]]:
+        """
+        Brings the info of several songs from the database at once.
+
+        :param song_ids: song identifiers.
+        :param batch_size: number of query's batches.
+        :return: a list of dictionaries with the songs info, including their id. Missing songs are left out.
+        """
+        pass
+
+    @abc.abstractmethod
+    def insert(self, fingerprint: int, song_id: int, offset: int):
         """
         Inserts a single fingerprint into the database.
 
-        :param fingerprint: Part of a sha1 hash, in hexadecimal format
+        :param fingerprint: Landmark packed into an integer
         :param song_id: Song identifier this fingerprint is off
         :param offset: The offset this fingerprint is from.
         """
@@ -119,12 +151,12 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
-    def query(self, fingerprint: str = None) -> List[Tuple]:
+    def query(self, fingerprint: int = None) -> List[Tuple]:
         """
         Returns all matching fingerprint entries associated with
         the given hash as parameter, if None is passed it returns all entries.
 
-        :param fingerprint: part of a sha1 hash, in hexadecimal format
+        :param fingerprint: landmark packed into an integer
         :return: a list of fingerprint records stored in the db.
         """
         pass
@@ -139,28 +171,63 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
-    def insert_hashes(self, song_id: int, hashes: List[Tuple[str, int]], batch_size: int = 1000) -> None:
+    def insert_hashes(self, song_id: int, hashes: List[Tuple[int, int]], batch_size: int = 1000) -> None:
         """
         Insert a multitude of fingerprints.
 
         :param song_id: Song identifier the fingerprints belong to
-        :param hashes: A sequence of tuples in the format (hash, offset)
-            - hash: Part of a sha1 hash, in hexadecimal format
+        :param hashes: A sequence of tuples in the format (hash, offset), or an array of (hash, offset) rows
+            - hash: Landmark packed into an integer
             - offset: Offset this hash was created from/at.
         :param batch_size: insert batches.
         """
 
     @abc.abstractmethod
-    def return_matches(self, hashes: List[Tuple[str, int]], batch_size: int = 1000) \
-            -> Tuple[List[Tuple[int, int]], Dict[int, int]]:
+    def load_hashes(self, song_id: int, hashes: List[Tuple[int, int]]) -> None:
+        """
+        Bulk loads a multitude of fingerprints, with the native loader of the database.
+
+        :param song_id: Song identifier the fingerprints belong to
+        :param hashes: A sequence of tuples in the format (hash, offset), or an array of (hash, offset) rows
+            - hash: Landmark packed into an integer
+            - offset: Offset this hash was created from/at.
+        """
+        pass
+
+    @abc.abstractmethod
+    def in_bulk_ingest(self) -> bool:
+        """
+        Tells whether a bulk ingestion is open.
+
+        :return: True if begin_bulk_ingest was called and end_bulk_ingest did not finish yet.
+        """
+        pass
+
+    @abc.abstractmethod
+    def begin_bulk_ingest(self) -> None:
+        """
+        Starts a bulk ingestion, the fingerprints indexes are not maintained until it ends.
+        """
+        pass
+
+    @abc.abstractmethod
+    def end_bulk_ingest(self) -> None:
+        """
+        Ends a bulk ingestion, removing duplicated fingerprints and building the indexes again.
+        """
+        pass
+
+    @abc.abstractmethod
+    def return_matches(self, hashes: List[Tuple[int, int]], batch_size: int = 1000) \
+            -> Tuple[np.ndarray, Dict[int, int]]:
         """
         Searches the database for pairs of (hash, offset) values.
 
         :param hashes: A sequence of tuples in the format (hash, offset)
-            - hash: Part of a sha1 hash, in hexadecimal format
+            - hash: Landmark packed into an integer
             - offset: Offset this hash was created from/at.
         :param batch_size: number of query's batches.
-        :return: a list of (sid, offset_difference) tuples and a
+        :return: an integer array of (sid, offset_difference) rows and a
         dictionary with the amount of hashes matched (not considering
         duplicated hashes) in each song.
             - song id: Song identifier
@@ -168,6 +235,45 @@ class BaseDatabase(object, metaclass=abc.ABCMeta):
         """
         pass
 
+    @abc.abstractmethod
+    def has_legacy_fingerprints_table(self) -> bool:
+        """
+        Tells whether the fingerprints table was created with the legacy sha1 hash column.
+
+        :return: True if the table has to be converted, see convert_fingerprints_table.
+        """
+        pass
+
+    @abc.abstractmethod
+    def convert_fingerprints_table(self) -> bool:
+        """
+        Converts a fingerprints table created with the legacy sha1 hash column into the
+        packed integer one. Legacy fingerprints can not be converted, so they are removed
+        and the songs have to be fingerprinted again.
+
+        :return: whether the table had to be converted or not.
+        """
+        pass
+
+    @abc.abstractmethod
+    def set_song_total_hashes(self, song_id: int, total_hashes: int) -> None:
+        """
+        Updates the amount of hashes of a song, when it is fingerprinted again.
+
+        :param song_id: song identifier.
+        :param total_hashes: amount of hashes inserted on fingerprint table.
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_songs_without_fingerprints(self) -> List[Dict[str, str]]:
+        """
+        Returns all fully fingerprinted songs which do not have any fingerprint stored.
+
+        :return: a list of dictionaries with the songs info.
+        """
+        pass
+
     @abc.abstractmethod
     def delete_songs_by_id(self, song_ids: List[int], batch_size: int = 1000) -> None:
         """
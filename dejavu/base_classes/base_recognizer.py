@@ -1,10 +1,12 @@
 import abc
+from concurrent.futures import ThreadPoolExecutor
 from time import time
-from typing import Dict, List, Tuple
+from typing import Dict, List, Set, Tuple
 
 import numpy as np
 
-from dejavu.config.settings import DEFAULT_FS
+import dejavu.logic.decoder as decoder
+from dejavu.config.settings import DEFAULT_FS, MATCH_THREADS
 
 
 class BaseRecognizer(object, metaclass=abc.ABCMeta):
@@ -12,21 +14,68 @@ class BaseRecognizer(object, metaclass=abc.ABCMeta):
         self.dejavu = dejavu
         self.Fs = DEFAULT_FS
 
-    def _recognize(self, *data) -> Tuple[List[Dict[str, any]], int, int, int]:
+    def _fingerprint(self, *data) -> Tuple[Set[Tuple[int, int]], float]:
         fingerprint_times = []
         hashes = set()  # to remove possible duplicated fingerprints we built a set.
-        for channel in data:
+        for channel in decoder.select_channels(data, self.dejavu.channel_strategy):
             fingerprints, fingerprint_time = self.dejavu.generate_fingerprints(channel, Fs=self.Fs)
             fingerprint_times.append(fingerprint_time)
             hashes |= set(fingerprints)
 
+        return hashes, np.sum(fingerprint_times)
+
+    def _match(self, hashes: Set[Tuple[int, int]]) -> Tuple[List[Dict[str, any]], int, int]:
         matches, dedup_hashes, query_time = self.dejavu.find_matches(hashes)
 
         t = time()
         final_results = self.dejavu.align_matches(matches, dedup_hashes, len(hashes))
         align_time = time() - t
 
-        return final_results, np.sum(fingerprint_times), query_time, align_time
+        return final_results, query_time, align_time
+
+    def _recognize(self, *data) -> Tuple[List[Dict[str, any]], int, int, int]:
+        hashes, fingerprint_time = self._fingerprint(*data)
+        final_results, query_time, align_time = self._match(hashes)
+
+        return final_results, fingerprint_time, query_time, align_time
+
+    def _recognize_batch(self, clips: List[Tuple[List[List[int]], int]])\
+            -> List[Tuple[List[Dict[str, any]], int, int, int]]:
+        """
+        Recognizes several clips, fingerprinting the channels of all the clips sharing a sampling rate
+        in a single batch and querying their matches concurrently. The fingerprint time reported for each
+        clip is the one of its whole batch.
+
+        :param clips: list of tuples with the channels of a clip and their sampling rate.
+        :return: a list with the same results _recognize gives, one per clip.
+        """
+        hashes = [set() for _ in clips]
+        fingerprint_times = [0] * len(clips)
+
+        batches = {}
+        for index, (channels, fs) in enumerate(clips):
+            for channel in decoder.select_channels(channels, self.dejavu.channel_strategy):
+                batches.setdefault(fs, []).append((index, channel))
+
+        for fs, batch in batches.items():
+            fingerprints, fingerprint_time = self.dejavu.generate_fingerprints_batch([c for _, c in batch], Fs=fs)
+            for (index, _), clip_fingerprints in zip(batch, fingerprints):
+                fingerprint_times[index] += fingerprint_time
+                hashes[index] |= set(clip_fingerprints)
+
+        # the database is queried for every clip at once, the alignment is cheap and runs clip by clip.
+        with ThreadPoolExecutor(max(1, min(MATCH_THREADS, len(clips)))) as executor:
+            found = list(executor.map(self.dejavu.find_matches, hashes))
+
+        results = []
+        for clip_hashes, fingerprint_time, (matches, dedup_hashes, query_time) in zip(hashes, fingerprint_times, found):
+            t = time()
+            final_results = self.dejavu.align_matches(matches, dedup_hashes, len(clip_hashes))
+            align_time = time() - t
+
+            results.append((final_results, fingerprint_time, query_time, align_time))
+
+        return results
 
     @abc.abstractmethod
     def recognize(self) -> Dict[str, any]:
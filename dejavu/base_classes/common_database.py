@@ -1,7 +1,10 @@
 import abc
 from typing import Dict, List, Tuple
 
+import numpy as np
+
 from dejavu.base_classes.base_database import BaseDatabase
+from dejavu.logic.fingerprint import fingerprints_array
 
 
 class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
@@ -9,6 +12,12 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
     # I've built this class with the idea to reuse that logic instead of copy pasting
     # over and over the same code.
 
+    # extra connection options the bulk loads need, see load_hashes.
+    BULK_LOAD_OPTIONS = {}
+
+    # hash index created apart from the fingerprints table by setup, None if the table creates it.
+    CREATE_FINGERPRINTS_TABLE_INDEX = None
+
     def __init__(self):
         super().__init__()
 
@@ -35,6 +44,44 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
             cur.execute(self.CREATE_FINGERPRINTS_TABLE)
             cur.execute(self.DELETE_UNFINGERPRINTED)
 
+            # the fingerprints indexes are left alone while a bulk ingestion is open, see begin_bulk_ingest.
+            cur.execute(self.SELECT_FINGERPRINTS_UNIQUE_INDEX)
+            if not cur.fetchone()[0]:
+                print("A bulk ingestion is open or was interrupted, fingerprints are not indexed until it ends. "
+                      "Run the bulk ingestion again or call end_bulk_ingest to finish it.")
+            elif self.CREATE_FINGERPRINTS_TABLE_INDEX:
+                cur.execute(self.CREATE_FINGERPRINTS_TABLE_INDEX)
+
+            # tables created before the file sha1 was unique get the index here, unless they hold songs
+            # fingerprinted from the same file as another one: those are only removed on request.
+            cur.execute(self.SELECT_SONGS_FILE_SHA1_INDEX)
+            if not cur.fetchone()[0]:
+                cur.execute(self.SELECT_NUM_DUPLICATED_SONGS)
+                duplicated = cur.fetchone()[0]
+                if duplicated:
+                    print(f"{duplicated} songs were fingerprinted from the same file as another song, the file "
+                          "sha1 index is not created until they are removed with delete_duplicated_songs "
+                          "(python dejavu.py --dedupe).")
+                else:
+                    cur.execute(self.CREATE_SONGS_FILE_SHA1_INDEX)
+
+    def delete_duplicated_songs(self) -> int:
+        """
+        Keeps a single song per file sha1, the fingerprinted one first and then the oldest. The others
+        are deleted with their fingerprints, then the unique file sha1 index is created.
+
+        :return: the amount of songs deleted.
+        """
+        with self.cursor() as cur:
+            cur.execute(self.DELETE_DUPLICATED_SONGS)
+            deleted = max(cur.rowcount, 0)
+
+            cur.execute(self.SELECT_SONGS_FILE_SHA1_INDEX)
+            if not cur.fetchone()[0]:
+                cur.execute(self.CREATE_SONGS_FILE_SHA1_INDEX)
+
+        return deleted
+
     def empty(self) -> None:
         """
         Called when the database should be cleared of all data.
@@ -107,11 +154,43 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
             cur.execute(self.SELECT_SONG, (song_id,))
             return cur.fetchone()
 
-    def insert(self, fingerprint: str, song_id: int, offset: int):
+    def get_song_id_by_file_hash(self, file_hash: str) -> int:
+        """
+        Looks up the fingerprinted song of a file by its sha1, through the unique index of the column.
+
+        :param file_hash: sha1 of the file content.
+        :return: the song identifier, or None if the file was not fingerprinted.
+        """
+        with self.cursor() as cur:
+            cur.execute(self.SELECT_SONG_ID_BY_FILE_SHA1, (file_hash,))
+            song = cur.fetchone()
+
+        return song[0] if song else None
+
+    def get_songs_by_ids(self, song_ids: List[int], batch_size: int = 1000) -> List[Dict[str, str]]:
+        """
+        Brings the info of several songs from the database at once.
+
+        :param song_ids: song identifiers.
+        :param batch_size: number of query's batches.
+        :return: a list of dictionaries with the songs info, including their id. Missing songs are left out.
+        """
+        songs = []
+        with self.cursor(dictionary=True) as cur:
+            for index in range(0, len(song_ids), batch_size):
+                # Create our IN part of the query
+                query = self.SELECT_SONGS_BY_IDS % ', '.join(['%s'] * len(song_ids[index: index + batch_size]))
+
+                cur.execute(query, song_ids[index: index + batch_size])
+                songs.extend(cur)
+
+        return songs
+
+    def insert(self, fingerprint: int, song_id: int, offset: int):
         """
         Inserts a single fingerprint into the database.
 
-        :param fingerprint: Part of a sha1 hash, in hexadecimal format
+        :param fingerprint: Landmark packed into an integer
         :param song_id: Song identifier this fingerprint is off
         :param offset: The offset this fingerprint is from.
         """
@@ -131,12 +210,12 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
         """
         pass
 
-    def query(self, fingerprint: str = None) -> List[Tuple]:
+    def query(self, fingerprint: int = None) -> List[Tuple]:
         """
         Returns all matching fingerprint entries associated with
         the given hash as parameter, if None is passed it returns all entries.
 
-        :param fingerprint: part of a sha1 hash, in hexadecimal format
+        :param fingerprint: landmark packed into an integer
         :return: a list of fingerprint records stored in the db.
         """
         with self.cursor() as cur:
@@ -154,68 +233,199 @@ class CommonDatabase(BaseDatabase, metaclass=abc.ABCMeta):
         """
         return self.query(None)
 
-    def insert_hashes(self, song_id: int, hashes: List[Tuple[str, int]], batch_size: int = 1000) -> None:
+    def insert_hashes(self, song_id: int, hashes: List[Tuple[int, int]], batch_size: int = 1000) -> None:
         """
         Insert a multitude of fingerprints.
 
         :param song_id: Song identifier the fingerprints belong to
-        :param hashes: A sequence of tuples in the format (hash, offset)
-            - hash: Part of a sha1 hash, in hexadecimal format
+        :param hashes: A sequence of tuples in the format (hash, offset), or an array of (hash, offset) rows
+            - hash: Landmark packed into an integer
             - offset: Offset this hash was created from/at.
         :param batch_size: insert batches.
         """
-        values = [(song_id, hsh, int(offset)) for hsh, offset in hashes]
+        values = [(song_id, hsh, offset) for hsh, offset in fingerprints_array(hashes).tolist()]
 
         with self.cursor() as cur:
             for index in range(0, len(hashes), batch_size):
                 cur.executemany(self.INSERT_FINGERPRINT, values[index: index + batch_size])
 
-    def return_matches(self, hashes: List[Tuple[str, int]],
-                       batch_size: int = 1000) -> Tuple[List[Tuple[int, int]], Dict[int, int]]:
+    def load_hashes(self, song_id: int, hashes: List[Tuple[int, int]]) -> None:
+        """
+        Bulk loads a multitude of fingerprints. Instead of sending rows in insert batches, they are
+        streamed into a temporary staging table by the native loader of the database (see copy_fingerprints),
+        then moved into the fingerprints table with a single statement which leaves out the duplicated ones.
+
+        :param song_id: Song identifier the fingerprints belong to
+        :param hashes: A sequence of tuples in the format (hash, offset), or an array of (hash, offset) rows
+            - hash: Landmark packed into an integer
+            - offset: Offset this hash was created from/at.
+        """
+        rows = fingerprints_array(hashes)
+
+        with self.cursor(**self.BULK_LOAD_OPTIONS) as cur:
+            # the staging table lives as long as the connection, a failed load may have left rows in it.
+            cur.execute(self.CREATE_FINGERPRINTS_STAGING_TABLE)
+            cur.execute(self.TRUNCATE_FINGERPRINTS_STAGING)
+
+            self.copy_fingerprints(cur, rows)
+
+            cur.execute(self.INSERT_FINGERPRINTS_FROM_STAGING, (song_id,))
+            cur.execute(self.TRUNCATE_FINGERPRINTS_STAGING)
+
+    @abc.abstractmethod
+    def copy_fingerprints(self, cur, rows: np.ndarray) -> None:
+        """
+        Streams fingerprints into the staging table, through the bulk loader of the database.
+
+        :param cur: open cursor of the connection the staging table was created on.
+        :param rows: integer array of (hash, offset) rows.
+        """
+        pass
+
+    def in_bulk_ingest(self) -> bool:
+        """
+        Tells whether a bulk ingestion is open, its state is the shape of the fingerprints table so it
+        survives an interrupted process.
+
+        :return: True if the unique constraint of the fingerprints table is dropped.
+        """
+        with self.cursor() as cur:
+            cur.execute(self.SELECT_FINGERPRINTS_UNIQUE_INDEX)
+            return not cur.fetchone()[0]
+
+    def begin_bulk_ingest(self) -> None:
+        """
+        Starts a bulk ingestion: the hash index and the unique constraint of the fingerprints table are
+        dropped, so inserts only append rows until end_bulk_ingest builds them again. A plain song id index
+        takes their place meanwhile, so fingerprints are still stored and deleted as usual, but they can
+        not be matched efficiently.
+
+        Does nothing if a bulk ingestion is already open, an interrupted one is resumed.
+        """
+        if not self.in_bulk_ingest():
+            with self.cursor() as cur:
+                cur.execute(self.DROP_FINGERPRINTS_INDEXES)
+
+    def end_bulk_ingest(self) -> None:
+        """
+        Ends a bulk ingestion: duplicated fingerprints are removed in a single pass over the table, then
+        the hash index and the unique constraint are built again. If interrupted, the table keeps its
+        bulk shape and calling it again finishes the job.
+
+        Does nothing if no bulk ingestion is open.
+        """
+        if not self.in_bulk_ingest():
+            return
+
+        with self.cursor() as cur:
+            # one copy of every duplicated row is kept aside, all of them are deleted and the copy put back.
+            cur.execute(self.DROP_FINGERPRINTS_DUPLICATES)
+            cur.execute(self.CREATE_FINGERPRINTS_DUPLICATES)
+            cur.execute(self.DELETE_FINGERPRINTS_DUPLICATES)
+            cur.execute(self.INSERT_FINGERPRINTS_DUPLICATES)
+            cur.execute(self.DROP_FINGERPRINTS_DUPLICATES)
+
+            cur.execute(self.CREATE_FINGERPRINTS_INDEXES)
+
+    def return_matches(self, hashes: List[Tuple[int, int]],
+                       batch_size: int = 1000) -> Tuple[np.ndarray, Dict[int, int]]:
         """
         Searches the database for pairs of (hash, offset) values.
 
         :param hashes: A sequence of tuples in the format (hash, offset)
-            - hash: Part of a sha1 hash, in hexadecimal format
+            - hash: Landmark packed into an integer
             - offset: Offset this hash was created from/at.
         :param batch_size: number of query's batches.
-        :return: a list of (sid, offset_difference) tuples and a
+        :return: an integer array of (sid, offset_difference) rows and a
         dictionary with the amount of hashes matched (not considering
         duplicated hashes) in each song.
             - song id: Song identifier
             - offset_difference: (database_offset - sampled_offset)
         """
-        # Create a dictionary of hash => offset pairs for later lookups
-        mapper = {}
-        for hsh, offset in hashes:
-            if hsh.upper() in mapper.keys():
-                mapper[hsh.upper()].append(offset)
-            else:
-                mapper[hsh.upper()] = [offset]
+        # sorted by hash, so the sampled offsets of each matched hash are found with a binary search.
+        hashes = np.array(list(hashes), dtype=np.int64).reshape(-1, 2)
+        hashes = hashes[np.argsort(hashes[:, 0], kind="stable")]
+        sampled_hashes, sampled_offsets = hashes[:, 0], hashes[:, 1]
 
-        values = list(mapper.keys())
+        values = np.unique(sampled_hashes).tolist()
 
-        # in order to count each hash only once per db offset we use the dic below
-        dedup_hashes = {}
-
-        results = []
+        rows = []
         with self.cursor() as cur:
             for index in range(0, len(values), batch_size):
                 # Create our IN part of the query
                 query = self.SELECT_MULTIPLE % ', '.join([self.IN_MATCH] * len(values[index: index + batch_size]))
 
                 cur.execute(query, values[index: index + batch_size])
+                rows.extend(cur.fetchall())
+
+        rows = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        db_hashes, sids, db_offsets = rows[:, 0], rows[:, 1], rows[:, 2]
+
+        # in order to count each hash only once per db offset we count the rows.
+        song_ids, counts = np.unique(sids, return_counts=True)
+        dedup_hashes = dict(zip(song_ids.tolist(), counts.tolist()))
 
-                for hsh, sid, offset in cur:
-                    if sid not in dedup_hashes.keys():
-                        dedup_hashes[sid] = 1
-                    else:
-                        dedup_hashes[sid] += 1
-                    #  we now evaluate all offset for each  hash matched
-                    for song_sampled_offset in mapper[hsh]:
-                        results.append((sid, offset - song_sampled_offset))
+        # we now evaluate all offset for each hash matched: every row is repeated once per sampled offset
+        # of its hash, and paired with the sampled offsets found between first and last.
+        first = np.searchsorted(sampled_hashes, db_hashes, side="left")
+        repeats = np.searchsorted(sampled_hashes, db_hashes, side="right") - first
+        starts = np.cumsum(repeats) - repeats
+        positions = np.arange(repeats.sum()) - np.repeat(starts - first, repeats)
 
-            return results, dedup_hashes
+        results = np.stack([np.repeat(sids, repeats), np.repeat(db_offsets, repeats) - sampled_offsets[positions]], 1)
+        return results, dedup_hashes
+
+    def has_legacy_fingerprints_table(self) -> bool:
+        """
+        Tells whether the fingerprints table was created with the legacy sha1 hash column.
+
+        :return: True if the table has to be converted, see convert_fingerprints_table.
+        """
+        with self.cursor() as cur:
+            cur.execute(self.SELECT_HASH_COLUMN_TYPE)
+            column_type = cur.fetchone()[0]
+
+        if isinstance(column_type, (bytes, bytearray)):
+            column_type = column_type.decode("utf8")
+
+        return column_type.lower() == self.LEGACY_HASH_COLUMN_TYPE
+
+    def convert_fingerprints_table(self) -> bool:
+        """
+        Converts a fingerprints table created with the legacy sha1 hash column into the
+        packed integer one. Legacy fingerprints can not be converted, so they are removed
+        and the songs have to be fingerprinted again.
+
+        :return: whether the table had to be converted or not.
+        """
+        if not self.has_legacy_fingerprints_table():
+            return False
+
+        with self.cursor() as cur:
+            cur.execute(self.TRUNCATE_FINGERPRINTS)
+            cur.execute(self.ALTER_FINGERPRINTS_HASH_TYPE)
+
+        return True
+
+    def set_song_total_hashes(self, song_id: int, total_hashes: int) -> None:
+        """
+        Updates the amount of hashes of a song, when it is fingerprinted again.
+
+        :param song_id: song identifier.
+        :param total_hashes: amount of hashes inserted on fingerprint table.
+        """
+        with self.cursor() as cur:
+            cur.execute(self.UPDATE_SONG_TOTAL_HASHES, (total_hashes, song_id))
+
+    def get_songs_without_fingerprints(self) -> List[Dict[str, str]]:
+        """
+        Returns all fully fingerprinted songs which do not have any fingerprint stored.
+
+        :return: a list of dictionaries with the songs info.
+        """
+        with self.cursor(dictionary=True) as cur:
+            cur.execute(self.SELECT_SONGS_WITHOUT_FINGERPRINTS)
+            return list(cur)
 
     def delete_songs_by_id(self, song_ids: List[int], batch_size: int = 1000) -> None:
         """
@@ -42,6 +42,10 @@ FIELD_TOTAL_HASHES = 'total_hashes'
 
 # TABLE FINGERPRINTS
 FINGERPRINTS_TABLENAME = "fingerprints"
+# Temporary table fingerprints are bulk loaded into before being moved to the fingerprints table.
+FINGERPRINTS_STAGING_TABLENAME = "fingerprints_staging"
+# Temporary table the duplicated fingerprints are gathered in when a bulk ingestion ends.
+FINGERPRINTS_DUPLICATES_TABLENAME = "fingerprints_duplicates"
 
 # FINGERPRINTS FIELDS
 FIELD_HASH = 'hash'
@@ -56,10 +60,49 @@ FIELD_OFFSET = 'offset'
 # And 2 sets a square mask, i.e. all elements are considered neighbors.
 CONNECTIVITY_MASK = 2
 
+# Algorithm used to find the spectrogram peaks. Possible values are: ['separable', 'morphology']
+# 'morphology' runs scipy's maximum_filter with the mask above plus a binary erosion of the background.
+# 'separable' finds the same peaks with two 1-D running maximums, which is much faster, but it only
+# applies to the square mask (CONNECTIVITY_MASK = 2); the diamond one always falls back to 'morphology'.
+PEAK_DETECTOR = 'separable'
+
+# How audio files are decoded. Possible values are: ['ffmpeg', 'pydub']
+# 'ffmpeg' pipes raw samples from ffmpeg straight into a numpy buffer, only decoding the seconds that are
+# fingerprinted and resampling/mixing channels on the fly when the fingerprint settings ask for it.
+# 'pydub' decodes the whole file through pydub and trims it afterwards; it is also the fallback when the
+# ffmpeg and ffprobe binaries are not found.
+DECODER_BACKEND = 'ffmpeg'
+
+# Threads storing the songs fingerprinted by Dejavu.fingerprint_directory, while its process pool keeps
+# fingerprinting the next files, and number of fingerprinted songs that can wait for them. When the queue
+# is full the pool stops taking new files until the writers catch up.
+DB_WRITER_THREADS = 2
+DB_WRITE_QUEUE_SIZE = 8
+
+# Threads querying the matches of the clips recognized together (see BaseRecognizer._recognize_batch),
+# each query opening its own connection.
+MATCH_THREADS = 8
+
+# Bulk ingestion jobs (see IngestJob): times a file is tried before it is left as failed, and number of
+# files finished between two saves of the job manifest, also used by the file index (see FileIndex).
+INGEST_MAX_ATTEMPTS = 3
+INGEST_CHECKPOINT_INTERVAL = 50
+
+# Threads listing the top level subdirectories of a folder in parallel while looking for files to
+# fingerprint, see decoder.find_files. It mostly pays off on network filesystems, where every listing
+# waits on the server; 1 walks the whole tree from the calling thread.
+DIRECTORY_WALK_THREADS = 1
+
 # Sampling rate, related to the Nyquist conditions, which affects
 # the range frequencies we can detect.
 DEFAULT_FS = 44100
 
+# How multichannel audio is fingerprinted, right after decoding. Possible values are: ['all', 'mix', 'left']
+# 'all' fingerprints every channel and joins their hashes, 'mix' averages the channels into a single one
+# and 'left' only keeps the first channel. The last two halve the work on stereo audio, and since channels
+# are usually very alike, 'all' mostly adds duplicated hashes. It is set with the "channels" config key.
+DEFAULT_CHANNEL_STRATEGY = 'all'
+
 # Size of the FFT window, affects frequency granularity
 DEFAULT_WINDOW_SIZE = 4096
 
@@ -82,6 +125,29 @@ DEFAULT_AMP_MIN = 5
 # fingerprints and faster matching, but can potentially affect accuracy.
 PEAK_NEIGHBORHOOD_SIZE = 20  # 20 was the original value.
 
+# Number of spectrogram frames computed and searched for peaks at once. Tracks are
+# fingerprinted block by block, so this bounds memory no matter how long the audio is.
+DEFAULT_BLOCK_FRAMES = 1024
+
+# Maximum number of clips of the same length fingerprint_batch stacks into a single spectrogram. The
+# memory taken grows with it, about 10MB per 12 second clip at 44.1 kHz.
+FINGERPRINT_BATCH_SIZE = 8
+
+# Constellation density control: keep at most DEFAULT_PEAKS_PER_SLICE of the strongest peaks in each
+# time slice of DEFAULT_SLICE_FRAMES frames (43 frames are about a second) and each of the DEFAULT_FREQ_ZONES
+# equal frequency zones. This bounds the hashes per second, and so the insert and query cost, no matter how
+# loud the audio is. None keeps every peak above DEFAULT_AMP_MIN.
+DEFAULT_PEAKS_PER_SLICE = None
+DEFAULT_SLICE_FRAMES = 43
+DEFAULT_FREQ_ZONES = 4
+
+# Frequency band fingerprinted, in Hz. Bins outside of it are dropped right after the FFT, so peak finding
+# runs on a smaller matrix, and the hashes only use the bits needed for the bins left (see
+# FINGERPRINT_FREQ_BITS). Radio codecs cut most content above 5-7 kHz, so on 44.1 kHz audio a band
+# like 100-5500 Hz keeps about a quarter of the bins. None means no limit on that side.
+DEFAULT_MIN_FREQ = None
+DEFAULT_MAX_FREQ = None
+
 # Thresholds on how close or far fingerprints can be in time in order
 # to be paired as a fingerprint. If your max is too low, higher values of
 # DEFAULT_FAN_VALUE may not perform as expected.
@@ -93,10 +159,55 @@ MAX_HASH_TIME_DELTA = 200
 # affect performance.
 PEAK_SORT = True
 
-# Number of bits to grab from the front of the SHA1 hash in the
-# fingerprint calculation. The more you grab, the more memory storage,
-# with potentially lesser collisions of matches.
-FINGERPRINT_REDUCTION = 20
+# Fingerprints are stored as a single integer that bit-packs the landmark (freq1, freq2, t_delta):
+#    freq1 << (FINGERPRINT_FREQ_BITS + FINGERPRINT_DELTA_BITS)
+#    | freq2 << FINGERPRINT_DELTA_BITS
+#    | (t_delta - MIN_HASH_TIME_DELTA)
+# Frequencies are spectrogram bin indexes, so FINGERPRINT_FREQ_BITS must be able to hold
+# DEFAULT_WINDOW_SIZE / 2 + 1 bins, and FINGERPRINT_DELTA_BITS the MIN/MAX_HASH_TIME_DELTA range.
+# When a frequency band is set, bins are counted from its lower edge and packed with just the bits
+# the band needs instead of FINGERPRINT_FREQ_BITS.
+FINGERPRINT_FREQ_BITS = 12
+FINGERPRINT_DELTA_BITS = 10
+
+# FINGERPRINT PROFILES:
+# Named sets of fingerprint parameters, overriding the defaults above. Dejavu uses the one set by the
+# "fingerprint_profile" key of its configuration ('default' when missing). Keep using the same profile
+# for fingerprinting and recognition against the same database.
+FINGERPRINT_PROFILES = {
+    'default': {},
+    # at most 5 peaks per second in each zone, i.e. up to 20 peaks and 80 hashes per second and channel.
+    'top_peaks': {
+        'peaks_per_slice': 5,
+        'slice_frames': DEFAULT_SLICE_FRAMES,
+        'freq_zones': DEFAULT_FREQ_ZONES
+    },
+    # Landmarks sit well below 5 kHz, so the audio can be downsampled (anti-alias filtered) before the FFT.
+    # The window is shrunk by the same factor so bins keep their width in Hz and frames their length in
+    # seconds, for about 4 times less FFT work and spectrogram memory. Their hashes are not compatible
+    # with the 44.1 kHz ones, so they need their own database.
+    'low_rate': {
+        'target_fs': 11025,
+        'wsize': 512
+    },
+    'narrowband': {
+        'target_fs': 8000,
+        'wsize': 512
+    },
+    # only the band radio codecs keep, the peak search runs on about a quarter of the bins.
+    'band_limited': {
+        'min_freq': 100,
+        'max_freq': 5500
+    }
+}
+
+# Maximum size, in bytes, of the fingerprint cache directory set by the "fingerprint_cache" config key.
+# When it grows over it, the least recently used entries are removed.
+FINGERPRINT_CACHE_MAX_SIZE = 2**30
+
+# Number of songs whose name, sha1 and total hashes Dejavu keeps in memory to build recognition results
+# without querying the database, the least recently used ones are dropped first.
+SONG_CACHE_SIZE = 10000
 
 # Number of results being returned for file recognition
 TOPN = 2
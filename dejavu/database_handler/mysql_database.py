@@ -1,12 +1,17 @@
+import os
 import queue
+import tempfile
 
 import mysql.connector
+import numpy as np
 from mysql.connector.errors import DatabaseError
 
 from dejavu.base_classes.common_database import CommonDatabase
 from dejavu.config.settings import (FIELD_FILE_SHA1, FIELD_FINGERPRINTED,
                                     FIELD_HASH, FIELD_OFFSET, FIELD_SONG_ID,
                                     FIELD_SONGNAME, FIELD_TOTAL_HASHES,
+                                    FINGERPRINTS_DUPLICATES_TABLENAME,
+                                    FINGERPRINTS_STAGING_TABLENAME,
                                     FINGERPRINTS_TABLENAME, SONGS_TABLENAME)
 
 
@@ -28,9 +33,30 @@ class MySQLDatabase(CommonDatabase):
         ) ENGINE=INNODB;
     """
 
+    CREATE_SONGS_FILE_SHA1_INDEX = f"""
+        ALTER TABLE `{SONGS_TABLENAME}`
+        ADD CONSTRAINT `uq_{SONGS_TABLENAME}_{FIELD_FILE_SHA1}` UNIQUE KEY (`{FIELD_FILE_SHA1}`);
+    """
+
+    # songs DELETE_DUPLICATED_SONGS would remove.
+    SELECT_NUM_DUPLICATED_SONGS = f"""
+        SELECT COUNT(`{FIELD_FILE_SHA1}`) - COUNT(DISTINCT `{FIELD_FILE_SHA1}`) AS n FROM `{SONGS_TABLENAME}`;
+    """
+
+    # keeps a single song per file sha1, the fingerprinted one first and then the oldest.
+    DELETE_DUPLICATED_SONGS = f"""
+        DELETE s FROM `{SONGS_TABLENAME}` s
+        JOIN `{SONGS_TABLENAME}` k
+        ON k.`{FIELD_FILE_SHA1}` = s.`{FIELD_FILE_SHA1}`
+        AND (
+            k.`{FIELD_FINGERPRINTED}` > s.`{FIELD_FINGERPRINTED}`
+            OR (k.`{FIELD_FINGERPRINTED}` = s.`{FIELD_FINGERPRINTED}` AND k.`{FIELD_SONG_ID}` < s.`{FIELD_SONG_ID}`)
+        );
+    """
+
     CREATE_FINGERPRINTS_TABLE = f"""
         CREATE TABLE IF NOT EXISTS `{FINGERPRINTS_TABLENAME}` (
-            `{FIELD_HASH}` BINARY(10) NOT NULL
+            `{FIELD_HASH}` BIGINT NOT NULL
         ,   `{FIELD_SONG_ID}` MEDIUMINT UNSIGNED NOT NULL
         ,   `{FIELD_OFFSET}` INT UNSIGNED NOT NULL
         ,   `date_created` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
@@ -49,7 +75,7 @@ class MySQLDatabase(CommonDatabase):
                 `{FIELD_SONG_ID}`
             ,   `{FIELD_HASH}`
             ,   `{FIELD_OFFSET}`)
-        VALUES (%s, UNHEX(%s), %s);
+        VALUES (%s, %s, %s);
     """
 
     INSERT_SONG = f"""
@@ -57,15 +83,95 @@ class MySQLDatabase(CommonDatabase):
         VALUES (%s, UNHEX(%s), %s);
     """
 
+    # BULK LOADS
+    CREATE_FINGERPRINTS_STAGING_TABLE = f"""
+        CREATE TEMPORARY TABLE IF NOT EXISTS `{FINGERPRINTS_STAGING_TABLENAME}` (
+            `{FIELD_HASH}` BIGINT NOT NULL
+        ,   `{FIELD_OFFSET}` INT UNSIGNED NOT NULL
+        ) ENGINE=INNODB;
+    """
+
+    LOAD_FINGERPRINTS_STAGING = f"""
+        LOAD DATA LOCAL INFILE %s
+        INTO TABLE `{FINGERPRINTS_STAGING_TABLENAME}` (`{FIELD_HASH}`, `{FIELD_OFFSET}`);
+    """
+
+    INSERT_FINGERPRINTS_FROM_STAGING = f"""
+        INSERT IGNORE INTO `{FINGERPRINTS_TABLENAME}` (
+                `{FIELD_SONG_ID}`
+            ,   `{FIELD_HASH}`
+            ,   `{FIELD_OFFSET}`)
+        SELECT DISTINCT %s, `{FIELD_HASH}`, `{FIELD_OFFSET}`
+        FROM `{FINGERPRINTS_STAGING_TABLENAME}`;
+    """
+
+    TRUNCATE_FINGERPRINTS_STAGING = f"TRUNCATE TABLE `{FINGERPRINTS_STAGING_TABLENAME}`;"
+
+    # the server has to accept them too, with local_infile enabled.
+    BULK_LOAD_OPTIONS = {"allow_local_infile": True}
+
+    # BULK INGESTION
+    # the foreign key needs an index starting with the song id, an append only one while songs are inserted.
+    DROP_FINGERPRINTS_INDEXES = f"""
+        ALTER TABLE `{FINGERPRINTS_TABLENAME}`
+            ADD INDEX `ix_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}` (`{FIELD_SONG_ID}`)
+        ,   DROP INDEX `ix_{FINGERPRINTS_TABLENAME}_{FIELD_HASH}`
+        ,   DROP INDEX `uq_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}_{FIELD_OFFSET}_{FIELD_HASH}`;
+    """
+
+    CREATE_FINGERPRINTS_INDEXES = f"""
+        ALTER TABLE `{FINGERPRINTS_TABLENAME}`
+            ADD INDEX `ix_{FINGERPRINTS_TABLENAME}_{FIELD_HASH}` (`{FIELD_HASH}`)
+        ,   ADD CONSTRAINT `uq_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}_{FIELD_OFFSET}_{FIELD_HASH}`
+                UNIQUE KEY (`{FIELD_SONG_ID}`, `{FIELD_OFFSET}`, `{FIELD_HASH}`)
+        ,   DROP INDEX `ix_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}`;
+    """
+
+    SELECT_FINGERPRINTS_UNIQUE_INDEX = f"""
+        SELECT COUNT(*)
+        FROM `information_schema`.`STATISTICS`
+        WHERE `TABLE_SCHEMA` = DATABASE()
+        AND `TABLE_NAME` = '{FINGERPRINTS_TABLENAME}'
+        AND `INDEX_NAME` = 'uq_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}_{FIELD_OFFSET}_{FIELD_HASH}';
+    """
+
+    CREATE_FINGERPRINTS_DUPLICATES = f"""
+        CREATE TEMPORARY TABLE `{FINGERPRINTS_DUPLICATES_TABLENAME}` ENGINE=INNODB AS
+        SELECT `{FIELD_SONG_ID}`, `{FIELD_HASH}`, `{FIELD_OFFSET}`
+        FROM `{FINGERPRINTS_TABLENAME}`
+        GROUP BY `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`, `{FIELD_HASH}`
+        HAVING COUNT(*) > 1;
+    """
+
+    DELETE_FINGERPRINTS_DUPLICATES = f"""
+        DELETE f
+        FROM `{FINGERPRINTS_TABLENAME}` f
+        JOIN `{FINGERPRINTS_DUPLICATES_TABLENAME}` d
+            ON f.`{FIELD_SONG_ID}` = d.`{FIELD_SONG_ID}`
+            AND f.`{FIELD_OFFSET}` = d.`{FIELD_OFFSET}`
+            AND f.`{FIELD_HASH}` = d.`{FIELD_HASH}`;
+    """
+
+    INSERT_FINGERPRINTS_DUPLICATES = f"""
+        INSERT INTO `{FINGERPRINTS_TABLENAME}` (
+                `{FIELD_SONG_ID}`
+            ,   `{FIELD_HASH}`
+            ,   `{FIELD_OFFSET}`)
+        SELECT `{FIELD_SONG_ID}`, `{FIELD_HASH}`, `{FIELD_OFFSET}`
+        FROM `{FINGERPRINTS_DUPLICATES_TABLENAME}`;
+    """
+
+    DROP_FINGERPRINTS_DUPLICATES = f"DROP TEMPORARY TABLE IF EXISTS `{FINGERPRINTS_DUPLICATES_TABLENAME}`;"
+
     # SELECTS
     SELECT = f"""
         SELECT `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`
         FROM `{FINGERPRINTS_TABLENAME}`
-        WHERE `{FIELD_HASH}` = UNHEX(%s);
+        WHERE `{FIELD_HASH}` = %s;
     """
 
     SELECT_MULTIPLE = f"""
-        SELECT HEX(`{FIELD_HASH}`), `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`
+        SELECT `{FIELD_HASH}`, `{FIELD_SONG_ID}`, `{FIELD_OFFSET}`
         FROM `{FINGERPRINTS_TABLENAME}`
         WHERE `{FIELD_HASH}` IN (%s);
     """
@@ -78,6 +184,30 @@ class MySQLDatabase(CommonDatabase):
         WHERE `{FIELD_SONG_ID}` = %s;
     """
 
+    SELECT_SONGS_BY_IDS = f"""
+        SELECT
+            `{FIELD_SONG_ID}`
+        ,   `{FIELD_SONGNAME}`
+        ,   HEX(`{FIELD_FILE_SHA1}`) AS `{FIELD_FILE_SHA1}`
+        ,   `{FIELD_TOTAL_HASHES}`
+        FROM `{SONGS_TABLENAME}`
+        WHERE `{FIELD_SONG_ID}` IN (%s);
+    """
+
+    SELECT_SONG_ID_BY_FILE_SHA1 = f"""
+        SELECT `{FIELD_SONG_ID}`
+        FROM `{SONGS_TABLENAME}`
+        WHERE `{FIELD_FILE_SHA1}` = UNHEX(%s) AND `{FIELD_FINGERPRINTED}` = 1;
+    """
+
+    SELECT_SONGS_FILE_SHA1_INDEX = f"""
+        SELECT COUNT(*)
+        FROM `information_schema`.`STATISTICS`
+        WHERE `TABLE_SCHEMA` = DATABASE()
+        AND `TABLE_NAME` = '{SONGS_TABLENAME}'
+        AND `INDEX_NAME` = 'uq_{SONGS_TABLENAME}_{FIELD_FILE_SHA1}';
+    """
+
     SELECT_NUM_FINGERPRINTS = f"SELECT COUNT(*) AS n FROM `{FINGERPRINTS_TABLENAME}`;"
 
     SELECT_UNIQUE_SONG_IDS = f"""
@@ -97,6 +227,35 @@ class MySQLDatabase(CommonDatabase):
         WHERE `{FIELD_FINGERPRINTED}` = 1;
     """
 
+    SELECT_SONGS_WITHOUT_FINGERPRINTS = f"""
+        SELECT
+            `{FIELD_SONG_ID}`
+        ,   `{FIELD_SONGNAME}`
+        ,   HEX(`{FIELD_FILE_SHA1}`) AS `{FIELD_FILE_SHA1}`
+        FROM `{SONGS_TABLENAME}` s
+        WHERE `{FIELD_FINGERPRINTED}` = 1
+        AND NOT EXISTS (
+            SELECT 1 FROM `{FINGERPRINTS_TABLENAME}` f WHERE f.`{FIELD_SONG_ID}` = s.`{FIELD_SONG_ID}`
+        );
+    """
+
+    SELECT_HASH_COLUMN_TYPE = f"""
+        SELECT `DATA_TYPE`
+        FROM `information_schema`.`COLUMNS`
+        WHERE `TABLE_SCHEMA` = DATABASE()
+        AND `TABLE_NAME` = '{FINGERPRINTS_TABLENAME}'
+        AND `COLUMN_NAME` = '{FIELD_HASH}';
+    """
+
+    # MIGRATION FROM THE LEGACY SHA1 FINGERPRINTS
+    LEGACY_HASH_COLUMN_TYPE = "binary"
+
+    TRUNCATE_FINGERPRINTS = f"TRUNCATE TABLE `{FINGERPRINTS_TABLENAME}`;"
+
+    ALTER_FINGERPRINTS_HASH_TYPE = f"""
+        ALTER TABLE `{FINGERPRINTS_TABLENAME}` MODIFY `{FIELD_HASH}` BIGINT NOT NULL;
+    """
+
     # DROPS
     DROP_FINGERPRINTS = f"DROP TABLE IF EXISTS `{FINGERPRINTS_TABLENAME}`;"
     DROP_SONGS = f"DROP TABLE IF EXISTS `{SONGS_TABLENAME}`;"
@@ -106,6 +265,10 @@ class MySQLDatabase(CommonDatabase):
         UPDATE `{SONGS_TABLENAME}` SET `{FIELD_FINGERPRINTED}` = 1 WHERE `{FIELD_SONG_ID}` = %s;
     """
 
+    UPDATE_SONG_TOTAL_HASHES = f"""
+        UPDATE `{SONGS_TABLENAME}` SET `{FIELD_TOTAL_HASHES}` = %s WHERE `{FIELD_SONG_ID}` = %s;
+    """
+
     # DELETES
     DELETE_UNFINGERPRINTED = f"""
         DELETE FROM `{SONGS_TABLENAME}` WHERE `{FIELD_FINGERPRINTED}` = 0;
@@ -116,7 +279,7 @@ class MySQLDatabase(CommonDatabase):
     """
 
     # IN
-    IN_MATCH = f"UNHEX(%s)"
+    IN_MATCH = "%s"
 
     def __init__(self, **options):
         super().__init__()
@@ -142,6 +305,21 @@ class MySQLDatabase(CommonDatabase):
             cur.execute(self.INSERT_SONG, (song_name, file_hash, total_hashes))
             return cur.lastrowid
 
+    def copy_fingerprints(self, cur, rows: np.ndarray) -> None:
+        """
+        Streams fingerprints into the staging table, through LOAD DATA LOCAL INFILE of a tab separated file.
+
+        :param cur: open cursor of the connection the staging table was created on.
+        :param rows: integer array of (hash, offset) rows.
+        """
+        fd, path = tempfile.mkstemp(suffix=".tsv")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(("%d\t%d\n" * len(rows)) % tuple(rows.ravel().tolist()))
+            cur.execute(self.LOAD_FINGERPRINTS_STAGING, (path,))
+        finally:
+            os.remove(path)
+
     def __getstate__(self):
         return self._options,
 
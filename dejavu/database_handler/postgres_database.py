@@ -1,5 +1,7 @@
+import io
 import queue
 
+import numpy as np
 import psycopg2
 from psycopg2.extras import DictCursor
 
@@ -7,6 +9,8 @@ from dejavu.base_classes.common_database import CommonDatabase
 from dejavu.config.settings import (FIELD_FILE_SHA1, FIELD_FINGERPRINTED,
                                     FIELD_HASH, FIELD_OFFSET, FIELD_SONG_ID,
                                     FIELD_SONGNAME, FIELD_TOTAL_HASHES,
+                                    FINGERPRINTS_DUPLICATES_TABLENAME,
+                                    FINGERPRINTS_STAGING_TABLENAME,
                                     FINGERPRINTS_TABLENAME, SONGS_TABLENAME)
 
 
@@ -28,9 +32,30 @@ class PostgreSQLDatabase(CommonDatabase):
         );
     """
 
+    CREATE_SONGS_FILE_SHA1_INDEX = f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS "uq_{SONGS_TABLENAME}_{FIELD_FILE_SHA1}"
+        ON "{SONGS_TABLENAME}" ("{FIELD_FILE_SHA1}");
+    """
+
+    # songs DELETE_DUPLICATED_SONGS would remove.
+    SELECT_NUM_DUPLICATED_SONGS = f"""
+        SELECT COUNT("{FIELD_FILE_SHA1}") - COUNT(DISTINCT "{FIELD_FILE_SHA1}") AS n FROM "{SONGS_TABLENAME}";
+    """
+
+    # keeps a single song per file sha1, the fingerprinted one first and then the oldest.
+    DELETE_DUPLICATED_SONGS = f"""
+        DELETE FROM "{SONGS_TABLENAME}" s
+        USING "{SONGS_TABLENAME}" k
+        WHERE k."{FIELD_FILE_SHA1}" = s."{FIELD_FILE_SHA1}"
+        AND (
+            k."{FIELD_FINGERPRINTED}" > s."{FIELD_FINGERPRINTED}"
+            OR (k."{FIELD_FINGERPRINTED}" = s."{FIELD_FINGERPRINTED}" AND k."{FIELD_SONG_ID}" < s."{FIELD_SONG_ID}")
+        );
+    """
+
     CREATE_FINGERPRINTS_TABLE = f"""
         CREATE TABLE IF NOT EXISTS "{FINGERPRINTS_TABLENAME}" (
-            "{FIELD_HASH}" BYTEA NOT NULL
+            "{FIELD_HASH}" BIGINT NOT NULL
         ,   "{FIELD_SONG_ID}" INT NOT NULL
         ,   "{FIELD_OFFSET}" INT NOT NULL
         ,   "date_created" TIMESTAMP NOT NULL DEFAULT now()
@@ -39,13 +64,10 @@ class PostgreSQLDatabase(CommonDatabase):
         ,   CONSTRAINT "fk_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}" FOREIGN KEY ("{FIELD_SONG_ID}")
                 REFERENCES "{SONGS_TABLENAME}"("{FIELD_SONG_ID}") ON DELETE CASCADE
         );
-
-        CREATE INDEX IF NOT EXISTS "ix_{FINGERPRINTS_TABLENAME}_{FIELD_HASH}" ON "{FINGERPRINTS_TABLENAME}"
-        USING hash ("{FIELD_HASH}");
     """
 
     CREATE_FINGERPRINTS_TABLE_INDEX = f"""
-        CREATE INDEX "ix_{FINGERPRINTS_TABLENAME}_{FIELD_HASH}" ON "{FINGERPRINTS_TABLENAME}"
+        CREATE INDEX IF NOT EXISTS "ix_{FINGERPRINTS_TABLENAME}_{FIELD_HASH}" ON "{FINGERPRINTS_TABLENAME}"
         USING hash ("{FIELD_HASH}");
     """
 
@@ -55,7 +77,7 @@ class PostgreSQLDatabase(CommonDatabase):
                 "{FIELD_SONG_ID}"
             ,   "{FIELD_HASH}"
             ,   "{FIELD_OFFSET}")
-        VALUES (%s, decode(%s, 'hex'), %s) ON CONFLICT DO NOTHING;
+        VALUES (%s, %s, %s) ON CONFLICT DO NOTHING;
     """
 
     INSERT_SONG = f"""
@@ -64,15 +86,101 @@ class PostgreSQLDatabase(CommonDatabase):
         RETURNING "{FIELD_SONG_ID}";
     """
 
+    # BULK LOADS
+    CREATE_FINGERPRINTS_STAGING_TABLE = f"""
+        CREATE TEMPORARY TABLE IF NOT EXISTS "{FINGERPRINTS_STAGING_TABLENAME}" (
+            "{FIELD_HASH}" BIGINT NOT NULL
+        ,   "{FIELD_OFFSET}" INT NOT NULL
+        );
+    """
+
+    COPY_FINGERPRINTS_STAGING = f"""
+        COPY "{FINGERPRINTS_STAGING_TABLENAME}" ("{FIELD_HASH}", "{FIELD_OFFSET}") FROM STDIN WITH (FORMAT binary);
+    """
+
+    INSERT_FINGERPRINTS_FROM_STAGING = f"""
+        INSERT INTO "{FINGERPRINTS_TABLENAME}" (
+                "{FIELD_SONG_ID}"
+            ,   "{FIELD_HASH}"
+            ,   "{FIELD_OFFSET}")
+        SELECT DISTINCT %s, "{FIELD_HASH}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_STAGING_TABLENAME}"
+        ON CONFLICT DO NOTHING;
+    """
+
+    TRUNCATE_FINGERPRINTS_STAGING = f'TRUNCATE TABLE "{FINGERPRINTS_STAGING_TABLENAME}";'
+
+    # binary COPY format: signature, flags and header extension length, then every row as its number of
+    # fields followed by the size and big endian value of each one, and -1 as the end of the data.
+    COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + bytes(8)
+    COPY_ROW = np.dtype([("fields", ">i2"), ("hash_size", ">i4"), ("hash", ">i8"),
+                         ("offset_size", ">i4"), ("offset", ">i4")])
+    COPY_TRAILER = b"\xff\xff"
+
+    # BULK INGESTION
+    # the cascading song deletes need an index starting with the song id, an append only one while songs are inserted.
+    DROP_FINGERPRINTS_INDEXES = f"""
+        CREATE INDEX IF NOT EXISTS "ix_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}" ON "{FINGERPRINTS_TABLENAME}"
+        ("{FIELD_SONG_ID}");
+
+        DROP INDEX IF EXISTS "ix_{FINGERPRINTS_TABLENAME}_{FIELD_HASH}";
+        ALTER TABLE "{FINGERPRINTS_TABLENAME}" DROP CONSTRAINT IF EXISTS "uq_{FINGERPRINTS_TABLENAME}";
+    """
+
+    CREATE_FINGERPRINTS_INDEXES = f"""
+        ALTER TABLE "{FINGERPRINTS_TABLENAME}"
+        ADD CONSTRAINT "uq_{FINGERPRINTS_TABLENAME}" UNIQUE ("{FIELD_SONG_ID}", "{FIELD_OFFSET}", "{FIELD_HASH}");
+
+        CREATE INDEX IF NOT EXISTS "ix_{FINGERPRINTS_TABLENAME}_{FIELD_HASH}" ON "{FINGERPRINTS_TABLENAME}"
+        USING hash ("{FIELD_HASH}");
+
+        DROP INDEX IF EXISTS "ix_{FINGERPRINTS_TABLENAME}_{FIELD_SONG_ID}";
+    """
+
+    SELECT_FINGERPRINTS_UNIQUE_INDEX = f"""
+        SELECT COUNT(*)
+        FROM pg_indexes
+        WHERE schemaname = current_schema()
+        AND tablename = '{FINGERPRINTS_TABLENAME}'
+        AND indexname = 'uq_{FINGERPRINTS_TABLENAME}';
+    """
+
+    CREATE_FINGERPRINTS_DUPLICATES = f"""
+        CREATE TEMPORARY TABLE "{FINGERPRINTS_DUPLICATES_TABLENAME}" AS
+        SELECT "{FIELD_SONG_ID}", "{FIELD_HASH}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_TABLENAME}"
+        GROUP BY "{FIELD_SONG_ID}", "{FIELD_OFFSET}", "{FIELD_HASH}"
+        HAVING COUNT(*) > 1;
+    """
+
+    DELETE_FINGERPRINTS_DUPLICATES = f"""
+        DELETE FROM "{FINGERPRINTS_TABLENAME}" f
+        USING "{FINGERPRINTS_DUPLICATES_TABLENAME}" d
+        WHERE f."{FIELD_SONG_ID}" = d."{FIELD_SONG_ID}"
+        AND f."{FIELD_OFFSET}" = d."{FIELD_OFFSET}"
+        AND f."{FIELD_HASH}" = d."{FIELD_HASH}";
+    """
+
+    INSERT_FINGERPRINTS_DUPLICATES = f"""
+        INSERT INTO "{FINGERPRINTS_TABLENAME}" (
+                "{FIELD_SONG_ID}"
+            ,   "{FIELD_HASH}"
+            ,   "{FIELD_OFFSET}")
+        SELECT "{FIELD_SONG_ID}", "{FIELD_HASH}", "{FIELD_OFFSET}"
+        FROM "{FINGERPRINTS_DUPLICATES_TABLENAME}";
+    """
+
+    DROP_FINGERPRINTS_DUPLICATES = f'DROP TABLE IF EXISTS "{FINGERPRINTS_DUPLICATES_TABLENAME}";'
+
     # SELECTS
     SELECT = f"""
         SELECT "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
         FROM "{FINGERPRINTS_TABLENAME}"
-        WHERE "{FIELD_HASH}" = decode(%s, 'hex');
+        WHERE "{FIELD_HASH}" = %s;
     """
 
     SELECT_MULTIPLE = f"""
-        SELECT upper(encode("{FIELD_HASH}", 'hex')), "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
+        SELECT "{FIELD_HASH}", "{FIELD_SONG_ID}", "{FIELD_OFFSET}"
         FROM "{FINGERPRINTS_TABLENAME}"
         WHERE "{FIELD_HASH}" IN (%s);
     """
@@ -88,6 +196,30 @@ class PostgreSQLDatabase(CommonDatabase):
         WHERE "{FIELD_SONG_ID}" = %s;
     """
 
+    SELECT_SONGS_BY_IDS = f"""
+        SELECT
+            "{FIELD_SONG_ID}"
+        ,   "{FIELD_SONGNAME}"
+        ,   upper(encode("{FIELD_FILE_SHA1}", 'hex')) AS "{FIELD_FILE_SHA1}"
+        ,   "{FIELD_TOTAL_HASHES}"
+        FROM "{SONGS_TABLENAME}"
+        WHERE "{FIELD_SONG_ID}" IN (%s);
+    """
+
+    SELECT_SONG_ID_BY_FILE_SHA1 = f"""
+        SELECT "{FIELD_SONG_ID}"
+        FROM "{SONGS_TABLENAME}"
+        WHERE "{FIELD_FILE_SHA1}" = decode(%s, 'hex') AND "{FIELD_FINGERPRINTED}" = 1;
+    """
+
+    SELECT_SONGS_FILE_SHA1_INDEX = f"""
+        SELECT COUNT(*)
+        FROM pg_indexes
+        WHERE schemaname = current_schema()
+        AND tablename = '{SONGS_TABLENAME}'
+        AND indexname = 'uq_{SONGS_TABLENAME}_{FIELD_FILE_SHA1}';
+    """
+
     SELECT_NUM_FINGERPRINTS = f'SELECT COUNT(*) AS n FROM "{FINGERPRINTS_TABLENAME}";'
 
     SELECT_UNIQUE_SONG_IDS = f"""
@@ -107,6 +239,35 @@ class PostgreSQLDatabase(CommonDatabase):
         WHERE "{FIELD_FINGERPRINTED}" = 1;
     """
 
+    SELECT_SONGS_WITHOUT_FINGERPRINTS = f"""
+        SELECT
+            "{FIELD_SONG_ID}"
+        ,   "{FIELD_SONGNAME}"
+        ,   upper(encode("{FIELD_FILE_SHA1}", 'hex')) AS "{FIELD_FILE_SHA1}"
+        FROM "{SONGS_TABLENAME}" s
+        WHERE "{FIELD_FINGERPRINTED}" = 1
+        AND NOT EXISTS (
+            SELECT 1 FROM "{FINGERPRINTS_TABLENAME}" f WHERE f."{FIELD_SONG_ID}" = s."{FIELD_SONG_ID}"
+        );
+    """
+
+    SELECT_HASH_COLUMN_TYPE = f"""
+        SELECT data_type
+        FROM information_schema.columns
+        WHERE table_schema = current_schema()
+        AND table_name = '{FINGERPRINTS_TABLENAME}'
+        AND column_name = '{FIELD_HASH}';
+    """
+
+    # MIGRATION FROM THE LEGACY SHA1 FINGERPRINTS
+    LEGACY_HASH_COLUMN_TYPE = "bytea"
+
+    TRUNCATE_FINGERPRINTS = f'TRUNCATE TABLE "{FINGERPRINTS_TABLENAME}";'
+
+    ALTER_FINGERPRINTS_HASH_TYPE = f"""
+        ALTER TABLE "{FINGERPRINTS_TABLENAME}" ALTER COLUMN "{FIELD_HASH}" TYPE BIGINT USING NULL;
+    """
+
     # DROPS
     DROP_FINGERPRINTS = F'DROP TABLE IF EXISTS "{FINGERPRINTS_TABLENAME}";'
     DROP_SONGS = F'DROP TABLE IF EXISTS "{SONGS_TABLENAME}";'
@@ -119,6 +280,13 @@ class PostgreSQLDatabase(CommonDatabase):
         WHERE "{FIELD_SONG_ID}" = %s;
     """
 
+    UPDATE_SONG_TOTAL_HASHES = f"""
+        UPDATE "{SONGS_TABLENAME}" SET
+            "{FIELD_TOTAL_HASHES}" = %s
+        ,   "date_modified" = now()
+        WHERE "{FIELD_SONG_ID}" = %s;
+    """
+
     # DELETES
     DELETE_UNFINGERPRINTED = f"""
         DELETE FROM "{SONGS_TABLENAME}" WHERE "{FIELD_FINGERPRINTED}" = 0;
@@ -129,7 +297,7 @@ class PostgreSQLDatabase(CommonDatabase):
     """
 
     # IN
-    IN_MATCH = f"decode(%s, 'hex')"
+    IN_MATCH = "%s"
 
     def __init__(self, **options):
         super().__init__()
@@ -155,6 +323,23 @@ class PostgreSQLDatabase(CommonDatabase):
             cur.execute(self.INSERT_SONG, (song_name, file_hash, total_hashes))
             return cur.fetchone()[0]
 
+    def copy_fingerprints(self, cur, rows: np.ndarray) -> None:
+        """
+        Streams fingerprints into the staging table, through a binary COPY FROM STDIN.
+
+        :param cur: open cursor of the connection the staging table was created on.
+        :param rows: integer array of (hash, offset) rows.
+        """
+        data = np.empty(len(rows), dtype=self.COPY_ROW)
+        data["fields"] = 2
+        data["hash_size"] = 8
+        data["hash"] = rows[:, 0]
+        data["offset_size"] = 4
+        data["offset"] = rows[:, 1]
+
+        payload = self.COPY_HEADER + data.tobytes() + self.COPY_TRAILER
+        cur.copy_expert(self.COPY_FINGERPRINTS_STAGING, io.BytesIO(payload))
+
     def __getstate__(self):
         return self._options,
 
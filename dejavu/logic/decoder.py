@@ -1,14 +1,34 @@
-import fnmatch
+import json
+import mmap
 import os
+import queue
+import shutil
+import struct
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from hashlib import sha1
-from typing import List, Tuple
+from typing import Iterator, List, Set, Tuple
 
 import numpy as np
 from pydub import AudioSegment
+from pydub.exceptions import CouldntDecodeError
 from pydub.utils import audioop
 
+from dejavu.config.settings import (DECODER_BACKEND, DEFAULT_CHANNEL_STRATEGY,
+                                    DIRECTORY_WALK_THREADS)
 from dejavu.third_party import wavio
 
+# WAV format tags of integer PCM data, the only ones read_wav handles.
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# ffprobe format names of containers ffmpeg can not decode from a pipe, since they need to seek
+# (mp4/m4a keep their index at the end of the file when it was not written for streaming).
+SEEKABLE_CONTAINERS = {"mov", "mp4", "m4a", "3gp", "3g2", "mj2"}
+
 
 def unique_hash(file_path: str, block_size: int = 2**20) -> str:
     """ Small function to generate a hash to uniquely generate
@@ -31,44 +51,430 @@ def unique_hash(file_path: str, block_size: int = 2**20) -> str:
     return s.hexdigest().upper()
 
 
-def find_files(path: str, extensions: List[str]) -> List[Tuple[str, str]]:
+def buffer_hash(data: bytes) -> str:
+    """
+    Same hash unique_hash gives, for file content that is already in memory (or memory mapped).
+
+    :param data: file content.
+    :return: a hash in an hexagesimal string form.
     """
-    Get all files that meet the specified extensions.
+    return sha1(data).hexdigest().upper()
+
+
+@contextmanager
+def map_file(file_path: str) -> Iterator[bytes]:
+    """
+    Memory maps a file read only, so its content can be hashed and decoded while reading it from
+    disk only once: pages read for the hash are still in memory when the decoder gets them.
+
+    :param file_path: path to file.
+    :return: a context manager giving the content of the file.
+    """
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # empty files can not be mapped.
+            yield b""
+            return
+
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield data
+        finally:
+            data.close()
+
+
+def find_files(path: str, extensions: List[str], nthreads: int = DIRECTORY_WALK_THREADS) -> Iterator[Tuple[str, str]]:
+    """
+    Get all files that meet the specified extensions. Files are yielded while the tree is walked, so
+    they can be processed before the walk is over.
 
     :param path: path to a directory with audio files.
     :param extensions: file extensions to look for.
-    :return: a list of tuples with file name and its extension.
+    :param nthreads: threads walking the top level subdirectories in parallel, 1 walks the tree in order.
+    :return: a generator of tuples with file name and its extension.
     """
     # Allow both with ".mp3" and without "mp3" to be used for extensions
-    extensions = [e.replace(".", "") for e in extensions]
+    extensions = {e.replace(".", "") for e in extensions}
+
+    if nthreads <= 1:
+        yield from scan_tree(path, extensions)
+        return
 
-    results = []
-    for dirpath, dirnames, files in os.walk(path):
-        for extension in extensions:
-            for f in fnmatch.filter(files, f"*.{extension}"):
-                p = os.path.join(dirpath, f)
-                results.append((p, extension))
-    return results
+    subdirectories = []
+    yield from scan_directory(path, extensions, subdirectories)
 
+    # every thread walks whole subdirectories and sends their files as soon as they are found.
+    found = queue.Queue()
 
-def read(file_name: str, limit: int = None) -> Tuple[List[List[int]], int, str]:
+    def walk(directory: str) -> None:
+        try:
+            for result in scan_tree(directory, extensions):
+                found.put(result)
+        finally:
+            found.put(None)
+
+    with ThreadPoolExecutor(nthreads) as executor:
+        for directory in subdirectories:
+            executor.submit(walk, directory)
+
+        for _ in subdirectories:
+            yield from iter(found.get, None)
+
+
+def scan_tree(path: str, extensions: Set[str]) -> Iterator[Tuple[str, str]]:
     """
-    Reads any file supported by pydub (ffmpeg) and returns the data contained
-    within. If file reading fails due to input being a 24-bit wav file,
-    wavio is used as a backup.
+    Walks a directory tree, like os.walk without following symbolic links to directories.
+
+    :param path: path to the directory.
+    :param extensions: file extensions to look for, without the dot.
+    :return: a generator of tuples with file name and its extension.
+    """
+    directories = [path]
+    while directories:
+        subdirectories = []
+        yield from scan_directory(directories.pop(), extensions, subdirectories)
+        # reversed, so subdirectories are walked in the order they were listed.
+        directories.extend(reversed(subdirectories))
+
+
+def scan_directory(path: str, extensions: Set[str], subdirectories: List[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Lists the files of a single directory with os.scandir, whose entries already tell files from
+    directories without a stat call per entry on most filesystems.
+
+    :param path: path to the directory.
+    :param extensions: file extensions to look for, without the dot.
+    :param subdirectories: list where the subdirectories found are appended.
+    :return: a generator of tuples with file name and its extension.
+    """
+    try:
+        entries = os.scandir(path)
+    except OSError:
+        # unreadable directories are skipped, as os.walk does.
+        return
+
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                    continue
+                is_file = entry.is_file()
+            except OSError:
+                continue
+
+            _, dot, extension = entry.name.rpartition(".")
+            if is_file and dot and extension in extensions:
+                yield entry.path, extension
+
+
+def read(file_name: str, limit: int = None, fs: int = None, channel_strategy: str = None,
+         start: float = None) -> Tuple[List[List[int]], int, str]:
+    """
+    Reads any file supported by ffmpeg and returns the data contained within, using the
+    DECODER_BACKEND set in the settings. The file is read once, the same bytes are hashed
+    and decoded.
 
     Can be optionally limited to a certain amount of seconds from the start
     of the file by specifying the `limit` parameter. This is the amount of
-    seconds from the start of the file.
+    seconds from the start of the file, or from `start` when a window of the file is read: the
+    wav reader and the ffmpeg backend seek to it, so only the window is decoded.
+
+    The ffmpeg backend can also resample the audio to `fs` and apply the 'mix' and 'left' channel
+    strategies while decoding; the pydub one ignores both, so callers have to check the sampling rate
+    returned and still apply select_channels.
 
     :param file_name: file to be read.
     :param limit: number of seconds to limit.
+    :param fs: sampling rate wanted, None keeps the one of the file.
+    :param channel_strategy: channel strategy applied while decoding, see select_channels.
+    :param start: second of the file where decoding starts, None for the start of the file.
     :return: tuple list of (channels, sample_rate, content_file_hash).
     """
+    with map_file(file_name) as data:
+        file_hash = buffer_hash(data)
+        channels, frame_rate = decode(file_name, data, limit, fs=fs, channel_strategy=channel_strategy, start=start)
+
+    return channels, frame_rate, file_hash
+
+
+def decode(file_name: str, data: bytes = None, limit: int = None, fs: int = None,
+           channel_strategy: str = None, start: float = None) -> Tuple[List[List[int]], int]:
+    """
+    Decodes a file with the DECODER_BACKEND set in the settings, see read. PCM WAV files at the wanted
+    sampling rate skip the backend, their samples are memory mapped by read_wav.
+
+    :param file_name: file to be decoded.
+    :param data: content of the file when it is already in memory, see map_file.
+    :param limit: number of seconds to limit.
+    :param fs: sampling rate wanted, None keeps the one of the file.
+    :param channel_strategy: channel strategy applied while decoding, see select_channels.
+    :param start: second of the file where decoding starts, None for the start of the file.
+    :return: tuple of (channels, sample_rate).
+    """
+    wav = read_wav(file_name, limit, fs=fs, start=start)
+    if wav is not None:
+        return wav
+
+    if DECODER_BACKEND == "ffmpeg" and ffmpeg_available():
+        return read_ffmpeg(file_name, limit, fs=fs, channel_strategy=channel_strategy, data=data, start=start)
+
+    return read_pydub(file_name, limit, start=start)
+
+
+def wav_header(file_name: str) -> Tuple[int, int, int, int, int]:
+    """
+    Parses the RIFF header of an integer PCM WAV file.
+
+    :param file_name: file to be parsed.
+    :return: tuple of (sample_rate, channels, sample_width, data_offset, data_size) with the sample width
+     in bytes and the position and length of the samples in the file, or None if the file is not a
+     PCM WAV file.
+    """
+    with open(file_name, "rb") as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:] != b"WAVE":
+            return None
+
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, chunk_size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+
+            if chunk_id == b"fmt ":
+                body = f.read(chunk_size)
+                if len(body) < 16:
+                    return None
+                tag, nchannels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", body[:16])
+                if tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    # the actual format is the first two bytes of the sub format guid.
+                    tag = struct.unpack("<H", body[24:26])[0]
+                fmt = (tag, nchannels, sample_rate, bits)
+                f.seek(chunk_size % 2, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None or fmt[0] != WAVE_FORMAT_PCM or fmt[3] % 8 or not fmt[1]:
+                    return None
+                offset = f.tell()
+                # streamed WAV files may leave the size unset, the samples go on until the end of the file.
+                size = os.fstat(f.fileno()).st_size - offset
+                if 0 < chunk_size < size:
+                    size = chunk_size
+                return fmt[2], fmt[1], fmt[3] // 8, offset, size
+            else:
+                # chunks are padded to an even size.
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def read_wav(file_name: str, limit: int = None, fs: int = None, start: float = None) -> Tuple[List[np.array], int]:
+    """
+    Reads a PCM WAV file without decoding nor copying it: the samples are memory mapped and each channel
+    is a strided int16 view over them. Samples wider than 16 bits (24 bit ones included) are viewed
+    through their two most significant bytes, that is truncated to 16 bits as ffmpeg does.
+
+    :param file_name: file to be read.
+    :param limit: number of seconds to limit.
+    :param fs: sampling rate wanted, None keeps the one of the file.
+    :param start: second of the file where reading starts, None for the start of the file.
+    :return: tuple of (channels, sample_rate), or None if the file is not a 16 to 32 bit PCM WAV file
+     sampled at fs.
+    """
+    header = wav_header(file_name)
+    if header is None:
+        return None
+
+    sample_rate, nchannels, width, offset, size = header
+    if width < 2 or (fs and fs != sample_rate):
+        return None
+
+    nframes = size // (nchannels * width)
+    if start:
+        # the window is mapped from its first frame on, nothing before it is read.
+        first_frame = min(int(start * sample_rate), nframes)
+        offset += first_frame * nchannels * width
+        nframes -= first_frame
+    if limit:
+        nframes = min(nframes, int(limit * sample_rate))
+    if nframes == 0:
+        return [np.zeros(0, dtype=np.int16) for _ in range(nchannels)], sample_rate
+
+    data = np.memmap(file_name, dtype=np.uint8, mode="r", offset=offset, shape=(nframes * nchannels * width,))
+    # little endian samples, so the two last bytes of each one are its 16 most significant bits.
+    samples = np.ndarray((nframes, nchannels), dtype="<i2", buffer=data, offset=width - 2,
+                         strides=(nchannels * width, width))
+
+    return [samples[:, channel] for channel in range(nchannels)], sample_rate
+
+
+@lru_cache(maxsize=1)
+def ffmpeg_available() -> bool:
+    """
+    Tells whether the ffmpeg and ffprobe binaries can be found in the PATH.
+    """
+    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+
+def probe(file_name: str) -> Tuple[int, int, float, str]:
+    """
+    Gets the properties of the first audio stream of a file with ffprobe.
+
+    :param file_name: file to be probed.
+    :return: tuple of (sample_rate, channels, duration, container format names), duration is None when
+     it is not known.
+    """
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries",
+           "stream=sample_rate,channels,duration:format=duration,format_name", "-of", "json", file_name]
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    info = json.loads(output.stdout or "{}")
+    if output.returncode or not info.get("streams"):
+        raise CouldntDecodeError(f"No audio stream found in {file_name}: {output.stderr.decode(errors='replace')}")
+
+    stream, container = info["streams"][0], info.get("format", {})
+    duration = stream.get("duration", container.get("duration"))
+    return (int(stream["sample_rate"]), int(stream["channels"]), float(duration) if duration else None,
+            container.get("format_name", ""))
+
+
+def read_ffmpeg(file_name: str, limit: int = None, fs: int = None, channel_strategy: str = None,
+                data: bytes = None, start: float = None) -> Tuple[List[np.array], int]:
+    """
+    Decodes a file with ffmpeg, which writes raw 16 bit samples to a pipe that is read straight
+    into a numpy buffer allocated for the expected length. Only the first `limit` seconds are
+    decoded, and resampling and channel mixing are done by ffmpeg itself. With `start`, ffmpeg seeks
+    to it (`-ss`) and the `limit` seconds are counted from there.
+
+    When the content of the file is given it is fed to ffmpeg through its stdin, instead of letting
+    it read the file again, unless the container needs seeking (mp4 and the like) or a window is
+    decoded: a pipe can not be seeked, everything before `start` would be read and decoded.
+
+    :param file_name: file to be read.
+    :param limit: number of seconds to limit.
+    :param fs: sampling rate wanted, None keeps the one of the file.
+    :param channel_strategy: 'mix' or 'left' decode a single channel, anything else keeps them all.
+    :param data: content of the file when it is already in memory, see map_file.
+    :param start: second of the file where decoding starts, None for the start of the file.
+    :return: tuple of (channels, sample_rate), channels are views over the decoded buffer.
+    """
+    file_fs, nchannels, duration, container = probe(file_name)
+    fs = fs or file_fs
+
+    if data is not None and (start or any(name in SEEKABLE_CONTAINERS for name in container.split(","))):
+        data = None
+
+    cmd = ["ffmpeg", "-v", "error"]
+    if data is None:
+        cmd += ["-nostdin"]
+    if start:
+        cmd += ["-ss", str(start)]
+        duration = max(duration - start, 0) if duration else None
+    if limit:
+        cmd += ["-t", str(limit)]
+    cmd += ["-i", "pipe:0" if data is not None else file_name, "-map", "0:a:0", "-vn"]
+
+    if nchannels > 1 and channel_strategy in ("mix", "left"):
+        if channel_strategy == "mix":
+            mix = "+".join(f"{1 / nchannels}*c{channel}" for channel in range(nchannels))
+        else:
+            mix = "c0"
+        cmd += ["-af", f"pan=mono|c0={mix}"]
+        nchannels = 1
+
+    cmd += ["-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(fs), "-ac", str(nchannels), "-"]
+
+    # the duration is only an estimate, so leave a second of slack and grow the buffer if needed.
+    seconds = min(duration, limit) if duration and limit else duration or limit or 60
+    samples = np.empty((int(seconds * fs) + fs, nchannels), dtype=np.int16)
+
+    nbytes = 0
+    with subprocess.Popen(cmd, stdin=subprocess.PIPE if data is not None else None, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE) as process:
+        if data is not None:
+            # written from another thread, ffmpeg only drains its stdin while its stdout is being read.
+            feeder = threading.Thread(target=feed_pipe, args=(process.stdin, data), daemon=True)
+            feeder.start()
+
+        # drained meanwhile too, ffmpeg blocks once the stderr pipe is full (a damaged file can log an
+        # error per frame) and would never close its stdout.
+        stderr = bytearray()
+        drainer = threading.Thread(target=drain_pipe, args=(process.stderr, stderr), daemon=True)
+        drainer.start()
+
+        while True:
+            if nbytes == samples.nbytes:
+                grown = np.empty((2 * len(samples), nchannels), dtype=np.int16)
+                grown[:len(samples)] = samples
+                samples = grown
+
+            read = process.stdout.readinto(memoryview(samples).cast("B")[nbytes:])
+            if not read:
+                break
+            nbytes += read
+
+        drainer.join()
+        if data is not None:
+            feeder.join()
+
+    if process.returncode:
+        raise CouldntDecodeError(f"ffmpeg could not decode {file_name}: {stderr.decode(errors='replace')}")
+
+    samples = samples[:nbytes // samples[0].nbytes]
+    return list(samples.T), fs
+
+
+def feed_pipe(pipe, data: bytes) -> None:
+    """
+    Writes data to a pipe and closes it. ffmpeg closes its end once `-t` seconds are decoded,
+    so a broken pipe just means the rest of the data was not needed.
+
+    :param pipe: pipe to write to.
+    :param data: data to be written.
+    """
+    try:
+        pipe.write(data)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
+
+def drain_pipe(pipe, tail: bytearray, max_size: int = 2**16) -> None:
+    """
+    Reads a pipe until it is closed, keeping only the end of what was written to it.
+
+    :param pipe: pipe to read from.
+    :param tail: buffer the last bytes read are kept in.
+    :param max_size: maximum number of bytes kept.
+    """
+    for chunk in iter(lambda: pipe.read1(max_size), b""):
+        tail.extend(chunk)
+        del tail[:-max_size]
+
+
+def read_pydub(file_name: str, limit: int = None, start: float = None) -> Tuple[List[np.array], int]:
+    """
+    Reads any file supported by pydub (ffmpeg) and returns the data contained
+    within. If file reading fails due to input being a 24-bit wav file,
+    wavio is used as a backup.
+
+    pydub always decodes the whole file, a window starting at `start` is only cut afterwards.
+
+    :param file_name: file to be read.
+    :param limit: number of seconds to limit.
+    :param start: second of the file where the returned audio starts, None for the start of the file.
+    :return: tuple of (channels, sample_rate).
+    """
     # pydub does not support 24-bit wav files, use wavio when this occurs
     try:
         audiofile = AudioSegment.from_file(file_name)
 
+        if start:
+            audiofile = audiofile[int(start * 1000):]
+
         if limit:
             audiofile = audiofile[:limit * 1000]
 
@@ -78,12 +484,22 @@ def read(file_name: str, limit: int = None) -> Tuple[List[List[int]], int, str]:
         for chn in range(audiofile.channels):
             channels.append(data[chn::audiofile.channels])
 
-        audiofile.frame_rate
+        frame_rate = audiofile.frame_rate
     except audioop.error:
-        _, _, audiofile = wavio.readwav(file_name)
+        wav = wavio.read(file_name)
+        frame_rate = wav.rate
+
+        # wavio gives a (samples, channels) array, the window is cut in samples.
+        audiofile = wav.data
+        if start:
+            audiofile = audiofile[int(start * frame_rate):]
 
         if limit:
-            audiofile = audiofile[:limit * 1000]
+            audiofile = audiofile[:int(limit * frame_rate)]
+
+        # keep the most significant 16 bits of wider samples, as read_wav does.
+        if wav.sampwidth > 2:
+            audiofile = audiofile >> 8 * (wav.sampwidth - 2)
 
         audiofile = audiofile.T
         audiofile = audiofile.astype(np.int16)
@@ -92,7 +508,30 @@ def read(file_name: str, limit: int = None) -> Tuple[List[List[int]], int, str]:
         for chn in audiofile:
             channels.append(chn)
 
-    return channels, audiofile.frame_rate, unique_hash(file_name)
+    return channels, frame_rate
+
+
+def select_channels(channels: List[List[int]], strategy: str = DEFAULT_CHANNEL_STRATEGY) -> List[List[int]]:
+    """
+    Applies a channel strategy to the decoded channels of an audio file.
+
+    :param channels: list of channels, as returned by read.
+    :param strategy: 'all' keeps every channel, 'mix' averages them into a single one and
+    'left' only keeps the first one.
+    :return: the list of channels to fingerprint.
+    """
+    if strategy == "all" or len(channels) <= 1:
+        return channels
+    elif strategy == "left":
+        return channels[:1]
+    elif strategy == "mix":
+        mix = np.zeros(len(channels[0]), dtype=np.float32)
+        for channel in channels:
+            mix += channel
+        mix /= len(channels)
+        return [mix]
+
+    raise TypeError("Unsupported channel strategy supplied.")
 
 
 def get_audio_name_from_path(file_path: str) -> str:
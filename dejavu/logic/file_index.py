@@ -0,0 +1,52 @@
+import os
+from typing import Dict, Tuple
+
+from dejavu.logic.json_manifest import JsonManifest
+
+
+class FileIndex(JsonManifest):
+    """
+    Persistent manifest of the files already seen, keyed by their path. Each entry keeps the size,
+    modification time and inode the file had when it was hashed, together with its sha1 and song id,
+    so a file whose stat did not change since is known without reading it again.
+
+    The manifest is a json file, loaded when the index is created and written back every
+    checkpoint_interval indexed files and by save, so an interrupted scan keeps most of its entries.
+    The database writers index files concurrently, so updates are locked.
+    """
+    @staticmethod
+    def _signature(stat: os.stat_result) -> Dict[str, int]:
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "inode": stat.st_ino}
+
+    def lookup(self, file_path: str) -> Tuple[Dict[str, any], Dict[str, int]]:
+        """
+        Gets the entry of a file, as long as the file did not change since it was indexed.
+
+        :param file_path: path of the file.
+        :return: a tuple with the entry (a dictionary with the sha1 and song_id of the file, None if it is not
+         indexed or changed) and the current stat signature of the file, to give to update once it is hashed.
+        """
+        try:
+            signature = self._signature(os.stat(file_path))
+        except OSError:
+            return None, None
+
+        entry = self.entries.get(self._key(file_path))
+        if entry is None or any(entry[field] != value for field, value in signature.items()):
+            return None, signature
+        return entry, signature
+
+    def update(self, file_path: str, signature: Dict[str, int], file_hash: str, song_id: int = None) -> None:
+        """
+        Indexes a file. The signature has to be taken by lookup before hashing the file: if the file
+        is modified in between, the signature will not match anymore and the file is hashed again.
+
+        :param file_path: path of the file.
+        :param signature: stat signature returned by lookup.
+        :param file_hash: sha1 of the file content.
+        :param song_id: id of the song fingerprinted from the file.
+        """
+        if signature is not None:
+            with self.lock:
+                self.entries[self._key(file_path)] = {**signature, "sha1": file_hash, "song_id": song_id}
+                self._checkpoint()
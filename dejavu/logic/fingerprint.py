@@ -1,21 +1,43 @@
-import hashlib
-from operator import itemgetter
-from typing import List, Tuple
+from itertools import chain
+from math import gcd
+from typing import Collection, Dict, Iterator, List, Tuple
 
-import matplotlib.mlab as mlab
-import matplotlib.pyplot as plt
 import numpy as np
+from scipy.ndimage import maximum_filter1d
 from scipy.ndimage.filters import maximum_filter
 from scipy.ndimage.morphology import (binary_erosion,
                                       generate_binary_structure,
                                       iterate_structure)
+from scipy.signal import resample_poly
 
 from dejavu.config.settings import (CONNECTIVITY_MASK, DEFAULT_AMP_MIN,
-                                    DEFAULT_FAN_VALUE, DEFAULT_FS,
-                                    DEFAULT_OVERLAP_RATIO, DEFAULT_WINDOW_SIZE,
-                                    FINGERPRINT_REDUCTION, MAX_HASH_TIME_DELTA,
+                                    DEFAULT_BLOCK_FRAMES, DEFAULT_FAN_VALUE,
+                                    DEFAULT_FREQ_ZONES, DEFAULT_FS,
+                                    DEFAULT_MAX_FREQ, DEFAULT_MIN_FREQ,
+                                    DEFAULT_OVERLAP_RATIO,
+                                    DEFAULT_PEAKS_PER_SLICE,
+                                    DEFAULT_SLICE_FRAMES, DEFAULT_WINDOW_SIZE,
+                                    FINGERPRINT_BATCH_SIZE,
+                                    FINGERPRINT_DELTA_BITS,
+                                    FINGERPRINT_FREQ_BITS,
+                                    FINGERPRINT_PROFILES, MAX_HASH_TIME_DELTA,
                                     MIN_HASH_TIME_DELTA,
-                                    PEAK_NEIGHBORHOOD_SIZE, PEAK_SORT)
+                                    PEAK_DETECTOR, PEAK_NEIGHBORHOOD_SIZE,
+                                    PEAK_SORT)
+from dejavu.logic.stft import spectrogram
+
+
+def get_fingerprint_profile(profile: str = "default") -> Dict[str, any]:
+    """
+    Given a profile name it returns the fingerprint parameters for that profile.
+
+    :param profile: name of a profile in FINGERPRINT_PROFILES.
+    :return: a dictionary with the keyword arguments to give to fingerprint.
+    """
+    try:
+        return dict(FINGERPRINT_PROFILES[profile])
+    except KeyError:
+        raise TypeError("Unsupported fingerprint profile supplied.")
 
 
 def fingerprint(channel_samples: List[int],
@@ -23,53 +45,247 @@ def fingerprint(channel_samples: List[int],
                 wsize: int = DEFAULT_WINDOW_SIZE,
                 wratio: float = DEFAULT_OVERLAP_RATIO,
                 fan_value: int = DEFAULT_FAN_VALUE,
-                amp_min: int = DEFAULT_AMP_MIN) -> List[Tuple[str, int]]:
+                amp_min: int = DEFAULT_AMP_MIN,
+                peaks_per_slice: int = DEFAULT_PEAKS_PER_SLICE,
+                slice_frames: int = DEFAULT_SLICE_FRAMES,
+                freq_zones: int = DEFAULT_FREQ_ZONES,
+                target_fs: int = None,
+                min_freq: int = DEFAULT_MIN_FREQ,
+                max_freq: int = DEFAULT_MAX_FREQ) -> List[Tuple[int, int]]:
     """
     FFT the channel, log transform output, find local maxima, then return locally sensitive hashes.
     """
+    return list(iter_fingerprints(channel_samples, Fs=Fs, wsize=wsize, wratio=wratio, fan_value=fan_value,
+                                  amp_min=amp_min, peaks_per_slice=peaks_per_slice, slice_frames=slice_frames,
+                                  freq_zones=freq_zones, target_fs=target_fs, min_freq=min_freq,
+                                  max_freq=max_freq))
+
+
+def iter_fingerprints(channel_samples: List[int],
+                      Fs: int = DEFAULT_FS,
+                      wsize: int = DEFAULT_WINDOW_SIZE,
+                      wratio: float = DEFAULT_OVERLAP_RATIO,
+                      fan_value: int = DEFAULT_FAN_VALUE,
+                      amp_min: int = DEFAULT_AMP_MIN,
+                      peaks_per_slice: int = DEFAULT_PEAKS_PER_SLICE,
+                      slice_frames: int = DEFAULT_SLICE_FRAMES,
+                      freq_zones: int = DEFAULT_FREQ_ZONES,
+                      target_fs: int = None,
+                      min_freq: int = DEFAULT_MIN_FREQ,
+                      max_freq: int = DEFAULT_MAX_FREQ,
+                      block_frames: int = DEFAULT_BLOCK_FRAMES) -> Iterator[Tuple[int, int]]:
+    """
+    Same as fingerprint, but the channel is processed block_frames spectrogram frames at a time and the
+    hashes are yielded as soon as they are final, so memory does not grow with the length of the track.
+
+    The last frames of each block are carried over to the next one as context for the peak search
+    (PEAK_NEIGHBORHOOD_SIZE frames on each side of the ones being finalized), as are the last
+    fan_value - 1 peaks which still need their neighbors to be paired. When peaks_per_slice is set, frames
+    are only finalized once their whole time slice is known. The result is the same as fingerprinting the
+    whole spectrogram at once.
+
+    :param channel_samples: channel info of the audio.
+    :param Fs: sampling rate of the samples.
+    :param wsize: size of the FFT window.
+    :param wratio: ratio by which each sequential window overlaps the last and the next window.
+    :param fan_value: degree to which a fingerprint can be paired with its neighbors.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :param peaks_per_slice: maximum number of peaks kept per time slice and frequency zone, None keeps them all.
+    :param slice_frames: length of the time slices, in spectrogram frames.
+    :param freq_zones: number of equally sized frequency zones the spectrum is split into.
+    :param target_fs: sampling rate the channel is downsampled to before the FFT, None keeps Fs.
+    :param min_freq: lowest frequency fingerprinted, in Hz, None for no limit.
+    :param max_freq: highest frequency fingerprinted, in Hz, None for no limit.
+    :param block_frames: number of spectrogram frames computed at once.
+    :return: a generator of hashes with their corresponding offsets.
+    """
+    if target_fs and target_fs != Fs:
+        channel_samples = downsample(channel_samples, Fs, target_fs)
+        Fs = target_fs
+
+    nfft, hop = fft_window(wsize, wratio)
+    min_bin, max_bin, freq_bits = freq_band(nfft, Fs, min_freq, max_freq)
+
+    # amount of frames, shorter inputs are zero padded to a single frame.
+    nframes = max(1, (len(channel_samples) - nfft) // hop + 1)
+
+    carry = np.empty((max_bin - min_bin, 0), dtype=np.float32)
+    core_start = 0
+    tail_freqs = tail_times = np.empty(0, dtype=np.int64)
+    for start in range(0, nframes, block_frames):
+        stop = min(start + block_frames, nframes)
+        last_block = stop == nframes
+
+        block = spectrogram(channel_samples[start * hop: (stop - 1) * hop + nfft], Fs=Fs, nfft=nfft,
+                            noverlap=nfft - hop, min_bin=min_bin, max_bin=max_bin)
+        arr2D = np.hstack((carry, block))
+        # frame index of the first column of arr2D
+        offset = start - carry.shape[1]
+
+        # peaks closer than PEAK_NEIGHBORHOOD_SIZE to the end of the block may change with the next one.
+        core_end = stop if last_block else max(core_start, stop - PEAK_NEIGHBORHOOD_SIZE)
+        if peaks_per_slice and not last_block:
+            # and peaks can only be selected once their time slice is complete.
+            core_end = max(core_start, core_end - core_end % slice_frames)
+
+        freqs, times = find_peaks(arr2D, amp_min=amp_min)
+        in_core = (times >= core_start - offset) & (times < core_end - offset)
+        freqs, times = freqs[in_core], times[in_core]
+
+        if peaks_per_slice:
+            strongest = select_peaks(freqs, times + offset, arr2D[freqs, times], peaks_per_slice=peaks_per_slice,
+                                     slice_frames=slice_frames, freq_zones=freq_zones, nbins=arr2D.shape[0])
+            freqs, times = freqs[strongest], times[strongest]
+
+        times += offset
+
+        if PEAK_SORT:
+            # stable sort, so peaks sharing the same time keep their original order.
+            order = np.argsort(times, kind="stable")
+            freqs, times = freqs[order], times[order]
+
+        freqs, times = np.concatenate((tail_freqs, freqs)), np.concatenate((tail_times, times))
+
+        # anchors whose fan out may include peaks of the next block are kept for later.
+        anchors = len(freqs) if last_block else max(0, len(freqs) - max(fan_value - 1, 0))
+        yield from pair_peaks(freqs, times, fan_value=fan_value, anchors=anchors, freq_bits=freq_bits)
+
+        tail_freqs, tail_times = freqs[anchors:], times[anchors:]
+        carry = arr2D[:, max(0, core_end - PEAK_NEIGHBORHOOD_SIZE - offset):]
+        core_start = core_end
+
+
+def fingerprint_batch(clips: List[List[int]],
+                      Fs: int = DEFAULT_FS,
+                      wsize: int = DEFAULT_WINDOW_SIZE,
+                      wratio: float = DEFAULT_OVERLAP_RATIO,
+                      fan_value: int = DEFAULT_FAN_VALUE,
+                      amp_min: int = DEFAULT_AMP_MIN,
+                      peaks_per_slice: int = DEFAULT_PEAKS_PER_SLICE,
+                      slice_frames: int = DEFAULT_SLICE_FRAMES,
+                      freq_zones: int = DEFAULT_FREQ_ZONES,
+                      target_fs: int = None,
+                      min_freq: int = DEFAULT_MIN_FREQ,
+                      max_freq: int = DEFAULT_MAX_FREQ,
+                      workers: int = -1,
+                      batch_size: int = FINGERPRINT_BATCH_SIZE) -> List[List[Tuple[int, int]]]:
+    """
+    Fingerprints several clips at once, giving for each one the same hashes fingerprint would.
 
-    # ------------------------------------------
-    # MEMORY-SAFE PATCH
-    # ------------------------------------------
+    Clips of the same length are stacked into a single matrix, so the framing, the FFT (split across
+    threads) and the peak filters run once per length instead of once per clip. Only selecting and
+    pairing the peaks is done clip by clip. At most batch_size clips are stacked at once, the memory
+    taken grows with it.
 
-    # Dejavu default wsize = 4096 is too big for numpy 2.x (328MB crash)
-    SAFE_WSIZE = min(2048, wsize)     # safer FFT window
-    SAFE_WSIZE = max(512, SAFE_WSIZE) # ensure minimum size
+    :param clips: list with the channel samples of every clip, all of them sampled at Fs.
+    :param Fs: sampling rate of the clips.
+    :param wsize: size of the FFT window.
+    :param wratio: ratio by which each sequential window overlaps the last and the next window.
+    :param fan_value: degree to which a fingerprint can be paired with its neighbors.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :param peaks_per_slice: maximum number of peaks kept per time slice and frequency zone, None keeps them all.
+    :param slice_frames: length of the time slices, in spectrogram frames.
+    :param freq_zones: number of equally sized frequency zones the spectrum is split into.
+    :param target_fs: sampling rate the clips are downsampled to before the FFT, None keeps Fs.
+    :param min_freq: lowest frequency fingerprinted, in Hz, None for no limit.
+    :param max_freq: highest frequency fingerprinted, in Hz, None for no limit.
+    :param workers: number of threads the FFT is split into, -1 uses every cpu.
+    :param batch_size: maximum number of clips fingerprinted at once.
+    :return: a list with the hashes and offsets of every clip, in the same order as the clips.
+    """
+    nfft, hop = fft_window(wsize, wratio)
+
+    lengths = {}
+    for index, clip in enumerate(clips):
+        lengths.setdefault(len(clip), []).append(index)
+
+    hashes = [None] * len(clips)
+    for same_length in lengths.values():
+        for first in range(0, len(same_length), batch_size):
+            indexes = same_length[first:first + batch_size]
+            batch = np.stack([np.asarray(clips[index], dtype=np.float32) for index in indexes])
+            batch_fs = Fs
+            if target_fs and target_fs != Fs:
+                batch = downsample(batch, Fs, target_fs)
+                batch_fs = target_fs
+
+            min_bin, max_bin, freq_bits = freq_band(nfft, batch_fs, min_freq, max_freq)
+            arr3D = spectrogram(batch, Fs=batch_fs, nfft=nfft, noverlap=nfft - hop, workers=workers,
+                                min_bin=min_bin, max_bin=max_bin)
+
+            if PEAK_DETECTOR == "separable" and CONNECTIVITY_MASK == 2:
+                clip_ids, freqs, times = find_peaks_separable(arr3D, amp_min=amp_min)
+                # peaks come sorted by clip, find where the ones of each clip start.
+                bounds = np.searchsorted(clip_ids, np.arange(len(indexes) + 1))
+                peaks = [(freqs[start:stop], times[start:stop]) for start, stop in zip(bounds[:-1], bounds[1:])]
+            else:
+                peaks = [find_peaks_morphology(arr2D, amp_min=amp_min) for arr2D in arr3D]
+
+            for index, arr2D, (freqs, times) in zip(indexes, arr3D, peaks):
+                if peaks_per_slice:
+                    strongest = select_peaks(freqs, times, arr2D[freqs, times], peaks_per_slice=peaks_per_slice,
+                                             slice_frames=slice_frames, freq_zones=freq_zones, nbins=arr2D.shape[0])
+                    freqs, times = freqs[strongest], times[strongest]
+
+                if PEAK_SORT:
+                    order = np.argsort(times, kind="stable")
+                    freqs, times = freqs[order], times[order]
+
+                hashes[index] = pair_peaks(freqs, times, fan_value=fan_value, freq_bits=freq_bits)
 
-    # Limit NFFT too
-    SAFE_NFFT = min(2048, SAFE_WSIZE)
+    return hashes
+
+
+def fft_window(wsize: int = DEFAULT_WINDOW_SIZE, wratio: float = DEFAULT_OVERLAP_RATIO) -> Tuple[int, int]:
+    """
+    Returns the FFT length and the hop between frames fingerprint uses for the given window settings.
+
+    :param wsize: size of the FFT window.
+    :param wratio: ratio by which each sequential window overlaps the last and the next window.
+    :return: a tuple with the FFT length and the hop, in samples.
+    """
+    # Fingerprints have always been computed with FFT windows clamped to [512, 2048] samples (it started as a
+    # memory safety patch), keep it that way so new hashes stay compatible with the ones in the database.
+    nfft = max(512, min(2048, wsize))
+    return nfft, nfft - int(nfft * wratio)
 
-    # Trim long audio (5–15s limit)
-    # Avoids huge spectrogram matrices
-    MAX_SAMPLES = Fs * 15
-    if len(channel_samples) > MAX_SAMPLES:
-        channel_samples = channel_samples[:MAX_SAMPLES]
 
-    # ------------------------------------------
-    # SAFE SPECTROGRAM GENERATION
-    # ------------------------------------------
-    arr2D = mlab.specgram(
-        channel_samples,
-        NFFT=SAFE_NFFT,
-        Fs=Fs,
-        window=mlab.window_hanning,
-        noverlap=int(SAFE_NFFT * wratio)
-    )[0]
+def freq_band(nfft: int, Fs: int, min_freq: int = DEFAULT_MIN_FREQ, max_freq: int = DEFAULT_MAX_FREQ)\
+        -> Tuple[int, int, int]:
+    """
+    Returns the spectrogram bins of a frequency band and the bits its hashes use per frequency.
+
+    :param nfft: length of the FFT window.
+    :param Fs: sampling rate of the samples.
+    :param min_freq: lowest frequency of the band, in Hz, None for no limit.
+    :param max_freq: highest frequency of the band, in Hz, None for no limit.
+    :return: a tuple with the first bin, the bin after the last one and the bits per frequency.
+    """
+    nbins = nfft // 2 + 1
+    if min_freq is None and max_freq is None:
+        return 0, nbins, FINGERPRINT_FREQ_BITS
 
-    # ------------------------------------------
-    # LOG TRANSFORM
-    # ------------------------------------------
-    arr2D = 10 * np.log10(arr2D, out=np.zeros_like(arr2D), where=(arr2D != 0))
+    min_bin = 0 if min_freq is None else min(nbins, int(np.ceil(min_freq * nfft / Fs)))
+    max_bin = nbins if max_freq is None else min(nbins, int(max_freq * nfft / Fs) + 1)
+    if max_bin <= min_bin:
+        raise ValueError(f"Frequency band [{min_freq}, {max_freq}] Hz holds no bins at {Fs} Hz.")
 
-    # ------------------------------------------
-    # PEAK EXTRACTION
-    # ------------------------------------------
-    local_maxima = get_2D_peaks(arr2D, plot=False, amp_min=amp_min)
+    # bins are counted from the lower edge of the band.
+    return min_bin, max_bin, max(1, (max_bin - min_bin - 1).bit_length())
 
-    # ------------------------------------------
-    # RETURN HASHES
-    # ------------------------------------------
-    return generate_hashes(local_maxima, fan_value=fan_value)
+
+def downsample(channel_samples: List[int], Fs: int, target_fs: int) -> np.array:
+    """
+    Resamples a channel to a lower sampling rate. The polyphase resampler low-pass filters the signal
+    below the new Nyquist frequency first, so higher frequencies do not alias into the fingerprinted band.
+
+    :param channel_samples: channel info of the audio, or a matrix with one channel per row.
+    :param Fs: sampling rate of the samples.
+    :param target_fs: new sampling rate.
+    :return: the resampled channel, in float32.
+    """
+    factor = gcd(Fs, target_fs)
+    return resample_poly(np.asarray(channel_samples, dtype=np.float32), target_fs // factor, Fs // factor, axis=-1)
 
 
 def get_2D_peaks(arr2D: np.array, plot: bool = False, amp_min: int = DEFAULT_AMP_MIN)\
@@ -82,6 +298,78 @@ def get_2D_peaks(arr2D: np.array, plot: bool = False, amp_min: int = DEFAULT_AMP
     :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
     :return: a list composed by a list of frequencies and times.
     """
+    freqs_filter, times_filter = find_peaks(arr2D, amp_min=amp_min)
+
+    if plot:
+        # imported here so workers don't pay for matplotlib unless they plot.
+        import matplotlib.pyplot as plt
+
+        # scatter of the peaks
+        fig, ax = plt.subplots()
+        ax.imshow(arr2D)
+        ax.scatter(times_filter, freqs_filter)
+        ax.set_xlabel('Time')
+        ax.set_ylabel('Frequency')
+        ax.set_title("Spectrogram")
+        plt.gca().invert_yaxis()
+        plt.show()
+
+    return list(zip(freqs_filter, times_filter))
+
+
+def find_peaks(arr2D: np.array, amp_min: int = DEFAULT_AMP_MIN) -> Tuple[np.array, np.array]:
+    """
+    Extract maximum peaks from the spectogram matrix (arr2D) with the detector set in PEAK_DETECTOR.
+    The separable detector only applies to the square mask, the diamond one always uses morphology.
+
+    :param arr2D: matrix representing the spectogram.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :return: a tuple with the arrays of frequencies and times of the peaks, sorted by frequency.
+    """
+    if PEAK_DETECTOR == "separable" and CONNECTIVITY_MASK == 2:
+        return find_peaks_separable(arr2D, amp_min=amp_min)
+    return find_peaks_morphology(arr2D, amp_min=amp_min)
+
+
+def find_peaks_separable(arr2D: np.array, amp_min: int = DEFAULT_AMP_MIN) -> Tuple[np.array, np.array]:
+    """
+    Extract maximum peaks from the spectogram matrix (arr2D) using a square neighborhood.
+
+    Gives the same peaks as find_peaks_morphology with CONNECTIVITY_MASK = 2, but the square maximum
+    filter is split in two 1-D running maximums (one per axis) and the background erosion is skipped:
+    an eroded background cell is zero, so it never passes an amp_min >= 0 threshold anyway. Only for
+    negative thresholds the erosion is needed, and it is done with the same 1-D running maximums.
+
+    The filters run over the last two axes, so a stack of spectrograms is handled in a single pass.
+
+    :param arr2D: matrix representing the spectogram, or a stack of them.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :return: a tuple with the arrays of frequencies and times of the peaks, sorted by frequency. Stacks
+     get an extra leading array with the index of the spectrogram each peak belongs to.
+    """
+    size = PEAK_NEIGHBORHOOD_SIZE * 2 + 1
+
+    local_max = maximum_filter1d(maximum_filter1d(arr2D, size, axis=-1), size, axis=-2) == arr2D
+    detected_peaks = local_max & (arr2D > amp_min)
+
+    if amp_min < 0:
+        # background cells (zeros) only surrounded by background, counting the outside as background too.
+        foreground = (arr2D != 0).view(np.uint8)
+        foreground_near = maximum_filter1d(maximum_filter1d(foreground, size, axis=-1, mode="constant"),
+                                           size, axis=-2, mode="constant")
+        detected_peaks &= foreground_near.view(bool)
+
+    return np.nonzero(detected_peaks)
+
+
+def find_peaks_morphology(arr2D: np.array, amp_min: int = DEFAULT_AMP_MIN) -> Tuple[np.array, np.array]:
+    """
+    Extract maximum peaks from the spectogram matrix (arr2D) using a morphology mask.
+
+    :param arr2D: matrix representing the spectogram.
+    :param amp_min: minimum amplitude in spectrogram in order to be considered a peak.
+    :return: a tuple with the arrays of frequencies and times of the peaks, sorted by frequency.
+    """
     # Original code from the repo is using a morphology mask that does not consider diagonal elements
     # as neighbors (basically a diamond figure) and then applies a dilation over it, so what I'm proposing
     # is to change from the current diamond figure to a just a normal square one:
@@ -122,55 +410,111 @@ def get_2D_peaks(arr2D: np.array, plot: bool = False, amp_min: int = DEFAULT_AMP
     # get indices for frequency and time
     filter_idxs = np.where(amps > amp_min)
 
-    freqs_filter = freqs[filter_idxs]
-    times_filter = times[filter_idxs]
+    return freqs[filter_idxs], times[filter_idxs]
 
-    if plot:
-        # scatter of the peaks
-        fig, ax = plt.subplots()
-        ax.imshow(arr2D)
-        ax.scatter(times_filter, freqs_filter)
-        ax.set_xlabel('Time')
-        ax.set_ylabel('Frequency')
-        ax.set_title("Spectrogram")
-        plt.gca().invert_yaxis()
-        plt.show()
 
-    return list(zip(freqs_filter, times_filter))
+def select_peaks(freqs: np.array, times: np.array, amps: np.array, peaks_per_slice: int,
+                 slice_frames: int = DEFAULT_SLICE_FRAMES, freq_zones: int = DEFAULT_FREQ_ZONES,
+                 nbins: int = DEFAULT_WINDOW_SIZE // 2 + 1) -> np.array:
+    """
+    Keeps the strongest peaks of each cell of a grid made of time slices and frequency zones, so the amount
+    of hashes per second does not depend on how loud or dense the audio is.
+
+    :param freqs: peak frequencies.
+    :param times: peak times.
+    :param amps: peak amplitudes.
+    :param peaks_per_slice: maximum number of peaks kept per time slice and frequency zone.
+    :param slice_frames: length of the time slices, in spectrogram frames.
+    :param freq_zones: number of equally sized frequency zones the spectrum is split into.
+    :param nbins: number of frequency bins of the spectrogram.
+    :return: a boolean mask with the peaks to keep.
+    """
+    cells = (times // slice_frames) * freq_zones + freqs * freq_zones // nbins
+
+    # sort by cell and then by decreasing amplitude, the rank of a peak is its position within its cell.
+    order = np.lexsort((-amps, cells))
+    sorted_cells = cells[order]
+    cell_starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+    ranks = np.arange(len(order)) - np.repeat(cell_starts, np.diff(np.r_[cell_starts, len(order)]))
+
+    keep = np.zeros(len(order), dtype=bool)
+    keep[order[ranks < peaks_per_slice]] = True
+    return keep
 
 
-def generate_hashes(peaks: List[Tuple[int, int]], fan_value: int = DEFAULT_FAN_VALUE) -> List[Tuple[str, int]]:
+def generate_hashes(peaks: List[Tuple[int, int]], fan_value: int = DEFAULT_FAN_VALUE) -> List[Tuple[int, int]]:
     """
     Hash list structure:
-       sha1_hash[0:FINGERPRINT_REDUCTION]    time_offset
-        [(e05b341a9b77a51fd26, 32), ... ]
+       packed (freq1, freq2, t_delta)    time_offset
+        [(2199027351557, 32), ... ]
+
+    Every peak is paired with the following fan_value - 1 peaks at once using numpy, the time delta
+    filter is applied as a mask and each landmark is bit-packed into a single integer
+    (see FINGERPRINT_FREQ_BITS and FINGERPRINT_DELTA_BITS in the settings).
 
     :param peaks: list of peak frequencies and times.
     :param fan_value: degree to which a fingerprint can be paired with its neighbors.
     :return: a list of hashes with their corresponding offsets.
     """
-    # frequencies are in the first position of the tuples
-    idx_freq = 0
-    # times are in the second position of the tuples
-    idx_time = 1
+    peaks = np.asarray(peaks, dtype=np.int64).reshape(-1, 2)
+    # frequencies are in the first column and times in the second one
+    freqs, times = peaks[:, 0], peaks[:, 1]
 
     if PEAK_SORT:
-        peaks.sort(key=itemgetter(1))
+        # stable sort, so peaks sharing the same time keep their original order.
+        order = np.argsort(times, kind="stable")
+        freqs, times = freqs[order], times[order]
 
-    hashes = []
-    for i in range(len(peaks)):
-        for j in range(1, fan_value):
-            if (i + j) < len(peaks):
+    return pair_peaks(freqs, times, fan_value=fan_value)
 
-                freq1 = peaks[i][idx_freq]
-                freq2 = peaks[i + j][idx_freq]
-                t1 = peaks[i][idx_time]
-                t2 = peaks[i + j][idx_time]
-                t_delta = t2 - t1
 
-                if MIN_HASH_TIME_DELTA <= t_delta <= MAX_HASH_TIME_DELTA:
-                    h = hashlib.sha1(f"{str(freq1)}|{str(freq2)}|{str(t_delta)}".encode('utf-8'))
+def pair_peaks(freqs: np.array, times: np.array, fan_value: int = DEFAULT_FAN_VALUE, anchors: int = None,
+               freq_bits: int = FINGERPRINT_FREQ_BITS) -> List[Tuple[int, int]]:
+    """
+    Pairs every peak with the following fan_value - 1 ones and packs each pair into a hash.
 
-                    hashes.append((h.hexdigest()[0:FINGERPRINT_REDUCTION], t1))
+    :param freqs: peak frequencies, in pairing order.
+    :param times: peak times, in pairing order.
+    :param fan_value: degree to which a fingerprint can be paired with its neighbors.
+    :param anchors: only the first `anchors` peaks are paired with their neighbors, all of them if None.
+    :param freq_bits: bits each frequency takes in the hash, see freq_band.
+    :return: a list of hashes with their corresponding offsets.
+    """
+    if freqs.max(initial=0) >> freq_bits:
+        raise ValueError(f"Peak frequency bins do not fit in {freq_bits} bits.")
 
-    return hashes
+    anchors = len(freqs) if anchors is None else anchors
+
+    # anchor i is paired with i + j for j in [1, fan_value), shape (anchors, fan_value - 1)
+    anchor_idxs = np.arange(anchors)[:, np.newaxis]
+    pairs = anchor_idxs + np.arange(1, max(fan_value, 1))[np.newaxis, :]
+    in_range = pairs < len(freqs)
+
+    anchor_idxs = np.broadcast_to(anchor_idxs, pairs.shape)[in_range]
+    pairs = pairs[in_range]
+
+    t1 = times[anchor_idxs]
+    t_delta = times[pairs] - t1
+
+    valid = (t_delta >= MIN_HASH_TIME_DELTA) & (t_delta <= MAX_HASH_TIME_DELTA)
+
+    hashes = (freqs[anchor_idxs][valid] << (freq_bits + FINGERPRINT_DELTA_BITS)) \
+        | (freqs[pairs][valid] << FINGERPRINT_DELTA_BITS) \
+        | (t_delta[valid] - MIN_HASH_TIME_DELTA)
+
+    return list(zip(hashes.tolist(), t1[valid].tolist()))
+
+
+def fingerprints_array(fingerprints: Collection[Tuple[int, int]]) -> np.ndarray:
+    """
+    Packs fingerprints into a single contiguous array, which is pickled (to send it to another process)
+    as one buffer instead of one object per hash and offset.
+
+    :param fingerprints: hashes with their corresponding offsets.
+    :return: an int64 array of (hash, offset) rows.
+    """
+    if isinstance(fingerprints, np.ndarray):
+        return fingerprints.astype(np.int64, copy=False).reshape(-1, 2)
+
+    return np.fromiter(chain.from_iterable(fingerprints), dtype=np.int64,
+                       count=2 * len(fingerprints)).reshape(-1, 2)
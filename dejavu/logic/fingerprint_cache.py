@@ -0,0 +1,197 @@
+import os
+import tempfile
+import threading
+from hashlib import sha1
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+from dejavu.config.settings import (CONNECTIVITY_MASK, DECODER_BACKEND,
+                                    DEFAULT_AMP_MIN,
+                                    DEFAULT_FAN_VALUE, DEFAULT_FREQ_ZONES,
+                                    DEFAULT_MAX_FREQ, DEFAULT_MIN_FREQ,
+                                    DEFAULT_OVERLAP_RATIO,
+                                    DEFAULT_PEAKS_PER_SLICE,
+                                    DEFAULT_SLICE_FRAMES, DEFAULT_WINDOW_SIZE,
+                                    FINGERPRINT_CACHE_MAX_SIZE,
+                                    FINGERPRINT_DELTA_BITS,
+                                    FINGERPRINT_FREQ_BITS, MAX_HASH_TIME_DELTA,
+                                    MIN_HASH_TIME_DELTA, PEAK_NEIGHBORHOOD_SIZE,
+                                    PEAK_SORT)
+from dejavu.logic.fingerprint import fingerprints_array
+
+# Bump it whenever a change to the fingerprinting code gives different hashes for the same parameters,
+# so entries cached by the previous code are not used anymore.
+FINGERPRINT_CACHE_VERSION = 2
+
+CACHE_EXTENSION = ".npz"
+
+# Share of max_size the cache is brought down to when it grows over it, so the next entries can be
+# stored without listing the directory again right away.
+EVICTION_TARGET = 0.9
+
+
+def fingerprint_version(fingerprint_params: Dict[str, any], channel_strategy: str, limit: int = None) -> str:
+    """
+    Identifies every setting the hashes of a file depend on, so files fingerprinted with different
+    settings never share a cache entry.
+
+    :param fingerprint_params: fingerprint parameters overriding the defaults, see FINGERPRINT_PROFILES.
+    :param channel_strategy: how multichannel audio is fingerprinted.
+    :param limit: number of seconds fingerprinted from the start of the file, None for the whole file.
+    :return: a short hexadecimal digest of the settings.
+    """
+    settings = {
+        "wsize": DEFAULT_WINDOW_SIZE,
+        "wratio": DEFAULT_OVERLAP_RATIO,
+        "fan_value": DEFAULT_FAN_VALUE,
+        "amp_min": DEFAULT_AMP_MIN,
+        "peaks_per_slice": DEFAULT_PEAKS_PER_SLICE,
+        "slice_frames": DEFAULT_SLICE_FRAMES,
+        "freq_zones": DEFAULT_FREQ_ZONES,
+        "target_fs": None,
+        "min_freq": DEFAULT_MIN_FREQ,
+        "max_freq": DEFAULT_MAX_FREQ,
+        **fingerprint_params,
+        "channel_strategy": channel_strategy,
+        "limit": limit,
+        "constants": (FINGERPRINT_CACHE_VERSION, DECODER_BACKEND, CONNECTIVITY_MASK, PEAK_NEIGHBORHOOD_SIZE,
+                      PEAK_SORT, MIN_HASH_TIME_DELTA, MAX_HASH_TIME_DELTA, FINGERPRINT_FREQ_BITS,
+                      FINGERPRINT_DELTA_BITS)
+    }
+    return sha1(repr(sorted(settings.items())).encode("utf-8")).hexdigest()[:16]
+
+
+class FingerprintCache:
+    """
+    Content addressed cache of file fingerprints on disk. Entries are keyed by the sha1 of the file
+    content and the fingerprint version, and hold the hashes and offsets as two numpy arrays.
+
+    Hits refresh the modification time of the entry, and when the directory grows over max_size
+    the least recently used entries are removed. Entries are written to a temporary file and then
+    renamed, so several processes can share the same directory.
+
+    The size of the directory is listed once per process and then kept up to date as entries are
+    stored. It is shared by the instances of a process, fingerprint workers get a copy of the cache
+    for every file. Entries stored by other processes are only accounted for at the next eviction.
+    """
+    sizes = {}
+    lock = threading.Lock()
+
+    def __init__(self, directory: str, version: str, max_size: int = FINGERPRINT_CACHE_MAX_SIZE):
+        """
+        :param directory: directory where the entries are kept, created if missing.
+        :param version: fingerprint version of the entries, see fingerprint_version.
+        :param max_size: maximum size of the directory, in bytes.
+        """
+        self.directory = directory
+        self.version = version
+        self.max_size = max_size
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.size()
+
+    def path(self, file_hash: str) -> str:
+        """
+        Path of the entry for the given file.
+
+        :param file_hash: sha1 of the file content.
+        :return: the path of the entry.
+        """
+        return os.path.join(self.directory, f"{file_hash}_{self.version}{CACHE_EXTENSION}")
+
+    def size(self) -> int:
+        """
+        :return: the size of the entries in the directory, as known by this process.
+        """
+        with FingerprintCache.lock:
+            if self.directory not in FingerprintCache.sizes:
+                FingerprintCache.sizes[self.directory] = sum(size for _, size, _ in self.entries())
+            return FingerprintCache.sizes[self.directory]
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """
+        Lists the entries in the directory.
+
+        :return: a list of (modification time, size, path) tuples.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(CACHE_EXTENSION):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def get(self, file_hash: str) -> Set[Tuple[int, int]]:
+        """
+        Looks up the fingerprints of a file.
+
+        :param file_hash: sha1 of the file content.
+        :return: a set of hashes with their corresponding offsets, or None if the file is not cached.
+        """
+        path = self.path(file_hash)
+        try:
+            with np.load(path) as entry:
+                hashes, offsets = entry["hashes"], entry["offsets"]
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            # missing, evicted by another process meanwhile, or unreadable.
+            return None
+
+        return set(zip(hashes.tolist(), offsets.tolist()))
+
+    def put(self, file_hash: str, fingerprints: Set[Tuple[int, int]]) -> None:
+        """
+        Stores the fingerprints of a file, evicting the least recently used entries if needed.
+
+        :param file_hash: sha1 of the file content.
+        :param fingerprints: hashes with their corresponding offsets, or an array of (hash, offset) rows.
+        """
+        fingerprints = fingerprints_array(fingerprints)
+        self.size()
+
+        path = self.path(file_hash)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, hashes=fingerprints[:, 0], offsets=fingerprints[:, 1].astype(np.uint32))
+            stored = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with FingerprintCache.lock:
+            FingerprintCache.sizes[self.directory] += stored - replaced
+            full = FingerprintCache.sizes[self.directory] > self.max_size
+
+        if full:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries until the directory fits in EVICTION_TARGET of max_size.
+        """
+        entries = self.entries()
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= EVICTION_TARGET * self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
+
+        with FingerprintCache.lock:
+            FingerprintCache.sizes[self.directory] = size
@@ -0,0 +1,95 @@
+from collections import Counter
+from typing import Dict
+
+from dejavu.config.settings import (INGEST_CHECKPOINT_INTERVAL,
+                                    INGEST_MAX_ATTEMPTS)
+from dejavu.logic.json_manifest import JsonManifest
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+
+class IngestJob(JsonManifest):
+    """
+    Persistent progress of a bulk ingestion, so an interrupted import continues where it stopped. The
+    manifest keeps the state of every file handed to the job (pending, in_progress, done or failed)
+    with the number of attempts made and, once done, its sha1 and song id.
+
+    Files still in progress when the manifest is loaded were interrupted and are tried again, as are
+    failed files until they reach max_attempts. The manifest is a json file written back every
+    checkpoint_interval finished files and by save. States are updated from several threads, the
+    fingerprinting pool feeder, the main thread and the database writers, so every access is locked.
+    """
+    def __init__(self, path: str, max_attempts: int = INGEST_MAX_ATTEMPTS,
+                 checkpoint_interval: int = INGEST_CHECKPOINT_INTERVAL):
+        """
+        :param path: path of the manifest file, created on the first save if missing.
+        :param max_attempts: times a file is tried before it is left as failed.
+        :param checkpoint_interval: number of files finished between two saves of the manifest.
+        """
+        super().__init__(path, checkpoint_interval)
+        self.max_attempts = max_attempts
+
+        for entry in self.entries.values():
+            if entry["state"] == IN_PROGRESS:
+                # interrupted, it goes back to the queue.
+                entry["state"] = PENDING
+
+    def pending(self, file_path: str) -> bool:
+        """
+        Tells whether a file still has to be ingested.
+
+        :param file_path: path of the file.
+        :return: False if the file is done or failed max_attempts times already.
+        """
+        with self.lock:
+            entry = self.entries.get(self._key(file_path))
+            if entry is None:
+                return True
+            return entry["state"] != DONE and entry["attempts"] < self.max_attempts
+
+    def start(self, file_path: str) -> None:
+        """
+        Marks a file as being ingested, one more attempt.
+
+        :param file_path: path of the file.
+        """
+        with self.lock:
+            entry = self.entries.setdefault(self._key(file_path), {"state": PENDING, "attempts": 0})
+            entry["state"] = IN_PROGRESS
+            entry["attempts"] += 1
+
+    def done(self, file_path: str, file_hash: str, song_id: int = None) -> None:
+        """
+        Marks a file as ingested.
+
+        :param file_path: path of the file.
+        :param file_hash: sha1 of the file content.
+        :param song_id: id of the song fingerprinted from the file.
+        """
+        with self.lock:
+            entry = self.entries.setdefault(self._key(file_path), {"attempts": 0})
+            entry.update(state=DONE, sha1=file_hash, song_id=song_id)
+            entry.pop("error", None)
+            self._checkpoint()
+
+    def fail(self, file_path: str, error: str) -> None:
+        """
+        Marks the current attempt of a file as failed.
+
+        :param file_path: path of the file.
+        :param error: description of the error.
+        """
+        with self.lock:
+            entry = self.entries.setdefault(self._key(file_path), {"attempts": 1})
+            entry.update(state=FAILED, error=error)
+            self._checkpoint()
+
+    def summary(self) -> Dict[str, int]:
+        """
+        :return: the number of files in each state.
+        """
+        with self.lock:
+            return dict(Counter(entry["state"] for entry in self.entries.values()))
@@ -0,0 +1,57 @@
+import json
+import os
+import tempfile
+import threading
+
+from dejavu.config.settings import INGEST_CHECKPOINT_INTERVAL
+
+
+class JsonManifest:
+    """
+    Entries keyed by absolute file path, persisted as a json file. The file is loaded when the
+    manifest is created and written back every checkpoint_interval changes and by save. Entries
+    may be changed from several threads, so every access is locked.
+    """
+    def __init__(self, path: str, checkpoint_interval: int = INGEST_CHECKPOINT_INTERVAL):
+        """
+        :param path: path of the manifest file, created on the first save if missing.
+        :param checkpoint_interval: number of changes between two saves of the manifest.
+        """
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.entries = {}
+        self.unsaved = 0
+        self.lock = threading.RLock()
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def _key(file_path: str) -> str:
+        return os.path.abspath(file_path)
+
+    def _checkpoint(self) -> None:
+        self.unsaved += 1
+        if self.unsaved >= self.checkpoint_interval:
+            self.save()
+
+    def save(self) -> None:
+        """
+        Writes the manifest, through a temporary file so an interrupted save keeps the previous one.
+        """
+        with self.lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self.entries, f)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            self.unsaved = 0
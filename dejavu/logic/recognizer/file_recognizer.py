@@ -1,5 +1,5 @@
 from time import time
-from typing import Dict
+from typing import Dict, List, Set, Tuple
 
 import dejavu.logic.decoder as decoder
 from dejavu.base_classes.base_recognizer import BaseRecognizer
@@ -11,11 +11,53 @@ class FileRecognizer(BaseRecognizer):
     def __init__(self, dejavu):
         super().__init__(dejavu)
 
-    def recognize_file(self, filename: str) -> Dict[str, any]:
-        channels, self.Fs, _ = decoder.read(filename, self.dejavu.limit)
+    def _decode(self, filename: str, data: bytes = None, start: float = None,
+                duration: float = None) -> Tuple[List[List[int]], int]:
+        # decoded just like the fingerprinted files, see Dejavu.get_file_fingerprints.
+        return decoder.decode(filename, data, duration or self.dejavu.limit,
+                              fs=self.dejavu.fingerprint_params.get("target_fs"),
+                              channel_strategy=self.dejavu.channel_strategy, start=start)
 
-        t = time()
-        matches, fingerprint_time, query_time, align_time = self._recognize(*channels)
+    def recognize_file(self, filename: str, start: float = None, duration: float = None) -> Dict[str, any]:
+        """
+        Recognizes a file, or only a window of it: with `start` and `duration` the decoder seeks to the
+        window, so a spot-check in a long recording costs the window and not the whole file.
+
+        :param filename: path of the audio file.
+        :param start: second of the file where the window starts, None for the start of the file.
+        :param duration: length of the window in seconds, None for the limit set in the configuration.
+        :return: the recognition results.
+        """
+        if start or duration:
+            # windows are neither hashed nor cached, that would mean reading the whole file.
+            channels, self.Fs = self._decode(filename, start=start, duration=duration)
+            t = time()
+            hashes, fingerprint_time = self._fingerprint(*channels)
+            return self._results(hashes, fingerprint_time, t)
+
+        cache = self.dejavu.fingerprint_cache
+
+        # the file is read once, the same bytes are hashed for the cache and decoded.
+        with decoder.map_file(filename) as data:
+            file_hash = decoder.buffer_hash(data) if cache else None
+            hashes = cache.get(file_hash) if cache else None
+
+            if hashes is None:
+                channels, self.Fs = self._decode(filename, data)
+
+        if hashes is None:
+            t = time()
+            hashes, fingerprint_time = self._fingerprint(*channels)
+            if cache:
+                cache.put(file_hash, hashes)
+        else:
+            t = time()
+            fingerprint_time = 0
+
+        return self._results(hashes, fingerprint_time, t)
+
+    def _results(self, hashes: Set[Tuple[int, int]], fingerprint_time: float, t: float) -> Dict[str, any]:
+        matches, query_time, align_time = self._match(hashes)
         t = time() - t
 
         results = {
@@ -28,5 +70,27 @@ class FileRecognizer(BaseRecognizer):
 
         return results
 
-    def recognize(self, filename: str) -> Dict[str, any]:
-        return self.recognize_file(filename)
+    def recognize_files(self, filenames: List[str]) -> List[Dict[str, any]]:
+        """
+        Recognizes several files at once, their channels are fingerprinted together in a single batch.
+        The fingerprint cache is not used, batches are meant for one-off clips like the recorder ones.
+
+        :param filenames: paths of the audio files.
+        :return: a list with the results of every file, in the same order.
+        """
+        clips = [self._decode(filename) for filename in filenames]
+
+        t = time()
+        recognized = self._recognize_batch(clips)
+        t = time() - t
+
+        return [{
+            TOTAL_TIME: t,
+            FINGERPRINT_TIME: fingerprint_time,
+            QUERY_TIME: query_time,
+            ALIGN_TIME: align_time,
+            RESULTS: matches
+        } for matches, fingerprint_time, query_time, align_time in recognized]
+
+    def recognize(self, filename: str, start: float = None, duration: float = None) -> Dict[str, any]:
+        return self.recognize_file(filename, start, duration)
@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from dejavu.config.settings import SONG_CACHE_SIZE
+
+
+class SongCache:
+    """
+    In memory cache of the song rows (name, sha1 and total hashes) recognition results are built with,
+    keyed by song id. It keeps the most recently used max_size songs, the others are loaded again from
+    the database when needed.
+
+    Songs inserted or deleted through Dejavu are invalidated, changes made by other processes are only
+    seen once their songs are evicted or the cache is cleared.
+    """
+    def __init__(self, max_size: int = SONG_CACHE_SIZE):
+        """
+        :param max_size: maximum number of songs kept.
+        """
+        self.max_size = max_size
+        self.songs = OrderedDict()
+
+    def get(self, song_ids: List[int]) -> Tuple[Dict[int, Dict[str, any]], List[int]]:
+        """
+        Looks up several songs.
+
+        :param song_ids: song identifiers.
+        :return: a tuple with a dictionary of the cached songs by id and the list of ids not cached.
+        """
+        found, missing = {}, []
+        for song_id in song_ids:
+            song = self.songs.get(song_id)
+            if song is None:
+                missing.append(song_id)
+            else:
+                self.songs.move_to_end(song_id)
+                found[song_id] = song
+
+        return found, missing
+
+    def put(self, songs: Dict[int, Dict[str, any]]) -> None:
+        """
+        Stores several songs, evicting the least recently used ones if needed.
+
+        :param songs: songs by id.
+        """
+        for song_id, song in songs.items():
+            self.songs[song_id] = song
+            self.songs.move_to_end(song_id)
+
+        while len(self.songs) > self.max_size:
+            self.songs.popitem(last=False)
+
+    def invalidate(self, song_ids: List[int]) -> None:
+        """
+        Removes songs whose rows changed in the database.
+
+        :param song_ids: song identifiers.
+        """
+        for song_id in song_ids:
+            self.songs.pop(song_id, None)
+
+    def clear(self) -> None:
+        """
+        Removes every song.
+        """
+        self.songs.clear()
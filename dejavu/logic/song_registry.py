@@ -0,0 +1,84 @@
+from typing import Dict, List, Set
+
+from dejavu.config.settings import FIELD_FILE_SHA1, FIELD_SONG_ID
+
+
+class SongRegistry:
+    """
+    Fingerprinted songs by the sha1 of their file, to know whether a file was already processed.
+
+    Nothing is read from the database until it is needed: single files are looked up by their sha1
+    (unique index on the songs table), and the whole songs table is only loaded when the full set of
+    hashes is asked for, like when a directory is fingerprinted. Songs inserted or deleted through
+    Dejavu are added and removed as they go, so the table is never loaded twice.
+    """
+    def __init__(self, db):
+        """
+        :param db: database the songs are stored in.
+        """
+        self.db = db
+        # every fingerprinted song, None until the songs table is loaded.
+        self.song_ids = None
+        # songs looked up or added before the songs table is loaded.
+        self.found = {}
+
+    def load(self) -> Dict[str, int]:
+        """
+        Loads every fingerprinted song, the first time only.
+
+        :return: a dictionary with the song ids by file sha1.
+        """
+        if self.song_ids is None:
+            self.song_ids = {song[FIELD_FILE_SHA1]: song[FIELD_SONG_ID] for song in self.db.get_songs()}
+            self.found = {}
+
+        return self.song_ids
+
+    def hashes(self) -> Set[str]:
+        """
+        :return: the sha1 of every fingerprinted file.
+        """
+        return set(self.load())
+
+    def get(self, file_hash: str) -> int:
+        """
+        Looks up the song fingerprinted from a file.
+
+        :param file_hash: sha1 of the file content.
+        :return: the song id, or None if the file was not fingerprinted.
+        """
+        if self.song_ids is not None:
+            return self.song_ids.get(file_hash)
+
+        if file_hash not in self.found:
+            song_id = self.db.get_song_id_by_file_hash(file_hash)
+            if song_id is None:
+                # not kept, the song may be inserted by another process meanwhile.
+                return None
+            self.found[file_hash] = song_id
+
+        return self.found[file_hash]
+
+    def __contains__(self, file_hash: str) -> bool:
+        return self.get(file_hash) is not None
+
+    def add(self, file_hash: str, song_id: int) -> None:
+        """
+        Registers a song just fingerprinted.
+
+        :param file_hash: sha1 of the file content.
+        :param song_id: song identifier.
+        """
+        songs = self.song_ids if self.song_ids is not None else self.found
+        songs[file_hash] = song_id
+
+    def remove(self, song_ids: List[int]) -> None:
+        """
+        Unregisters deleted songs.
+
+        :param song_ids: song identifiers.
+        """
+        song_ids = set(song_ids)
+        for songs in (self.song_ids or {}, self.found):
+            for file_hash in [file_hash for file_hash, song_id in songs.items() if song_id in song_ids]:
+                del songs[file_hash]
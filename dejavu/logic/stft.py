@@ -0,0 +1,83 @@
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft
+
+from dejavu.config.settings import (DEFAULT_FS, DEFAULT_OVERLAP_RATIO,
+                                    DEFAULT_WINDOW_SIZE)
+
+# Number of frames transformed at once, bounds the size of the temporary windowed/complex buffers
+# no matter how long the input is.
+FRAMES_PER_BLOCK = 256
+
+
+@lru_cache(maxsize=8)
+def hann_window(nfft: int) -> Tuple[np.array, float]:
+    """
+    Builds the (symmetric) hanning window used by the STFT together with the psd scale factor
+    that goes with it. Results are cached since the same few window sizes are used all the time.
+
+    :param nfft: window length.
+    :return: a tuple with the float32 window and the sum of its squares.
+    """
+    window = np.hanning(nfft).astype(np.float32)
+    window.setflags(write=False)
+    return window, float((window.astype(np.float64) ** 2).sum())
+
+
+def spectrogram(samples: List[int],
+                Fs: int = DEFAULT_FS,
+                nfft: int = DEFAULT_WINDOW_SIZE,
+                noverlap: int = int(DEFAULT_WINDOW_SIZE * DEFAULT_OVERLAP_RATIO),
+                workers: int = 1,
+                min_bin: int = 0,
+                max_bin: int = None) -> np.array:
+    """
+    Computes the log-scaled power spectral density of a channel, frequencies in rows and time in columns.
+    The scaling is the same one matplotlib.mlab.specgram uses (one sided psd, scaled by frequency and
+    by the window norm, no detrend), followed by 10 * log10 leaving silent bins at zero.
+
+    Frames are strided views over the signal and the output matrix is allocated only once, in float32.
+    A 2-D input is taken as a batch of equally long channels (one per row) transformed together.
+    Only the rows of the [min_bin, max_bin) band are kept, the rest are never squared nor scaled.
+
+    :param samples: channel samples, or a matrix with one channel per row.
+    :param Fs: sampling rate of the samples.
+    :param nfft: length of the FFT window.
+    :param noverlap: number of samples shared by consecutive windows.
+    :param workers: number of threads the FFT is split into, -1 uses every cpu.
+    :param min_bin: first frequency bin kept.
+    :param max_bin: frequency bin after the last one kept, None keeps up to the Nyquist frequency.
+    :return: a float32 matrix of shape (max_bin - min_bin, number of frames), with an extra leading
+     axis for batches.
+    """
+    nbins = nfft // 2 + 1
+    max_bin = nbins if max_bin is None else min(max_bin, nbins)
+    min_bin = min(min_bin, max_bin)
+
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.shape[-1] < nfft:
+        samples = np.pad(samples, [(0, 0)] * (samples.ndim - 1) + [(0, nfft - samples.shape[-1])])
+
+    frames = sliding_window_view(samples, nfft, axis=-1)[..., ::nfft - noverlap, :]
+    window, window_norm = hann_window(nfft)
+
+    arr2D = np.empty(samples.shape[:-1] + (max_bin - min_bin, frames.shape[-2]), dtype=np.float32)
+    for start in range(0, frames.shape[-2], FRAMES_PER_BLOCK):
+        block = fft.rfft(frames[..., start: start + FRAMES_PER_BLOCK, :] * window, axis=-1, workers=workers)
+        block = block[..., min_bin: max_bin]
+        out = np.swapaxes(arr2D[..., start: start + FRAMES_PER_BLOCK], -1, -2)
+        np.square(block.real, out=out)
+        out += np.square(block.imag)
+
+    # one sided density: double every bin but DC (and Nyquist on even windows).
+    doubled = slice(max(1, min_bin) - min_bin, max(0, min(max_bin, nbins if nfft % 2 else nbins - 1) - min_bin))
+    arr2D[..., doubled, :] *= 2
+    arr2D /= Fs * window_norm
+
+    np.log10(arr2D, out=arr2D, where=arr2D != 0)
+    arr2D *= 10
+
+    return arr2D
@@ -0,0 +1,154 @@
+import importlib
+import os
+import struct
+import sys
+import unittest
+from unittest import mock
+
+from dejavu.config.settings import FINGERPRINTS_STAGING_TABLENAME
+from dejavu.logic.fingerprint import fingerprints_array
+
+
+def import_handler(module_name: str, drivers: list):
+    """
+    Imports a database handler, with empty stand-ins for its driver modules when they are not installed:
+    the bulk load only talks to the cursor it is given.
+    """
+    stubs = {}
+    for driver in drivers:
+        try:
+            importlib.import_module(driver)
+        except ImportError:
+            stubs[driver] = mock.MagicMock()
+    with mock.patch.dict(sys.modules, stubs):
+        sys.modules.pop(module_name, None)
+        return importlib.import_module(module_name)
+
+
+mysql_database = import_handler("dejavu.database_handler.mysql_database",
+                                ["mysql", "mysql.connector", "mysql.connector.errors"])
+postgres_database = import_handler("dejavu.database_handler.postgres_database", ["psycopg2", "psycopg2.extras"])
+
+HASHES = {(2**40 + 5, 7), (-3, 0), (123456789012, 4000000), (2**62, 1)}
+
+
+class RecordingCursor:
+    """
+    Cursor keeping the statements it is given, with what the bulk loaders send along them.
+    """
+    def __init__(self):
+        self.statements = []
+        self.loaded_file = None
+        self.copied = None
+
+    def execute(self, query, params=None):
+        self.statements.append((query, params))
+        if query is mysql_database.MySQLDatabase.LOAD_FINGERPRINTS_STAGING:
+            with open(params[0]) as f:
+                self.loaded_file = (params[0], f.read())
+
+    def copy_expert(self, query, file):
+        self.statements.append((query, None))
+        self.copied = file.read()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def database(cls):
+    db = cls.__new__(cls)
+    db.cur = RecordingCursor()
+    db.cursor_options = []
+    db.cursor = lambda **options: db.cursor_options.append(options) or db.cur
+    return db
+
+
+class TestPostgresCopy(unittest.TestCase):
+    def copy(self, hashes) -> bytes:
+        db = database(postgres_database.PostgreSQLDatabase)
+        db.copy_fingerprints(db.cur, fingerprints_array(hashes))
+        self.assertEqual(db.cur.statements, [(db.COPY_FINGERPRINTS_STAGING, None)])
+        return db.cur.copied
+
+    def test_layout(self):
+        payload = self.copy(HASHES)
+
+        # signature, flags and header extension length.
+        self.assertEqual(payload[:11], b"PGCOPY\n\xff\r\n\x00")
+        self.assertEqual(struct.unpack(">ii", payload[11:19]), (0, 0))
+
+        # every tuple: field count, then the length and value of the bigint hash and the int offset.
+        body, trailer = payload[19:-2], payload[-2:]
+        row_size = struct.calcsize(">hiqii")
+        self.assertEqual(len(body), row_size * len(HASHES))
+        rows = [struct.unpack(">hiqii", body[i:i + row_size]) for i in range(0, len(body), row_size)]
+        self.assertEqual(rows, [(2, 8, h, 4, o) for h, o in fingerprints_array(HASHES).tolist()])
+        self.assertEqual({(h, o) for _, _, h, _, o in rows}, HASHES)
+
+        self.assertEqual(struct.unpack(">h", trailer), (-1,))
+
+    def test_no_rows(self):
+        self.assertEqual(self.copy([]), b"PGCOPY\n\xff\r\n\x00" + bytes(8) + b"\xff\xff")
+
+
+class TestMySQLLoad(unittest.TestCase):
+    def test_tab_separated_file(self):
+        db = database(mysql_database.MySQLDatabase)
+        db.copy_fingerprints(db.cur, fingerprints_array(HASHES))
+
+        path, content = db.cur.loaded_file
+        self.assertEqual(db.cur.statements, [(db.LOAD_FINGERPRINTS_STAGING, (path,))])
+        lines = content.splitlines()
+        self.assertEqual(len(lines), len(HASHES))
+        self.assertEqual({tuple(int(value) for value in line.split("\t")) for line in lines}, HASHES)
+        self.assertTrue(content.endswith("\n"))
+        self.assertFalse(os.path.exists(path))
+
+    def test_file_removed_when_load_fails(self):
+        db = database(mysql_database.MySQLDatabase)
+        paths = []
+
+        def fail(query, params=None):
+            paths.append(params[0])
+            raise RuntimeError("local_infile disabled")
+
+        db.cur.execute = fail
+        with self.assertRaises(RuntimeError):
+            db.copy_fingerprints(db.cur, fingerprints_array(HASHES))
+        self.assertFalse(os.path.exists(paths[0]))
+
+
+class TestStagingSequence(unittest.TestCase):
+    def assert_sequence(self, cls, copy_statement):
+        db = database(cls)
+        db.load_hashes(9, HASHES)
+
+        self.assertEqual(db.cursor_options, [cls.BULK_LOAD_OPTIONS])
+        queries = [query for query, _ in db.cur.statements]
+        self.assertEqual(queries, [
+            cls.CREATE_FINGERPRINTS_STAGING_TABLE,
+            cls.TRUNCATE_FINGERPRINTS_STAGING,
+            copy_statement,
+            cls.INSERT_FINGERPRINTS_FROM_STAGING,
+            cls.TRUNCATE_FINGERPRINTS_STAGING,
+        ])
+        self.assertEqual(db.cur.statements[3][1], (9,))
+
+        for query in (cls.CREATE_FINGERPRINTS_STAGING_TABLE, cls.TRUNCATE_FINGERPRINTS_STAGING, copy_statement):
+            self.assertIn(FINGERPRINTS_STAGING_TABLENAME, query)
+        self.assertIn("TEMPORARY", cls.CREATE_FINGERPRINTS_STAGING_TABLE)
+        self.assertIn("SELECT DISTINCT", cls.INSERT_FINGERPRINTS_FROM_STAGING)
+
+    def test_mysql(self):
+        self.assert_sequence(mysql_database.MySQLDatabase, mysql_database.MySQLDatabase.LOAD_FINGERPRINTS_STAGING)
+
+    def test_postgres(self):
+        self.assert_sequence(postgres_database.PostgreSQLDatabase,
+                             postgres_database.PostgreSQLDatabase.COPY_FINGERPRINTS_STAGING)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+from dejavu.base_classes.common_database import CommonDatabase
+
+
+class ScriptedCursor:
+    """
+    Cursor keeping the statements it is given, fetchone answers with the results set for each statement.
+    """
+    def __init__(self, results):
+        self.results = results
+        self.statements = []
+        self.rowcount = -1
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+        self.rowcount = 2 if query == "DELETE_DUPLICATED_SONGS" else -1
+
+    def fetchone(self):
+        return (self.results.get(self.statements[-1], 0),)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class ScriptedDatabase(CommonDatabase):
+    """
+    Database whose statements are their own attribute names.
+    """
+    def __init__(self, **results):
+        super().__init__()
+        self.cur = ScriptedCursor(results)
+
+    def cursor(self, **options):
+        return self.cur
+
+    def __getattr__(self, name):
+        if name.isupper():
+            return name
+        raise AttributeError(name)
+
+    def insert_song(self, song_name, file_hash, total_hashes):
+        pass
+
+    def copy_fingerprints(self, cur, rows):
+        pass
+
+
+class TestSongsFileSha1Index(unittest.TestCase):
+    def test_duplicated_songs_are_reported_not_deleted(self):
+        db = ScriptedDatabase(SELECT_FINGERPRINTS_UNIQUE_INDEX=1, SELECT_SONGS_FILE_SHA1_INDEX=0,
+                              SELECT_NUM_DUPLICATED_SONGS=2)
+        db.setup()
+        self.assertIn("SELECT_NUM_DUPLICATED_SONGS", db.cur.statements)
+        self.assertNotIn("DELETE_DUPLICATED_SONGS", db.cur.statements)
+        self.assertNotIn("CREATE_SONGS_FILE_SHA1_INDEX", db.cur.statements)
+
+    def test_index_created_without_duplicated_songs(self):
+        db = ScriptedDatabase(SELECT_FINGERPRINTS_UNIQUE_INDEX=1, SELECT_SONGS_FILE_SHA1_INDEX=0,
+                              SELECT_NUM_DUPLICATED_SONGS=0)
+        db.setup()
+        self.assertNotIn("DELETE_DUPLICATED_SONGS", db.cur.statements)
+        self.assertEqual(db.cur.statements[-1], "CREATE_SONGS_FILE_SHA1_INDEX")
+
+    def test_index_left_alone_when_present(self):
+        db = ScriptedDatabase(SELECT_FINGERPRINTS_UNIQUE_INDEX=1, SELECT_SONGS_FILE_SHA1_INDEX=1)
+        db.setup()
+        self.assertNotIn("SELECT_NUM_DUPLICATED_SONGS", db.cur.statements)
+        self.assertNotIn("CREATE_SONGS_FILE_SHA1_INDEX", db.cur.statements)
+
+    def test_delete_duplicated_songs(self):
+        db = ScriptedDatabase(SELECT_SONGS_FILE_SHA1_INDEX=0)
+        self.assertEqual(db.delete_duplicated_songs(), 2)
+        self.assertEqual(db.cur.statements, ["DELETE_DUPLICATED_SONGS", "SELECT_SONGS_FILE_SHA1_INDEX",
+                                             "CREATE_SONGS_FILE_SHA1_INDEX"])
+
+    def test_delete_duplicated_songs_again(self):
+        db = ScriptedDatabase(SELECT_SONGS_FILE_SHA1_INDEX=1)
+        db.delete_duplicated_songs()
+        self.assertNotIn("CREATE_SONGS_FILE_SHA1_INDEX", db.cur.statements)
+
+
+if __name__ == "__main__":
+    unittest.main()
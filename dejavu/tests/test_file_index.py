@@ -0,0 +1,43 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from dejavu.logic.file_index import FileIndex
+
+SIGNATURE = {"size": 1, "mtime": 2, "inode": 3}
+
+
+class TestFileIndexCheckpoints(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "index.json")
+
+    def test_saved_every_checkpoint_interval(self):
+        index = FileIndex(self.path, checkpoint_interval=3)
+        for i in range(7):
+            index.update(f"/music/{i}.mp3", SIGNATURE, "AB", i)
+
+        # without a final save, as when the process is killed.
+        self.assertEqual(len(FileIndex(self.path).entries), 6)
+        self.assertEqual(index.unsaved, 1)
+
+    def test_concurrent_updates(self):
+        index = FileIndex(self.path, checkpoint_interval=5)
+
+        def writer(n):
+            for i in range(200):
+                index.update(f"/music/{n}/{i}.mp3", SIGNATURE, "AB", i)
+
+        writers = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+        for thread in writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+
+        self.assertEqual(len(FileIndex(self.path).entries), 800)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from dejavu.logic import fingerprint
+from dejavu.logic.fingerprint import (find_peaks_morphology,
+                                      find_peaks_separable, iter_fingerprints)
+
+
+def spectrogram_like(seed: int, shape=(513, 300)) -> np.ndarray:
+    """
+    Log amplitudes rounded to integers, so neighbors often tie, with silent (zero) regions.
+    """
+    rng = np.random.default_rng(seed)
+    arr2D = np.round(rng.gamma(2.0, 8.0, size=shape)).astype(np.float32)
+    arr2D[:, 40:90] = 0
+    arr2D[100:160, :] = 0
+    arr2D[rng.random(shape) < 0.05] = 0
+    return arr2D
+
+
+def track(seconds: float, fs: int = 44100, seed: int = 0) -> np.ndarray:
+    """
+    Noise with a few tones coming and going, as int16 samples.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * fs)) / fs
+    samples = rng.standard_normal(len(t)) * 1000
+    for freq in (440, 1250, 3300, 7000):
+        samples += 4000 * np.sin(2 * np.pi * freq * t) * (np.sin(2 * np.pi * t * freq / 5000) > 0)
+    return samples.astype(np.int16)
+
+
+class TestPeakDetectors(unittest.TestCase):
+    def test_separable_matches_morphology(self):
+        with mock.patch.object(fingerprint, "CONNECTIVITY_MASK", 2):
+            for seed in range(3):
+                arr2D = spectrogram_like(seed)
+                for amp_min in (-1, 0, 5, 20):
+                    expected = find_peaks_morphology(arr2D, amp_min=amp_min)
+                    freqs, times = find_peaks_separable(arr2D, amp_min=amp_min)
+                    np.testing.assert_array_equal(freqs, expected[0])
+                    np.testing.assert_array_equal(times, expected[1])
+
+    def test_separable_stack_matches_each_spectrogram(self):
+        arrs = np.stack([spectrogram_like(seed, shape=(129, 80)) for seed in range(4)])
+        ids, freqs, times = find_peaks_separable(arrs, amp_min=5)
+        for i, arr2D in enumerate(arrs):
+            expected = find_peaks_separable(arr2D, amp_min=5)
+            np.testing.assert_array_equal(freqs[ids == i], expected[0])
+            np.testing.assert_array_equal(times[ids == i], expected[1])
+
+
+class TestIterFingerprints(unittest.TestCase):
+    def assert_blocks_match_whole(self, samples: np.ndarray, **kwargs):
+        whole = list(iter_fingerprints(samples, block_frames=len(samples), **kwargs))
+        self.assertTrue(whole)
+        for block_frames in (7, 64, 333):
+            with self.subTest(block_frames=block_frames):
+                self.assertEqual(list(iter_fingerprints(samples, block_frames=block_frames, **kwargs)), whole)
+
+    def test_blocks_match_whole_track(self):
+        self.assert_blocks_match_whole(track(6))
+
+    def test_blocks_match_whole_track_with_peaks_per_slice(self):
+        self.assert_blocks_match_whole(track(6, seed=1), peaks_per_slice=3)
+
+    def test_blocks_match_whole_track_with_morphology(self):
+        with mock.patch.object(fingerprint, "PEAK_DETECTOR", "morphology"):
+            self.assert_blocks_match_whole(track(4, seed=2))
+
+    def test_short_track(self):
+        samples = track(0.05)
+        self.assertEqual(list(iter_fingerprints(samples, block_frames=2)),
+                         list(iter_fingerprints(samples, block_frames=len(samples))))
+
+
+if __name__ == "__main__":
+    unittest.main()
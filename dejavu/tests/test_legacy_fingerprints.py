@@ -0,0 +1,32 @@
+import unittest
+from unittest import mock
+
+import dejavu
+from dejavu import Dejavu, LegacyFingerprintsError
+
+
+class TestLegacyFingerprints(unittest.TestCase):
+    def setUp(self):
+        self.db = mock.MagicMock()
+        patcher = mock.patch.object(dejavu, "get_database", return_value=lambda **options: self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_legacy_table_is_refused(self):
+        self.db.has_legacy_fingerprints_table.return_value = True
+        with self.assertRaises(LegacyFingerprintsError):
+            Dejavu({})
+        self.db.insert_hashes.assert_not_called()
+        self.db.return_matches.assert_not_called()
+
+    def test_legacy_table_is_accepted_to_migrate(self):
+        self.db.has_legacy_fingerprints_table.return_value = True
+        self.assertIs(Dejavu({}, migrate=True).db, self.db)
+
+    def test_converted_table(self):
+        self.db.has_legacy_fingerprints_table.return_value = False
+        self.assertIs(Dejavu({}).db, self.db)
+
+
+if __name__ == "__main__":
+    unittest.main()
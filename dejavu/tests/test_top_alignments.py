@@ -0,0 +1,44 @@
+import unittest
+from itertools import groupby
+
+import numpy as np
+
+from dejavu import Dejavu
+
+
+def groupby_alignments(matches, topn):
+    """
+    The sort and groupby loop top_alignments replaces.
+    """
+    sorted_matches = sorted(matches, key=lambda m: (m[0], m[1]))
+    counts = [(*key, len(list(group))) for key, group in groupby(sorted_matches, key=lambda m: (m[0], m[1]))]
+    songs_matches = sorted(
+        [max(list(group), key=lambda g: g[2]) for key, group in groupby(counts, key=lambda count: count[0])],
+        key=lambda count: count[2], reverse=True
+    )
+    return [(song_id, offset) for song_id, offset, _ in songs_matches[0:topn]]
+
+
+class TestTopAlignments(unittest.TestCase):
+    def test_matches_groupby_loop(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            size = rng.integers(1, 400)
+            songs = rng.integers(1, 30)
+            # few distinct offsets so counts tie often, negative ones included.
+            matches = np.column_stack((rng.integers(1, songs + 1, size), rng.integers(-20, 20, size)))
+            for topn in (1, 2, 5, 50):
+                with self.subTest(size=size, topn=topn):
+                    expected = groupby_alignments(matches.tolist(), topn)
+                    self.assertEqual(Dejavu.top_alignments(matches, topn=topn), expected)
+
+    def test_accepts_list_of_tuples(self):
+        matches = [(3, 10), (1, 5), (3, 10), (1, 5), (1, 7), (2, 0)]
+        self.assertEqual(Dejavu.top_alignments(matches, topn=2), [(1, 5), (3, 10)])
+
+    def test_no_matches(self):
+        self.assertEqual(Dejavu.top_alignments(np.empty((0, 2), dtype=np.int64)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,6 +20,16 @@ class FingerprintEngine:
             }
         }
 
+        # reuse fingerprints of files processed before (retries, re-ingestion after emptying the db).
+        cache_dir = os.environ.get('FINGERPRINT_CACHE_DIR', '')
+        if cache_dir:
+            self.config["fingerprint_cache"] = {"directory": cache_dir}
+
+        # manifest of the files already fingerprinted, so folder rescans skip unchanged files after a stat.
+        index_path = os.environ.get('FINGERPRINT_INDEX', '')
+        if index_path:
+            self.config["file_index"] = index_path
+
         self.djv = Dejavu(self.config)
 
     def fingerprint_folder(self, folder_path, extensions=[".mp3"], workers=3):
@@ -42,33 +52,24 @@ class FingerprintEngine:
             raise FileNotFoundError(f"File not found: {file_path}")
         
         abs_path = os.path.abspath(file_path)
-        folder = os.path.dirname(abs_path)
         song_name = os.path.splitext(os.path.basename(file_path))[0]
         print(song_name)
         print(f"[FINGERPRINT] Processing: {abs_path}")
-        print(f"[FINGERPRINT] Processing folder: {folder}")
         print(f"[FINGERPRINT] Fingerprinting file: {file_path}")
-        
-        try:
-            # Try passing song_name explicitly if your version requires it
-            self.djv.fingerprint_directory(folder, [".mp3"], nprocesses=1)
-            print("[FINGERPRINT] Successfully completed on Railway.")
-        except TypeError:
-            # If it still fails with the same error, use the directory method 
-            # pointed at the specific file's folder
-            folder = os.path.dirname(file_path)
-            self.djv.fingerprint_directory(folder, [".mp3"], 1)
+
+        # only this file, the rest of the folder was already fingerprinted by earlier calls.
+        self.djv.fingerprint_file(abs_path, song_name)
         
         print("[FINGERPRINT] Completed.")
             
-    def recognize_file(self, file_path):
+    def recognize_file(self, file_path, start=None, duration=None):
         """
-        Recognize audio fingerprint in a file
+        Recognize audio fingerprint in a file, or in the window of `duration` seconds from `start`
         """
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
 
         print(f"[RECOGNIZE] Recognizing audio from: {file_path}")
-        result = self.djv.recognize(FileRecognizer, file_path)
+        result = self.djv.recognize(FileRecognizer, file_path, start=start, duration=duration)
         print("[RECOGNIZE] Result:", result)
         return result
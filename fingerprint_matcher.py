@@ -1,5 +1,6 @@
 # fingerprint_matcher.py
 from dejavu import Dejavu
+from dejavu.config.settings import RESULTS, SONG_ID
 from dejavu.logic.recognizer.file_recognizer import FileRecognizer
 import mysql.connector
 
@@ -38,3 +39,33 @@ class FingerprintMatcher:
         except Exception as e:
             print(f"[Matcher] ❌ Fingerprint error for {stream_link}: {e}")
             return None
+
+    def recognize_clips(self, clips):
+        """
+        Recognizes the clips of a whole recording cycle at once, all of them are
+        fingerprinted in a single batch. `clips` is a list of (audio_path, stream_link)
+        tuples, the song id found for each one (or None) is returned in the same order.
+        """
+        print(f"[Matcher] 🔍 Checking fingerprints for {len(clips)} clips")
+
+        try:
+            results = FileRecognizer(self.djv).recognize_files([path for path, _ in clips])
+        except Exception as e:
+            print(f"[Matcher] ❌ Batch fingerprint error, checking clips one by one: {e}")
+            return [self.recognize_clip(path, link) for path, link in clips]
+
+        song_ids = []
+        for (audio_path, stream_link), result in zip(clips, results):
+            matches = result.get(RESULTS) if result else None
+
+            if not matches:
+                print(f"[Matcher] ❌ No match found for stream → {stream_link}")
+                song_ids.append(None)
+                continue
+
+            song_id = matches[0][SONG_ID]
+
+            print(f"[Matcher] 🎵 MATCH FOUND → Stream: {stream_link}, Song ID: {song_id}")
+            song_ids.append(song_id)
+
+        return song_ids
@@ -63,11 +63,14 @@ class MultiStreamRecorder:
 
             print("[Recorder] Starting recording cycle...")
 
+            # record every stream at the same time, matching waits for the whole cycle
+            # so all the clips are fingerprinted together in a single batch.
+            recorded = []
             threads = []
             for idx, stream in enumerate(streams):
                 t = threading.Thread(
                     target=self._record_single,
-                    args=(idx, stream)
+                    args=(idx, stream, recorded)
                 )
                 t.start()
                 threads.append(t)
@@ -75,6 +78,8 @@ class MultiStreamRecorder:
             for t in threads:
                 t.join()
 
+            self._match_recorded(recorded)
+
             print(f"[Recorder] Sleeping {self.wait_seconds} sec...")
             time.sleep(self.wait_seconds)
 
@@ -140,7 +145,40 @@ class MultiStreamRecorder:
             print(f"[DB] ❌ Failed to log audio_played: {e}")
 
 
-    def _record_single(self, idx, url):
+    def _match_recorded(self, recorded):
+        if not recorded:
+            return
+
+        try:
+            # --- MATCHING & LOGGING ---
+            song_ids = self.matcher.recognize_clips(recorded)
+
+            for (path, url), song_id in zip(recorded, song_ids):
+                if song_id:
+                    print(f"[Recorder] 🎯 MATCH → Stream: {url}, Song ID: {song_id}")
+                    self.log_audio_played(song_id, url)
+                else:
+                    print(f"[Recorder] ❌ No match for stream: {url}")
+            # --------------------------
+
+        except Exception as e:
+            print(f"[Recorder] ERROR matching {len(recorded)} clips: {e}")
+
+        finally:
+            # --- FILE DELETION LOGIC (Cleanup) ---
+            for path, _ in recorded:
+                self._delete_clip(path)
+            # -------------------------------------
+
+    def _delete_clip(self, path):
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+                print(f"[Recorder] 🗑️ DELETED CLIP: {path}")
+            except Exception as del_e:
+                print(f"[Recorder] ⚠️ Failed to delete file {path}: {del_e}")
+
+    def _record_single(self, idx, url, recorded):
         #matcher = self._get_matcher()
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"radio_{idx}_{timestamp}.wav"
@@ -167,35 +205,20 @@ class MultiStreamRecorder:
             
             if self.audio_has_duration(path):
                 print(f"[Recorder] ✅ Audio OK: {path}")
-                
-                # --- MATCHING & LOGGING ---
-                song_id = self.matcher.recognize_clip(path, url)
 
-                if song_id:
-                    print(f"[Recorder] 🎯 MATCH → Stream: {url}, Song ID: {song_id}")
-                    self.log_audio_played(song_id, url)
-                else:
-                    print(f"[Recorder] ❌ No match for stream: {url}")
-                    #self.log_audio_played(song_id, url)
-                # --------------------------
+                # matched (and deleted) with the rest of the cycle, list.append is thread safe.
+                recorded.append((path, url))
+                return
 
-            else:
-                print(f"[Recorder] ❌ EMPTY CLIP: {path}")
-                self.log_error_to_db(url, "EMPTY CLIP")
+            print(f"[Recorder] ❌ EMPTY CLIP: {path}")
+            self.log_error_to_db(url, "EMPTY CLIP")
             
             # --- FILE DELETION LOGIC (Cleanup) ---
-            if os.path.exists(path):
-                os.remove(path)
-                print(f"[Recorder] 🗑️ DELETED CLIP: {path}")
+            self._delete_clip(path)
             # -------------------------------------
 
         except Exception as e:
             print(f"[Recorder] ERROR {url}: {e}")
             # --- FILE DELETION LOGIC (Cleanup after error) ---
-            if os.path.exists(path):
-                try:
-                    os.remove(path)
-                    print(f"[Recorder] 🗑️ DELETED CLIP after ERROR: {path}")
-                except Exception as del_e:
-                    print(f"[Recorder] ⚠️ Failed to delete file {path} after error: {del_e}")
+            self._delete_clip(path)
             # -------------------------------------------------
@@ -0,0 +1,468 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+import tempfile
+import tracemalloc
+import wave
+from collections import Counter
+from itertools import groupby
+from multiprocessing.pool import ThreadPool
+from operator import itemgetter
+from time import time
+from typing import Callable, List, Tuple
+
+import matplotlib.mlab as mlab
+import numpy as np
+
+import dejavu.logic.decoder as decoder
+from dejavu import Dejavu
+from dejavu.config.settings import (DEFAULT_AMP_MIN, DEFAULT_BLOCK_FRAMES,
+                                    DEFAULT_FAN_VALUE, DEFAULT_FS,
+                                    DEFAULT_OVERLAP_RATIO,
+                                    FINGERPRINT_DELTA_BITS,
+                                    FINGERPRINT_FREQ_BITS,
+                                    MAX_HASH_TIME_DELTA, MIN_HASH_TIME_DELTA,
+                                    PEAK_NEIGHBORHOOD_SIZE)
+from dejavu.logic.fingerprint import (fft_window, find_peaks,
+                                      find_peaks_morphology,
+                                      find_peaks_separable, fingerprint,
+                                      fingerprint_batch, fingerprints_array,
+                                      freq_band, generate_hashes,
+                                      get_2D_peaks, get_fingerprint_profile,
+                                      iter_fingerprints)
+from dejavu.logic.stft import spectrogram
+
+# Extensions looked for when a folder of audio files is given.
+AUDIO_EXTENSIONS = ["mp3", "wav", "flac", "ogg", "m4a"]
+
+
+def timeit(func: Callable, *args, repeat: int = 3, **kwargs) -> Tuple[float, any]:
+    """
+    Runs func `repeat` times and returns the best wall time together with the last result.
+    """
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        t = time()
+        result = func(*args, **kwargs)
+        best = min(best, time() - t)
+    return best, result
+
+
+def report(name: str, baseline: float, candidate: float) -> None:
+    print(f"{name}: baseline {baseline:.4f}s, candidate {candidate:.4f}s, speedup x{baseline / candidate:.1f}")
+
+
+def synthetic_song(seconds: int, Fs: int = DEFAULT_FS, bpm: int = 120, seed: int = 0) -> np.array:
+    """
+    Builds a mono int16 track out of a repeated 4-bar random melody with harmonics and some noise,
+    which gives repeating landmarks like real music does.
+    """
+    rng = np.random.default_rng(seed)
+    beat = int(Fs * 60 / bpm)
+    notes = 110 * 2 ** (rng.integers(0, 48, 16) / 12)
+
+    t = np.arange(beat) / Fs
+    envelope = np.exp(-3 * t)
+    bars = np.concatenate([
+        envelope * sum(np.sin(2 * np.pi * note * harmonic * t) / harmonic for harmonic in (1, 2, 3))
+        for note in notes
+    ])
+
+    samples = np.resize(bars, seconds * Fs)
+    samples += 0.05 * rng.standard_normal(len(samples))
+    return (samples / np.abs(samples).max() * 20000).astype(np.int16)
+
+
+def mlab_spectrogram(samples: np.array, nfft: int = 2048) -> np.array:
+    """
+    Log spectrogram computed through matplotlib.mlab.specgram, as fingerprint did before having its own STFT.
+    """
+    arr2D = mlab.specgram(samples, NFFT=nfft, Fs=DEFAULT_FS, window=mlab.window_hanning,
+                          noverlap=int(nfft * DEFAULT_OVERLAP_RATIO))[0]
+    return 10 * np.log10(arr2D, out=np.zeros_like(arr2D), where=(arr2D != 0))
+
+
+def song_peaks(seconds: int, nfft: int = 2048) -> List[Tuple[int, int]]:
+    """
+    Finds the spectrogram peaks of a synthetic song the same way fingerprint does.
+    """
+    arr2D = spectrogram(synthetic_song(seconds), Fs=DEFAULT_FS, nfft=nfft, noverlap=int(nfft * DEFAULT_OVERLAP_RATIO))
+    return get_2D_peaks(arr2D)
+
+
+# Number of hex characters kept from the sha1 by the legacy fingerprints.
+FINGERPRINT_REDUCTION = 20
+
+
+def generate_hashes_loop(peaks: List[Tuple[int, int]], fan_value: int = DEFAULT_FAN_VALUE) -> List[Tuple[str, int]]:
+    """
+    Pure python pairing loop and sha1 fingerprints generate_hashes used before being vectorized and packed,
+    kept as the benchmark baseline.
+    """
+    peaks = sorted(peaks, key=itemgetter(1))
+
+    hashes = []
+    for i in range(len(peaks)):
+        for j in range(1, fan_value):
+            if (i + j) < len(peaks):
+                freq1, t1 = peaks[i]
+                freq2, t2 = peaks[i + j]
+                t_delta = t2 - t1
+
+                if MIN_HASH_TIME_DELTA <= t_delta <= MAX_HASH_TIME_DELTA:
+                    h = hashlib.sha1(f"{str(freq1)}|{str(freq2)}|{str(t_delta)}".encode('utf-8'))
+                    hashes.append((h.hexdigest()[0:FINGERPRINT_REDUCTION], t1))
+
+    return hashes
+
+
+def unpack_hashes(hashes: List[Tuple[int, int]]) -> List[Tuple[str, int]]:
+    """
+    Turns packed fingerprints back into the legacy sha1 ones so both implementations can be compared.
+    """
+    freq_mask, delta_mask = (1 << FINGERPRINT_FREQ_BITS) - 1, (1 << FINGERPRINT_DELTA_BITS) - 1
+
+    legacy = []
+    for hsh, offset in hashes:
+        freq1 = hsh >> (FINGERPRINT_FREQ_BITS + FINGERPRINT_DELTA_BITS)
+        freq2 = (hsh >> FINGERPRINT_DELTA_BITS) & freq_mask
+        t_delta = (hsh & delta_mask) + MIN_HASH_TIME_DELTA
+        h = hashlib.sha1(f"{freq1}|{freq2}|{t_delta}".encode('utf-8'))
+        legacy.append((h.hexdigest()[0:FINGERPRINT_REDUCTION], offset))
+
+    return legacy
+
+
+def bench_hashes(seconds: List[int], repeat: int) -> None:
+    for secs in seconds:
+        peaks = song_peaks(secs)
+
+        baseline, expected = timeit(generate_hashes_loop, peaks, repeat=repeat)
+        candidate, hashes = timeit(generate_hashes, peaks, repeat=repeat)
+
+        assert set(expected) == set(unpack_hashes(hashes)), "vectorized hashes differ from the loop"
+        report(f"generate_hashes {secs}s ({len(peaks)} peaks, {len(hashes)} hashes)", baseline, candidate)
+
+
+def bench_spectrogram(seconds: List[int], repeat: int, nfft: int = 2048) -> None:
+    for secs in seconds:
+        samples = synthetic_song(secs)
+
+        baseline, expected = timeit(mlab_spectrogram, samples, nfft, repeat=repeat)
+        candidate, arr2D = timeit(spectrogram, samples, Fs=DEFAULT_FS, nfft=nfft,
+                                  noverlap=int(nfft * DEFAULT_OVERLAP_RATIO), repeat=repeat)
+
+        assert set(get_2D_peaks(expected)) == set(get_2D_peaks(arr2D)), "spectrogram peaks differ from mlab's"
+        report(f"spectrogram {secs}s ({arr2D.shape[0]}x{arr2D.shape[1]})", baseline, candidate)
+
+
+def bench_streaming(seconds: List[int], repeat: int) -> None:
+    for secs in seconds:
+        samples = synthetic_song(secs)
+
+        def peak_memory(block_frames: int) -> Tuple[int, List[Tuple[int, int]]]:
+            tracemalloc.start()
+            hashes = list(iter_fingerprints(samples, block_frames=block_frames))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak, hashes
+
+        whole_memory, expected = peak_memory(sys.maxsize)
+        block_memory, hashes = peak_memory(DEFAULT_BLOCK_FRAMES)
+        assert expected == hashes, "block-wise fingerprints differ from the whole spectrogram ones"
+
+        baseline, _ = timeit(lambda: list(iter_fingerprints(samples, block_frames=sys.maxsize)), repeat=repeat)
+        candidate, _ = timeit(lambda: list(iter_fingerprints(samples)), repeat=repeat)
+        report(f"streaming {secs}s (peak memory {whole_memory / 2**20:.1f}MB -> {block_memory / 2**20:.1f}MB)",
+               baseline, candidate)
+
+
+def bench_peaks(seconds: List[int], repeat: int, nfft: int = 2048) -> None:
+    for secs in seconds:
+        arr2D = spectrogram(synthetic_song(secs), Fs=DEFAULT_FS, nfft=nfft, noverlap=int(nfft * DEFAULT_OVERLAP_RATIO))
+
+        for amp_min in (DEFAULT_AMP_MIN, -1):
+            baseline, expected = timeit(find_peaks_morphology, arr2D, amp_min=amp_min, repeat=repeat)
+            candidate, peaks = timeit(find_peaks_separable, arr2D, amp_min=amp_min, repeat=repeat)
+
+            assert all(np.array_equal(e, p) for e, p in zip(expected, peaks)), "separable peaks differ"
+            report(f"peaks {secs}s amp_min={amp_min} ({arr2D.shape[0]}x{arr2D.shape[1]}, {len(peaks[0])} peaks)",
+                   baseline, candidate)
+
+
+def stereo_corpus(seconds: int, src: str = None, nsongs: int = 4) -> List[Tuple[List[np.array], int]]:
+    """
+    Decodes every audio file in src, or builds a few synthetic stereo songs whose channels share most
+    of their content, like a real stereo mix does.
+    """
+    if src:
+        return [decoder.read(filename, seconds)[:2] for filename, _ in decoder.find_files(src, AUDIO_EXTENSIONS)]
+
+    corpus = []
+    for seed in range(nsongs):
+        left, other = synthetic_song(seconds, seed=2 * seed), synthetic_song(seconds, seed=2 * seed + 1)
+        right = (0.8 * left + 0.2 * other).astype(np.int16)
+        corpus.append(([left, right], DEFAULT_FS))
+    return corpus
+
+
+def bench_channels(seconds: List[int], repeat: int, src: str = None, clips: int = 5, clip_seconds: int = 5,
+                   seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    for secs in seconds:
+        corpus = stereo_corpus(secs, src)
+
+        # noisy clips taken at random positions of every song, recognized with each strategy.
+        queries = []
+        for song_id, (channels, fs) in enumerate(corpus):
+            for start in rng.integers(0, max(1, len(channels[0]) - clip_seconds * fs), clips):
+                clip = [np.asarray(c[start: start + clip_seconds * fs], dtype=np.float32) for c in channels]
+                queries.append((song_id, [c + rng.normal(0, c.std() / 2, len(c)) for c in clip], fs))
+
+        for strategy in ("all", "mix", "left"):
+            index, nhashes = {}, 0
+            t = time()
+            for song_id, (channels, fs) in enumerate(corpus):
+                hashes = set()
+                for channel in decoder.select_channels(channels, strategy):
+                    hashes.update(iter_fingerprints(channel, Fs=fs))
+                for hsh, offset in hashes:
+                    index.setdefault(hsh, []).append((song_id, offset))
+                nhashes += len(hashes)
+            ingest_time = time() - t
+
+            correct = 0
+            t = time()
+            for song_id, channels, fs in queries:
+                hashes = set()
+                for channel in decoder.select_channels(channels, strategy):
+                    hashes.update(iter_fingerprints(channel, Fs=fs))
+                votes = Counter((sid, offset - sampled_offset) for hsh, sampled_offset in hashes
+                                for sid, offset in index.get(hsh, []))
+                correct += bool(votes) and votes.most_common(1)[0][0][0] == song_id
+            query_time = time() - t
+
+            print(f"channels {strategy} {secs}s: ingest {ingest_time:.2f}s ({nhashes} hashes), "
+                  f"recognition {query_time:.2f}s, accuracy {correct}/{len(queries)}")
+
+
+def bench_batch(stations: List[int], repeat: int, clip_seconds: int = 12) -> None:
+    for nstations in stations:
+        clips = [synthetic_song(clip_seconds, seed=seed) for seed in range(nstations)]
+
+        # the recorder used to fingerprint every clip on its own thread.
+        def threaded() -> List[List[Tuple[int, int]]]:
+            with ThreadPool(nstations) as pool:
+                return pool.map(fingerprint, clips)
+
+        baseline, expected = timeit(threaded, repeat=repeat)
+        candidate, hashes = timeit(fingerprint_batch, clips, repeat=repeat)
+
+        assert expected == hashes, "batched fingerprints differ from the per clip ones"
+
+        tracemalloc.start()
+        fingerprint_batch(clips)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        report(f"batch {nstations} clips of {clip_seconds}s (peak memory {peak / 2**20:.1f}MB)", baseline, candidate)
+
+
+def bench_band(seconds: List[int], repeat: int, profile: str = "band_limited") -> None:
+    params = get_fingerprint_profile(profile)
+    nfft, hop = fft_window()
+    min_bin, max_bin, freq_bits = freq_band(nfft, DEFAULT_FS, params.get("min_freq"), params.get("max_freq"))
+
+    for secs in seconds:
+        samples = synthetic_song(secs)
+
+        # away from the band edges, peaks are the same ones the full spectrogram gives.
+        full = spectrogram(samples, nfft=nfft, noverlap=nfft - hop)
+        band = spectrogram(samples, nfft=nfft, noverlap=nfft - hop, min_bin=min_bin, max_bin=max_bin)
+        inner = slice(min_bin + PEAK_NEIGHBORHOOD_SIZE, max_bin - PEAK_NEIGHBORHOOD_SIZE)
+        expected = {(f, t) for f, t in zip(*find_peaks(full)) if inner.start <= f < inner.stop}
+        peaks = {(f + min_bin, t) for f, t in zip(*find_peaks(band)) if inner.start <= f + min_bin < inner.stop}
+        assert expected == peaks, "band limited peaks differ from the full spectrogram ones"
+
+        baseline, _ = timeit(fingerprint, samples, repeat=repeat)
+        candidate, hashes = timeit(fingerprint, samples, repeat=repeat, **params)
+        report(f"band {secs}s ({full.shape[0]} -> {band.shape[0]} bins, {len(hashes)} hashes of "
+               f"{2 * freq_bits + FINGERPRINT_DELTA_BITS} bits)", baseline, candidate)
+
+
+def bench_decode(seconds: List[int], repeat: int, src: str = None, song_seconds: int = 300) -> None:
+    if not decoder.ffmpeg_available():
+        sys.exit("ffmpeg and ffprobe are needed for the decode benchmark.")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if src:
+            filenames = [filename for filename, _ in decoder.find_files(src, AUDIO_EXTENSIONS)]
+        else:
+            filenames = [os.path.join(tmp, "song.wav")]
+            with wave.open(filenames[0], "wb") as song:
+                song.setnchannels(2)
+                song.setsampwidth(2)
+                song.setframerate(DEFAULT_FS)
+                song.writeframes(np.stack([synthetic_song(song_seconds, seed=seed) for seed in (0, 1)], 1).tobytes())
+
+        for limit in seconds:
+            def read_all(read: Callable) -> List[Tuple[List[np.array], int]]:
+                return [read(filename, limit) for filename in filenames]
+
+            baseline, expected = timeit(read_all, decoder.read_pydub, repeat=repeat)
+            candidate, decoded = timeit(read_all, decoder.read_ffmpeg, repeat=repeat)
+
+            for (expected_channels, expected_fs), (channels, fs) in zip(expected, decoded):
+                assert expected_fs == fs and len(expected_channels) == len(channels), "decoded formats differ"
+                # lossy formats may differ on the last frame boundaries, compare the common length.
+                length = min(len(expected_channels[0]), len(channels[0]))
+                assert abs(len(expected_channels[0]) - len(channels[0])) <= fs // 10, "decoded lengths differ"
+                if not src:
+                    assert all(np.array_equal(e[:length], c[:length]) for e, c in zip(expected_channels, channels)), \
+                        "decoded samples differ"
+
+            report(f"decode limit {limit}s ({len(filenames)} files)", baseline, candidate)
+
+            wav_filenames = [filename for filename in filenames if decoder.wav_header(filename)]
+            if wav_filenames:
+                def read_wavs(read: Callable) -> List[Tuple[List[np.array], int]]:
+                    return [read(filename, limit) for filename in wav_filenames]
+
+                baseline, expected = timeit(read_wavs, decoder.read_ffmpeg, repeat=repeat)
+                candidate, mapped = timeit(read_wavs, decoder.read_wav, repeat=repeat)
+                for (expected_channels, expected_fs), (channels, fs) in zip(expected, mapped):
+                    assert expected_fs == fs and all(np.array_equal(e, c)
+                                                     for e, c in zip(expected_channels, channels)), \
+                        "memory mapped samples differ"
+
+                report(f"wav limit {limit}s ({len(wav_filenames)} files)", baseline, candidate)
+
+
+def align_matches_loop(matches: List[Tuple[int, int]], topn: int = 2) -> List[Tuple[int, int]]:
+    """
+    Sort and groupby offset counting align_matches used before being vectorized, kept as the benchmark baseline.
+    """
+    sorted_matches = sorted(matches, key=lambda m: (m[0], m[1]))
+    counts = [(*key, len(list(group))) for key, group in groupby(sorted_matches, key=lambda m: (m[0], m[1]))]
+    songs_matches = sorted(
+        [max(list(group), key=lambda g: g[2]) for key, group in groupby(counts, key=lambda count: count[0])],
+        key=lambda count: count[2], reverse=True
+    )
+    return [(song_id, offset) for song_id, offset, _ in songs_matches[0:topn]]
+
+
+def bench_align(seconds: List[int], repeat: int, nsongs: int = 1000, matches_per_second: int = 20000) -> None:
+    rng = np.random.default_rng(0)
+    for secs in seconds:
+        # popular hashes match all over the library, a few hundred per second align on the right song.
+        nmatches = secs * matches_per_second
+        noise = np.stack([rng.integers(1, nsongs, nmatches), rng.integers(-1000, 20000, nmatches)], 1)
+        aligned = np.tile([nsongs, 4242], (secs * 200, 1))
+        matches = np.concatenate([noise, aligned])
+
+        baseline, expected = timeit(align_matches_loop, list(map(tuple, matches.tolist())), repeat=repeat)
+        candidate, aligned = timeit(Dejavu.top_alignments, matches, repeat=repeat)
+
+        assert expected == aligned, "vectorized alignment differs from the loop"
+        report(f"align_matches {secs}s ({len(matches)} matches)", baseline, candidate)
+
+
+def bench_transfer(seconds: List[int], repeat: int, song_id: int = 1) -> None:
+    for secs in seconds:
+        fingerprints = set(fingerprint(synthetic_song(secs)))
+
+        # what the parent of the fingerprinting pool does with a worker result: unpickle it and build
+        # the insert rows out of it.
+        def receive(payload: bytes) -> List[Tuple[int, int, int]]:
+            hashes = pickle.loads(payload)
+            if isinstance(hashes, set):
+                return [(song_id, int(hsh), int(offset)) for hsh, offset in hashes]
+            return [(song_id, hsh, offset) for hsh, offset in hashes.tolist()]
+
+        as_set = pickle.dumps(fingerprints, protocol=pickle.HIGHEST_PROTOCOL)
+        as_array = pickle.dumps(fingerprints_array(fingerprints), protocol=pickle.HIGHEST_PROTOCOL)
+
+        baseline, expected = timeit(receive, as_set, repeat=repeat)
+        candidate, rows = timeit(receive, as_array, repeat=repeat)
+
+        assert set(expected) == set(rows), "rows built from the array differ from the set ones"
+        report(f"transfer {secs}s ({len(fingerprints)} hashes, {len(as_set) / 2**20:.1f}MB -> "
+               f"{len(as_array) / 2**20:.1f}MB pickled)", baseline, candidate)
+
+
+def bench_load(seconds: List[int], repeat: int, config_path: str) -> None:
+    if config_path is None:
+        sys.exit("The load benchmark stores fingerprints in a database, give its configuration with --config.")
+
+    with open(config_path) as f:
+        db = Dejavu(json.load(f)).db
+
+    for secs in seconds:
+        fingerprints = fingerprints_array(fingerprint(synthetic_song(secs)))
+        song_ids = []
+        try:
+            # every run stores the fingerprints of a new song, so both paths insert the same amount of rows.
+            song_ids.extend(db.insert_song(f"bench_load_{secs}s", os.urandom(20).hex(), len(fingerprints))
+                            for _ in range(2 * repeat))
+            inserts, loads = iter(song_ids[:repeat]), iter(song_ids[repeat:])
+
+            before = db.get_num_fingerprints()
+            baseline, _ = timeit(lambda: db.insert_hashes(next(inserts), fingerprints), repeat=repeat)
+            inserted = db.get_num_fingerprints()
+            candidate, _ = timeit(lambda: db.load_hashes(next(loads), fingerprints), repeat=repeat)
+            loaded = db.get_num_fingerprints()
+
+            assert inserted - before == loaded - inserted == repeat * len(fingerprints), \
+                "bulk load stored a different number of fingerprints"
+            db.load_hashes(song_ids[-1], fingerprints)
+            assert db.get_num_fingerprints() == loaded, "bulk load stored duplicated fingerprints"
+        finally:
+            db.delete_songs_by_id(song_ids)
+
+        report(f"load {secs}s ({len(fingerprints)} hashes, {db.type})", baseline, candidate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro benchmarks for the dejavu fingerprinting pipeline. '
+                                                 'Usage: %(prog)s [options] BENCHMARK')
+    parser.add_argument("-sec", "--seconds", nargs="+", default=[15, 300], type=int,
+                        help='Audio lengths (in seconds) to benchmark.')
+    parser.add_argument("-r", "--repeat", action="store", default=3, type=int,
+                        help='Number of runs per measure, the best one is reported.')
+    parser.add_argument("-src", "--source", action="store", default=None,
+                        help='Folder of audio files used instead of synthetic songs, when the benchmark supports it.')
+    parser.add_argument("-c", "--config", action="store", default=None,
+                        help='Dejavu configuration file of the database used by the load benchmark.')
+    parser.add_argument("-st", "--stations", nargs="+", default=[10, 50], type=int,
+                        help='Number of clips recognized per recording cycle, for the batch benchmark.')
+    parser.add_argument("benchmark", help='Benchmark to run.',
+                        choices=["align", "band", "batch", "channels", "decode", "hashes", "load", "peaks",
+                                 "spectrogram", "streaming", "transfer"])
+
+    args = parser.parse_args()
+
+    if args.benchmark == "align":
+        bench_align(args.seconds, args.repeat)
+    elif args.benchmark == "band":
+        bench_band(args.seconds, args.repeat)
+    elif args.benchmark == "batch":
+        bench_batch(args.stations, args.repeat)
+    elif args.benchmark == "channels":
+        bench_channels(args.seconds, args.repeat, args.source)
+    elif args.benchmark == "decode":
+        bench_decode(args.seconds, args.repeat, args.source)
+    elif args.benchmark == "hashes":
+        bench_hashes(args.seconds, args.repeat)
+    elif args.benchmark == "load":
+        bench_load(args.seconds, args.repeat, args.config)
+    elif args.benchmark == "peaks":
+        bench_peaks(args.seconds, args.repeat)
+    elif args.benchmark == "spectrogram":
+        bench_spectrogram(args.seconds, args.repeat)
+    elif args.benchmark == "streaming":
+        bench_streaming(args.seconds, args.repeat)
+    elif args.benchmark == "transfer":
+        bench_transfer(args.seconds, args.repeat)